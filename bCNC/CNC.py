@@ -3,9 +3,12 @@
 # Author: vvlachoudis@gmail.com
 # Date: 24-Aug-2014
 
+import copy
+import itertools
 import math
 import os
 import re
+import time
 import types
 
 import undo
@@ -19,12 +22,25 @@ from bmath import (
     Matrix,
     Vector,
 )
-from bpath import Path, Segment
+from bpath import CompactPath, Path, Segment, offsetContours
 from bstl import Binary_STL_Writer
+import polyoffset
+import tour
 from dxf import DXF
 from svgcode import SVGcode
 from Helpers import to_zip
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
 IDPAT = re.compile(r".*\bid:\s*(.*?)\)")
 PARENPAT = re.compile(r"(\(.*?\))")
 SEMIPAT = re.compile(r"(;.*)")
@@ -32,6 +48,7 @@ OPPAT = re.compile(r"(.*)\[(.*)\]")
 CMDPAT = re.compile(r"([A-Za-z]+)")
 BLOCKPAT = re.compile(r"^\(Block-([A-Za-z]+):\s*(.*)\)")
 AUXPAT = re.compile(r"^(%[A-Za-z0-9]+)\b *(.*)$")
+PLAINPAT = re.compile(r"[()\[\]=;]")
 
 STOP = 0
 SKIP = 1
@@ -100,6 +117,27 @@ MODAL_MODES = {
 ERROR_HANDLING = {}
 TOLERANCE = 1e-7
 MAXINT = 1000000000  # python3 doesn't have maxint
+AUTOLEVEL_CHUNK = 5000  # motions to autolevel at once while compiling
+RESUME_CHECKPOINT = 2000  # lines between the saved interpreter states
+RESUME_DWELL = 3.0  # s, wait for the spindle when resuming a program
+POCKET_MAXDEPTH = 10000  # maximum pocket rings
+POCKET_PARALLEL = 4  # contours of a ring to offset them in a process pool
+POCKET_SEGMENTS = 2000  # minimum segments of a ring for the process pool
+
+# Offset methods of the profile and the pocket
+OFFSET_PATH = "path"  # every path offset on its own with Path.offsetClean
+OFFSET_POLYGON = "polygon"  # the paths of a block as one area, polyoffset
+
+# Probe surface interpolation methods
+PROBE_BILINEAR = 0
+PROBE_BICUBIC = 1
+PROBE_SPLINE = 2
+SPLINE_REFINE = 4  # resampling of the thin plate spline per probe cell
+ADAPTIVE_COARSE = 4  # initial spacing in grid steps of the adaptive scan
+ADAPTIVE_TIMEOUT = 120.0  # s, waiting the result of a probe
+
+# Bicubic coefficients from the values and derivatives on the cell corners
+BICUBIC = ((1, 0, 0, 0), (0, 0, 1, 0), (-3, 3, -2, -1), (2, -2, 1, 1))
 
 
 # -----------------------------------------------------------------------------
@@ -139,6 +177,9 @@ class Probe:
         self.xn = 5
         self.yn = 5
 
+        self.method = PROBE_BILINEAR
+        self._surface = None  # cached coefficients of the surface
+
         self.points = []  # probe points
         self.matrix = []  # 2D matrix with Z coordinates
         self.zeroed = False  # if probe was zeroed at any location
@@ -149,6 +190,7 @@ class Probe:
     def clear(self):
         del self.points[:]
         del self.matrix[:]
+        self._surface = None
         self.zeroed = False
         self.start = False
         self.saved = False
@@ -159,6 +201,7 @@ class Probe:
 
     # ----------------------------------------------------------------------
     def makeMatrix(self):
+        self._surface = None
         del self.matrix[:]
         for j in range(self.yn):
             self.matrix.append([0.0] * (self.xn))
@@ -254,11 +297,13 @@ class Probe:
     # Return step
     # ----------------------------------------------------------------------
     def xstep(self):
+        self._surface = None
         self._xstep = (self.xmax - self.xmin) / float(self.xn - 1)
         return self._xstep
 
     # ----------------------------------------------------------------------
     def ystep(self):
+        self._surface = None
         self._ystep = (self.ymax - self.ymin) / float(self.yn - 1)
         return self._ystep
 
@@ -305,6 +350,288 @@ class Probe:
         lines.append(f"G0X{self.xmin:.4f}Y{self.ymin:.4f}")
         return lines
 
+    # ----------------------------------------------------------------------
+    # Adaptive scan for autoleveling. Generator producing the lines while
+    # running: it starts with a coarse grid and refines only the cells
+    # where the probed points deviate more than tolerance from the plane
+    # fitted on the cell neighborhood. Between neighboring points the
+    # probe retracts only clearance above the points around, when the
+    # move stays over cells already refined within the tolerance, instead
+    # of going up to zmax.
+    # Yields None while waiting for the result of the last probe. The scan
+    # ends with an error if the probe fails, the probing is cleared or no
+    # result arrives in time.
+    # The nodes not probed are interpolated from their cell at the end.
+    # ----------------------------------------------------------------------
+    def scanAdaptive(self, tolerance, clearance):
+        self.clear()
+        self.start = True
+        self.makeMatrix()
+        self.xstep()
+        self.ystep()
+        probed = {}  # (i,j): z
+        known = {}  # (i,j): highest corner of the final cell over unit cell
+        pending = {}  # (i,j): cell being refined over unit cell
+
+        yield f"G0Z{CNC.vars['safe']:.4f}"
+        yield f"G0X{self.xmin:.4f}Y{self.ymin:.4f}"
+
+        cells = [
+            (i0, j0, i1, j1)
+            for i0, i1 in Probe._coarse(self.xn)
+            for j0, j1 in Probe._coarse(self.yn)
+        ]
+        nodes = set()
+        for i0, j0, i1, j1 in cells:
+            nodes.update(((i0, j0), (i1, j0), (i0, j1), (i1, j1)))
+
+        last = None
+        leafs = []
+        while nodes:
+            for i0, j0, i1, j1 in cells:
+                for i in range(i0, i1):
+                    for j in range(j0, j1):
+                        pending[i, j] = (i0, j0, i1, j1)
+
+            # serpentine order
+            nodes = sorted(
+                nodes, key=lambda n: (n[1], -n[0] if n[1] % 2 else n[0]))
+            for i, j in nodes:
+                x = self.xmin + self._xstep * i
+                y = self.ymin + self._ystep * j
+                z = self.zmax
+                if last is not None:
+                    # retract above the points probed around
+                    z = self._retract(probed, known, pending, last, (i, j))
+                    z = min(z + clearance, self.zmax)
+                n = len(self.points)
+                yield f"G0Z{z:.4f}"
+                yield f"G0X{x:.4f}Y{y:.4f}"
+                yield "%wait"  # added for smoothie
+                yield (
+                    f"{CNC.vars['prbcmd']}Z{self.zmin:.4f}"
+                    f"F{CNC.vars['prbfeed']:g}"
+                )
+                yield "%wait"  # added for smoothie
+
+                timeout = time.time() + ADAPTIVE_TIMEOUT
+                while len(self.points) == n:
+                    state = CNC.vars["state"]
+                    if (not self.start
+                            or state.upper().startswith(("ALARM", "ERROR"))):
+                        self.clear()
+                        raise Exception(
+                            _("Adaptive scan: probe failed {}").format(state))
+                    if state.startswith(("Hold", "Door")):
+                        # paused by the user
+                        timeout = time.time() + ADAPTIVE_TIMEOUT
+                    elif time.time() > timeout:
+                        self.clear()
+                        raise Exception(
+                            _("Adaptive scan: no probe result received"))
+                    yield None
+                probed[i, j] = self.points[-1][2]
+                last = (i, j)
+
+            # refine the cells deviating from the plane
+            nodes = set()
+            split = []
+            for cell in cells:
+                if self._deviation(probed, cell) <= tolerance:
+                    leafs.append(cell)
+                    Probe._known(known, probed, cell)
+                    continue
+                children = Probe._split(cell)
+                if len(children) == 1:
+                    leafs.append(cell)
+                    Probe._known(known, probed, cell)
+                    continue
+                split.extend(children)
+                for i0, j0, i1, j1 in children:
+                    for n in ((i0, j0), (i1, j0), (i0, j1), (i1, j1)):
+                        if n not in probed:
+                            nodes.add(n)
+            cells = split
+
+        self.start = False
+        self._fill(probed, leafs)
+        yield f"G0Z{self.zmax:.4f}"
+        yield f"G0X{self.xmin:.4f}Y{self.ymin:.4f}"
+
+    # ----------------------------------------------------------------------
+    # Index intervals of the initial cells along an axis
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _coarse(n):
+        bounds = list(range(0, n - 1, ADAPTIVE_COARSE)) + [n - 1]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    # ----------------------------------------------------------------------
+    # Split a cell in two along its directions with more than one step
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _split(cell):
+        i0, j0, i1, j1 = cell
+        xs = [(i0, i1)]
+        if i1 - i0 > 1:
+            im = (i0 + i1) // 2
+            xs = [(i0, im), (im, i1)]
+        ys = [(j0, j1)]
+        if j1 - j0 > 1:
+            jm = (j0 + j1) // 2
+            ys = [(j0, jm), (jm, j1)]
+        return [(a, c, b, d) for a, b in xs for c, d in ys]
+
+    # ----------------------------------------------------------------------
+    # Mark the unit cells of a final cell, following the plane of its
+    # corners within the tolerance, with its highest corner
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _known(known, probed, cell):
+        i0, j0, i1, j1 = cell
+        z = max(probed[i0, j0], probed[i1, j0],
+                probed[i0, j1], probed[i1, j1])
+        for i in range(i0, i1):
+            for j in range(j0, j1):
+                known[i, j] = z
+
+    # ----------------------------------------------------------------------
+    # @return the height to clear for the move from node a to b: the
+    # highest corner of the final cells crossed and, for the cells still
+    # refined, the highest point probed around them raised by the spread
+    # of the heights. zmax when too little is probed
+    # ----------------------------------------------------------------------
+    def _retract(self, probed, known, pending, a, b):
+        z = probed.get(a, self.zmax)
+        for cell in self._crossed(a, b):
+            try:
+                z = max(z, known[cell])
+                continue
+            except KeyError:
+                pass
+            try:
+                i0, j0, i1, j1 = pending[cell]
+            except KeyError:
+                return self.zmax
+            d = max(i1 - i0, j1 - j0)
+            heights = [
+                zp
+                for (i, j), zp in probed.items()
+                if i0 - d <= i <= i1 + d and j0 - d <= j <= j1 + d
+            ]
+            if len(heights) < 4:
+                # too little probed yet around
+                return self.zmax
+            # the surface inside may rise as much as it varies around
+            top = max(heights)
+            z = max(z, 2.0 * top - min(heights))
+        return z
+
+    # ----------------------------------------------------------------------
+    # @return the unit cells touched by the segment from node a to b
+    # ----------------------------------------------------------------------
+    def _crossed(self, a, b):
+        ax, ay = a
+        dx = b[0] - ax
+        dy = b[1] - ay
+        cells = []
+        for i in range(max(min(a[0], b[0]) - 1, 0),
+                       min(max(a[0], b[0]), self.xn - 2) + 1):
+            for j in range(max(min(a[1], b[1]) - 1, 0),
+                           min(max(a[1], b[1]), self.yn - 2) + 1):
+                # clip the segment to the cell [i,i+1]x[j,j+1]
+                t0, t1 = 0.0, 1.0
+                for d, lo, hi in ((dx, i - ax, i + 1 - ax),
+                                  (dy, j - ay, j + 1 - ay)):
+                    if d == 0:
+                        if lo > 0 or hi < 0:
+                            t0, t1 = 1.0, 0.0
+                            break
+                        continue
+                    ta, tb = sorted((lo / d, hi / d))
+                    t0 = max(t0, ta)
+                    t1 = min(t1, tb)
+                if t0 <= t1:
+                    cells.append((i, j))
+        return cells
+
+    # ----------------------------------------------------------------------
+    # Maximum distance of the probed points of a cell from the plane
+    # fitted by least squares on the points of the cell and its neighbors
+    # ----------------------------------------------------------------------
+    def _deviation(self, probed, cell):
+        i0, j0, i1, j1 = cell
+        di = i1 - i0
+        dj = j1 - j0
+        pts = [
+            (i, j, z)
+            for (i, j), z in probed.items()
+            if i0 - di <= i <= i1 + di and j0 - dj <= j <= j1 + dj
+        ]
+
+        # normal equations of z = a*i + b*j + c
+        sii = sij = sjj = si = sj = sz = siz = sjz = 0.0
+        for i, j, z in pts:
+            sii += i * i
+            sij += i * j
+            sjj += j * j
+            si += i
+            sj += j
+            sz += z
+            siz += i * z
+            sjz += j * z
+        m = [[sii, sij, si], [sij, sjj, sj], [si, sj, float(len(pts))]]
+        r = [siz, sjz, sz]
+
+        def det(m):
+            return (
+                m[0][0] * (m[1][1] * m[2][2] - m[1][2] * m[2][1])
+                - m[0][1] * (m[1][0] * m[2][2] - m[1][2] * m[2][0])
+                + m[0][2] * (m[1][0] * m[2][1] - m[1][1] * m[2][0])
+            )
+
+        d = det(m)
+        if abs(d) < 1e-10:
+            return 0.0
+        coef = []
+        for k in range(3):
+            mk = [row[:] for row in m]
+            for row, v in zip(mk, r):
+                row[k] = v
+            coef.append(det(mk) / d)
+        a, b, c = coef
+
+        return max(
+            abs(z - (a * i + b * j + c))
+            for i, j, z in pts
+            if i0 <= i <= i1 and j0 <= j <= j1
+        )
+
+    # ----------------------------------------------------------------------
+    # Fill the matrix nodes not probed interpolating from their cell
+    # ----------------------------------------------------------------------
+    def _fill(self, probed, cells):
+        for (i, j), z in probed.items():
+            self.matrix[j][i] = z
+        for i0, j0, i1, j1 in cells:
+            z00 = probed[i0, j0]
+            z10 = probed[i1, j0]
+            z01 = probed[i0, j1]
+            z11 = probed[i1, j1]
+            for j in range(j0, j1 + 1):
+                b = (j - j0) / (j1 - j0)
+                for i in range(i0, i1 + 1):
+                    if (i, j) in probed:
+                        continue
+                    a = (i - i0) / (i1 - i0)
+                    self.matrix[j][i] = (
+                        (1 - a) * (1 - b) * z00
+                        + a * (1 - b) * z10
+                        + (1 - a) * b * z01
+                        + a * b * z11
+                    )
+        self.prepare()
+
     # ----------------------------------------------------------------------
     # Add a probed point to the list and the 3D matrix
     # ----------------------------------------------------------------------
@@ -332,9 +659,11 @@ class Probe:
             self.points.append([x, y, z])
         except IndexError:
             pass
+        self._surface = None
 
         if len(self.points) >= self.xn * self.yn:
             self.start = False
+            self.prepare()
 
     # ----------------------------------------------------------------------
     # Make z-level relative to the location of (x,y,0)
@@ -354,9 +683,114 @@ class Probe:
                 row[i] -= zero
                 self.points.append([x, y, row[i]])
         self.zeroed = True
+        self.prepare()
+
+    # ----------------------------------------------------------------------
+    # Set the interpolation method PROBE_BILINEAR, PROBE_BICUBIC or
+    # PROBE_SPLINE. The higher order methods require numpy
+    # ----------------------------------------------------------------------
+    def setMethod(self, method):
+        if method != self.method:
+            self.method = method
+            self._surface = None
+
+    # ----------------------------------------------------------------------
+    # Solve once the coefficients of the interpolating surface.
+    # Both bicubic and spline end up as bicubic patches over a regular
+    # grid, the probe grid or a finer one sampling the spline, so
+    # evaluating a point costs the same whatever the number of probes.
+    # ----------------------------------------------------------------------
+    def prepare(self):
+        self._surface = False  # bilinear
+        if self.method == PROBE_BILINEAR or numpy is None or self.isEmpty():
+            return
+
+        xstep = self._xstep
+        ystep = self._ystep
+        z = numpy.array(self.matrix, dtype=float)
+        if self.method == PROBE_SPLINE:
+            try:
+                z = self._splineGrid()
+            except (numpy.linalg.LinAlgError, ValueError):
+                # not enough or degenerate points, use the probe grid
+                pass
+            else:
+                xstep /= SPLINE_REFINE
+                ystep /= SPLINE_REFINE
+
+        # derivatives in cell units
+        zx = numpy.gradient(z, axis=1)
+        zy = numpy.gradient(z, axis=0)
+        zxy = numpy.gradient(zx, axis=0)
+
+        # per cell matrix of values and derivatives on the corners
+        f = numpy.empty((z.shape[0] - 1, z.shape[1] - 1, 4, 4))
+        for row, (v, vx) in enumerate(((z, zy), (zx, zxy))):
+            f[:, :, 2 * row, 0] = v[:-1, :-1]
+            f[:, :, 2 * row, 1] = v[1:, :-1]
+            f[:, :, 2 * row, 2] = vx[:-1, :-1]
+            f[:, :, 2 * row, 3] = vx[1:, :-1]
+            f[:, :, 2 * row + 1, 0] = v[:-1, 1:]
+            f[:, :, 2 * row + 1, 1] = v[1:, 1:]
+            f[:, :, 2 * row + 1, 2] = vx[:-1, 1:]
+            f[:, :, 2 * row + 1, 3] = vx[1:, 1:]
+        m = numpy.array(BICUBIC, dtype=float)
+        coeffs = m @ f @ m.T
+
+        self._surface = (xstep, ystep, coeffs, coeffs.tolist())
+
+    # ----------------------------------------------------------------------
+    # Fit a thin plate spline through the scattered probe points and
+    # sample it SPLINE_REFINE times denser than the probe grid
+    # ----------------------------------------------------------------------
+    def _splineGrid(self):
+        pts = numpy.array(self.points, dtype=float).reshape(-1, 3)
+        # probing the same location twice makes the system singular
+        xy, idx = numpy.unique(
+            numpy.round(pts[:, :2], 6), axis=0, return_index=True)
+        pts = pts[idx]
+        if len(pts) < 3:
+            raise ValueError("Not enough probe points")
+
+        # work on normalized coordinates for a well conditioned system
+        scale = max(self.xmax - self.xmin, self.ymax - self.ymin)
+        xy = (pts[:, :2] - (self.xmin, self.ymin)) / scale
+        n = len(xy)
+
+        def kernel(a, b):
+            r2 = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                k = 0.5 * r2 * numpy.log(r2)
+            k[r2 == 0.0] = 0.0
+            return k
+
+        a = numpy.zeros((n + 3, n + 3))
+        a[:n, :n] = kernel(xy, xy)
+        a[:n, n] = 1.0
+        a[:n, n + 1:] = xy
+        a[n, :n] = 1.0
+        a[n + 1:, :n] = xy.T
+        b = numpy.zeros(n + 3)
+        b[:n] = pts[:, 2]
+        w = numpy.linalg.solve(a, b)
+
+        xn = (self.xn - 1) * SPLINE_REFINE + 1
+        yn = (self.yn - 1) * SPLINE_REFINE + 1
+        gx, gy = numpy.meshgrid(
+            numpy.linspace(0.0, (self.xmax - self.xmin) / scale, xn),
+            numpy.linspace(0.0, (self.ymax - self.ymin) / scale, yn),
+        )
+        grid = numpy.column_stack((gx.ravel(), gy.ravel()))
+        z = kernel(grid, xy) @ w[:n] + w[n] + grid @ w[n + 1:]
+        return z.reshape(yn, xn)
 
     # ----------------------------------------------------------------------
     def interpolate(self, x, y):
+        if self._surface is None:
+            self.prepare()
+        if self._surface:
+            return self._bicubic(x, y)
+
         ix = (x - self.xmin) / self._xstep
         jy = (y - self.ymin) / self._ystep
         i = int(math.floor(ix))
@@ -384,6 +818,148 @@ class Probe:
             + a * b * self.matrix[j + 1][i + 1]
         )
 
+    # ----------------------------------------------------------------------
+    # Evaluate the bicubic patch containing x,y.
+    # Outside the probed area the surface keeps its value on the border
+    # ----------------------------------------------------------------------
+    def _bicubic(self, x, y):
+        xstep, ystep, coeffs, patches = self._surface
+        u = (x - self.xmin) / xstep
+        v = (y - self.ymin) / ystep
+        nx = len(patches[0])
+        ny = len(patches)
+        i = min(max(int(math.floor(u)), 0), nx - 1)
+        j = min(max(int(math.floor(v)), 0), ny - 1)
+        a = min(max(u - i, 0.0), 1.0)
+        b = min(max(v - j, 0.0), 1.0)
+
+        z = 0.0
+        for row in reversed(patches[j][i]):
+            z = z * a + ((row[3] * b + row[2]) * b + row[1]) * b + row[0]
+        return z
+
+    # ----------------------------------------------------------------------
+    def _bicubicArray(self, x, y):
+        xstep, ystep, coeffs, patches = self._surface
+        ny, nx = coeffs.shape[:2]
+        u = (x - self.xmin) / xstep
+        v = (y - self.ymin) / ystep
+        i = numpy.clip(numpy.floor(u), 0, nx - 1).astype(int)
+        j = numpy.clip(numpy.floor(v), 0, ny - 1).astype(int)
+        a = numpy.clip(u - i, 0.0, 1.0)
+        b = numpy.clip(v - j, 0.0, 1.0)
+
+        c = coeffs[j, i]
+        z = numpy.zeros(len(a))
+        for p in range(3, -1, -1):
+            row = c[:, p]
+            z = (
+                z * a
+                + ((row[:, 3] * b + row[:, 2]) * b + row[:, 1]) * b
+                + row[:, 0]
+            )
+        return z
+
+    # ----------------------------------------------------------------------
+    # Vectorized interpolate() for arrays of x,y
+    # ----------------------------------------------------------------------
+    def interpolateArray(self, x, y):
+        if self._surface is None:
+            self.prepare()
+        if self._surface:
+            return self._bicubicArray(x, y)
+
+        matrix = numpy.array(self.matrix, dtype=float)
+        ix = (x - self.xmin) / self._xstep
+        jy = (y - self.ymin) / self._ystep
+        i = numpy.clip(numpy.floor(ix), 0, self.xn - 2).astype(int)
+        j = numpy.clip(numpy.floor(jy), 0, self.yn - 2).astype(int)
+
+        a = ix - i
+        b = jy - j
+        a1 = 1.0 - a
+        b1 = 1.0 - b
+
+        return (
+            a1 * b1 * matrix[j, i]
+            + a1 * b * matrix[j + 1, i]
+            + a * b1 * matrix[j, i + 1]
+            + a * b * matrix[j + 1, i + 1]
+        )
+
+    # ----------------------------------------------------------------------
+    # Grid crossings of many segments along one axis
+    # @return (seg, t) segment index and fraction [0..1) along the segment
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _crossings(u1, u2, d):
+        du = u2 - u1
+        first = numpy.floor(u1)
+        # positive direction: lines first+1 .. below u2
+        # negative direction: lines first .. above u2
+        pos = d > 1e-10
+        neg = d < -1e-10
+        start = numpy.where(pos, first + 1.0, first)
+        n = numpy.where(
+            pos,
+            numpy.ceil(u2) - start,
+            numpy.where(neg, start - numpy.floor(u2) + 1.0, 0.0),
+        )
+        n = numpy.maximum(n, 0).astype(int)
+
+        seg = numpy.repeat(numpy.arange(len(u1)), n)
+        k = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n) - n, n)
+        k = numpy.where(pos[seg], start[seg] + k, start[seg] - k)
+        t = (k - u1[seg]) / du[seg]
+        keep = (t >= 0.0) & (t < 0.999999999)
+        return seg[keep], t[keep]
+
+    # ----------------------------------------------------------------------
+    # Vectorized splitLine() for many segments at once
+    # @param p1, p2 (n,3) arrays of the start and end points of the segments
+    # @return (points, seg) the z-corrected points (m,3) ordered along the
+    #         segments and the index of the segment each point belongs to.
+    #         Like splitLine() the start points are not returned.
+    # ----------------------------------------------------------------------
+    def splitLines(self, p1, p2):
+        p1 = numpy.asarray(p1, dtype=float).reshape(-1, 3)
+        p2 = numpy.asarray(p2, dtype=float).reshape(-1, 3)
+        d = p2 - p1
+        d[numpy.abs(d) < 1e-10] = 0.0
+
+        sx, tx = Probe._crossings(
+            (p1[:, 0] - self.xmin) / self._xstep,
+            (p2[:, 0] - self.xmin) / self._xstep,
+            d[:, 0],
+        )
+        sy, ty = Probe._crossings(
+            (p1[:, 1] - self.ymin) / self._ystep,
+            (p2[:, 1] - self.ymin) / self._ystep,
+            d[:, 1],
+        )
+
+        # crossings of both axes plus the end point of every segment
+        n = len(p1)
+        seg = numpy.concatenate((sx, sy, numpy.arange(n)))
+        t = numpy.concatenate((tx, ty, numpy.ones(n)))
+        order = numpy.lexsort((t, seg))
+        seg = seg[order]
+        t = t[order]
+
+        # crossing a grid corner counts once
+        if len(t) > 1:
+            keep = numpy.ones(len(t), dtype=bool)
+            keep[1:] = (seg[1:] != seg[:-1]) | (t[1:] - t[:-1] > 1e-12)
+            seg = seg[keep]
+            t = t[keep]
+
+        points = p1[seg] + t[:, None] * d[seg]
+        # keep exact end points
+        end = t == 1.0
+        points[end] = p2[seg[end]]
+        points[:, 2] += self.interpolateArray(points[:, 0], points[:, 1])
+        return points, seg
+
     # ----------------------------------------------------------------------
     # Split line into multiple segments correcting for Z if needed
     # return only end points
@@ -655,6 +1231,220 @@ class Orient:
         self.saved = True
 
 
+# =============================================================================
+# Kinematic time estimator
+# Collects the linear segments of the motions and plans them like the GRBL
+# planner: maximum rate and acceleration per axis, junction speeds from the
+# junction deviation and trapezoidal velocity profiles between them
+# =============================================================================
+class Planner:
+    def __init__(self, feedmax, acceleration, junction):
+        self.feedmax = feedmax  # units/min per axis
+        self.acceleration = acceleration  # units/s^2 per axis
+        self.junction = junction  # junction deviation in units
+        self.xyz = []  # flat coordinates of the segment end points
+        self.feed = []  # feed per segment in units/min, 0.0 not a motion
+        self.stops = []  # segments starting from rest
+        self.last = None
+
+    # ----------------------------------------------------------------------
+    # @return a planner with the machine limits, from the controller
+    #         settings $11, $110-$112, $120-$122 when known otherwise
+    #         from the configuration
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def machine():
+        feedmax = [CNC.feedmax_x, CNC.feedmax_y, CNC.feedmax_z]
+        acceleration = [
+            CNC.acceleration_x, CNC.acceleration_y, CNC.acceleration_z]
+        junction = CNC.junction_deviation
+        scale = 25.4 if CNC.inch else 1.0
+        for i in range(3):
+            try:
+                feedmax[i] = float(CNC.vars[f"grbl_{110 + i}"]) / scale
+            except (KeyError, ValueError):
+                pass
+            try:
+                acceleration[i] = float(CNC.vars[f"grbl_{120 + i}"]) / scale
+            except (KeyError, ValueError):
+                pass
+        try:
+            junction = float(CNC.vars["grbl_11"]) / scale
+        except (KeyError, ValueError):
+            pass
+        return Planner(feedmax, acceleration, junction)
+
+    # ----------------------------------------------------------------------
+    # Number of segments added
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        return len(self.feed)
+
+    # ----------------------------------------------------------------------
+    # Add the segments of a motion
+    # @param xyz list of points starting from the current position
+    # @param feed in units/min, None for a rapid motion
+    # ----------------------------------------------------------------------
+    def add(self, xyz, feed=None):
+        if feed is None:
+            feed = math.inf
+        if self.last is None or self.last != xyz[0]:
+            # not connected, jump there
+            if self.last is not None:
+                self.feed.append(0.0)
+            self.xyz.extend(xyz[0])
+        for p in xyz[1:]:
+            self.xyz.extend(p)
+            self.feed.append(feed)
+        self.last = xyz[-1]
+
+    # ----------------------------------------------------------------------
+    # Next motion starts from rest (dwell, program pause...)
+    # ----------------------------------------------------------------------
+    def stop(self):
+        self.stops.append(len(self.feed))
+
+    # ----------------------------------------------------------------------
+    # Plan the segments
+    # @return list of the execution time of each segment in seconds
+    # ----------------------------------------------------------------------
+    def plan(self):
+        if not self.feed:
+            return []
+        if numpy is None:
+            return self._planPython()
+
+        n = len(self.feed)
+        d = numpy.diff(numpy.array(self.xyz, dtype=float).reshape(-1, 3),
+                       axis=0)
+        length = numpy.sqrt((d * d).sum(axis=1))
+        feed = numpy.array(self.feed, dtype=float)
+        valid = (length > TOLERANCE) & (feed > 0.0)
+        stop = numpy.zeros(n + 1, dtype=int)
+        stop[self.stops] = 1
+        stop[1:] |= ~valid  # start from rest after a jump
+        idx = numpy.nonzero(valid)[0]
+        times = numpy.zeros(n)
+        if len(idx) == 0:
+            return times.tolist()
+        stop = numpy.cumsum(stop)[idx]  # stops up to each segment
+
+        length = length[idx]
+        u = d[idx] / length[:, None]
+        feedmax = numpy.array(self.feedmax, dtype=float) / 60.0
+        acceleration = numpy.array(self.acceleration, dtype=float)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            au = numpy.abs(u)
+            speed = numpy.minimum(
+                feed[idx] / 60.0, (feedmax / au).min(axis=1))
+            accel = (acceleration / au).min(axis=1)
+
+            # maximum junction speed squared, from the acceleration along
+            # the junction vector and the deviation of the corner
+            cos = -(u[1:] * u[:-1]).sum(axis=1)
+            junit = u[1:] - u[:-1]
+            jnorm = numpy.sqrt((junit * junit).sum(axis=1))
+            jaccel = (acceleration * jnorm[:, None]
+                      / numpy.abs(junit)).min(axis=1)
+            jaccel[jnorm == 0.0] = math.inf  # straight
+            sin = numpy.sqrt(0.5 * (1.0 - numpy.maximum(cos, -0.999999)))
+            junction = jaccel * self.junction * sin / (1.0 - sin)
+        junction[cos > 0.999999] = 0.0
+        entry = numpy.zeros(len(idx) + 1)
+        entry[1:-1] = numpy.minimum(
+            junction, numpy.minimum(speed[1:], speed[:-1]) ** 2)
+        entry[1:-1][stop[1:] != stop[:-1]] = 0.0
+
+        # The backward and forward passes of the planner
+        #   entry[k] <= entry[k+1] + 2*a*L and entry[k+1] <= entry[k] + 2*a*L
+        # are running minimums of the entries shifted by the cumulative
+        # sum of 2*a*L
+        cum = numpy.zeros(len(idx) + 1)
+        numpy.cumsum(2.0 * accel * length, out=cum[1:])
+        entry = numpy.minimum.accumulate((entry + cum)[::-1])[::-1] - cum
+        entry = numpy.minimum.accumulate(entry - cum) + cum
+        entry = numpy.sqrt(numpy.maximum(entry, 0.0))
+
+        # trapezoidal or triangular profile
+        v0 = entry[:-1]
+        v1 = entry[1:]
+        cruise = length - (2.0 * speed**2 - v0**2 - v1**2) / (2.0 * accel)
+        with numpy.errstate(invalid="ignore"):
+            peak = numpy.where(
+                cruise < 0.0,
+                numpy.sqrt(accel * length + 0.5 * (v0**2 + v1**2)),
+                speed)
+        times[idx] = ((2.0 * peak - v0 - v1) / accel
+                      + numpy.maximum(cruise, 0.0) / speed)
+        return times.tolist()
+
+    # ----------------------------------------------------------------------
+    # Same as plan() without numpy
+    # ----------------------------------------------------------------------
+    def _planPython(self):
+        xyz = self.xyz
+        stops = set(self.stops)
+        restart = True
+        times = [0.0] * len(self.feed)
+        segments = []  # [index, length, speed, accel]
+        entry = [0.0]  # entry speeds squared
+        last = None
+        for i, feed in enumerate(self.feed):
+            d = [xyz[3 * i + 3 + k] - xyz[3 * i + k] for k in range(3)]
+            length = math.sqrt(d[0] ** 2 + d[1] ** 2 + d[2] ** 2)
+            restart = restart or i in stops
+            if length <= TOLERANCE or feed <= 0.0:
+                restart = True
+                continue
+            u = [x / length for x in d]
+            speed = feed / 60.0
+            accel = math.inf
+            for k in range(3):
+                if u[k]:
+                    speed = min(speed, self.feedmax[k] / 60.0 / abs(u[k]))
+                    accel = min(accel, self.acceleration[k] / abs(u[k]))
+            if restart:
+                entry[-1] = 0.0
+            else:
+                lu, lspeed = last
+                cos = -(u[0] * lu[0] + u[1] * lu[1] + u[2] * lu[2])
+                if cos > 0.999999:
+                    entry[-1] = 0.0
+                else:
+                    junit = [u[k] - lu[k] for k in range(3)]
+                    jnorm = math.sqrt(sum(x * x for x in junit))
+                    jaccel = min(
+                        (self.acceleration[k] * jnorm / abs(junit[k])
+                         for k in range(3) if junit[k]),
+                        default=math.inf)
+                    sin = math.sqrt(0.5 * (1.0 - max(cos, -0.999999)))
+                    entry[-1] = min(
+                        jaccel * self.junction * sin / (1.0 - sin),
+                        min(speed, lspeed) ** 2)
+            segments.append((i, length, speed, accel))
+            entry.append(0.0)
+            last = (u, speed)
+            restart = False
+
+        for j in range(len(segments) - 1, -1, -1):
+            reach = 2.0 * segments[j][3] * segments[j][1]
+            entry[j] = min(entry[j], entry[j + 1] + reach)
+        for j, (i, length, speed, accel) in enumerate(segments):
+            entry[j + 1] = min(entry[j + 1], entry[j] + 2.0 * accel * length)
+            v0 = math.sqrt(entry[j])
+            v1 = math.sqrt(entry[j + 1])
+            cruise = length - (2.0 * speed**2 - entry[j] - entry[j + 1]) / (
+                2.0 * accel)
+            if cruise < 0.0:
+                peak = math.sqrt(
+                    accel * length + 0.5 * (entry[j] + entry[j + 1]))
+                cruise = 0.0
+            else:
+                peak = speed
+            times[i] = (2.0 * peak - v0 - v1) / accel + cruise / speed
+        return times
+
+
 # =============================================================================
 # Command operations on a CNC
 # =============================================================================
@@ -668,6 +1458,7 @@ class CNC:
     feedmax_x = 3000
     feedmax_y = 3000
     feedmax_z = 2000
+    junction_deviation = 0.01  # mm
     travel_x = 300
     travel_y = 300
     travel_z = 60
@@ -845,6 +1636,11 @@ class CNC:
             CNC.feedmax_z = float(config.get(section, "feedmax_z"))
         except Exception:
             pass
+        try:
+            CNC.junction_deviation = float(
+                config.get(section, "junction_deviation"))
+        except Exception:
+            pass
         try:
             CNC.travel_x = float(config.get(section, "travel_x"))
         except Exception:
@@ -926,6 +1722,7 @@ class CNC:
             CNC.feedmax_x /= 25.4
             CNC.feedmax_y /= 25.4
             CNC.feedmax_z /= 25.4
+            CNC.junction_deviation /= 25.4
             CNC.travel_x /= 25.4
             CNC.travel_y /= 25.4
             CNC.travel_z /= 25.4
@@ -986,6 +1783,11 @@ class CNC:
         self.lval = 1
         self.tool = 0
         self._lastTool = None
+        self.wcs = 54  # G54..G59
+        self.spindle = 5  # M3/M4/M5
+        self.sval = 0.0
+        self.coolant = 9  # M7/M8/M9
+        self.feedmode = 94  # G93/G94/G95
 
         self.absolute = True  # G90/G91     absolute/relative motion
         self.arcabsolute = False  # G90.1/G91.1 absolute/relative arc
@@ -1192,22 +1994,31 @@ class CNC:
         return line.split()
 
     # ----------------------------------------------------------------------
-    # @return line,comment
-    #   line broken in a list of commands,
-    #       None,"" if empty or comment
-    #       else compiled expressions,""
+    # @return line broken in a list of commands,
+    #       None if empty or comment
+    #       else compiled expressions
+    # and set CNC.comment to the comment of the line
     # ----------------------------------------------------------------------
     @staticmethod
     def compileLine(line, space=False):
+        cmds, CNC.comment = CNC._compileLine(line, space)
+        return cmds
+
+    # ----------------------------------------------------------------------
+    # @return line,comment like compileLine() without touching CNC.comment,
+    # so it can be used from a thread
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _compileLine(line, space=False):
         line = line.strip()
         if not line:
-            return None
+            return None, ""
         if line[0] == "$":
-            return line
+            return line, ""
 
         # to accept #nnn variables as _nnn internally
         line = line.replace("#", "_")
-        CNC.comment = ""
+        comment = ""
 
         # execute literally the line after the first character
         if line[0] == "%":
@@ -1220,36 +2031,41 @@ class CNC:
                 cmd = None
                 args = None
             if cmd == "%wait":
-                return (WAIT,)
+                return (WAIT,), comment
             elif cmd == "%msg":
                 if not args:
                     args = None
-                return (MSG, args)
+                return (MSG, args), comment
             elif cmd == "%update":
-                return (UPDATE, args)
+                return (UPDATE, args), comment
             elif line.startswith("%if running") and not CNC.vars["running"]:
                 # ignore if running lines when not running
-                return None
+                return None, comment
             else:
                 try:
-                    return compile(line[1:], "", "exec")
+                    return compile(line[1:], "", "exec"), comment
                 except Exception as e:
                     print("Compile line error: \n")
                     print(e)
-                    return None
+                    return None, comment
 
         # most probably an assignment like  #nnn = expr
         if line[0] == "_":
             try:
-                return compile(line, "", "exec")
+                return compile(line, "", "exec"), comment
             except Exception:
                 # FIXME show the error!!!!
-                return None
+                return None, comment
 
         # commented line
         if line[0] == ";":
-            CNC.comment = line[1:].strip()
-            return None
+            return None, line[1:].strip()
+
+        # plain g-code without comments or expressions
+        if PLAINPAT.search(line) is None:
+            if not space:
+                line = line.replace(" ", "")
+            return line or None, comment
 
         out = []  # output list of commands
         bracket = 0  # bracket count []
@@ -1284,7 +2100,7 @@ class CNC:
                     else:
                         expr += ch
                 else:
-                    CNC.comment += ch
+                    comment += ch
             elif ch == "]":
                 # expression end?
                 if not inComment:
@@ -1301,7 +2117,7 @@ class CNC:
                     else:
                         expr += ch
                 else:
-                    CNC.comment += ch
+                    comment += ch
             elif ch == "=":
                 # check for assignments (FIXME very bad)
                 if not out and bracket == 0 and paren == 0:
@@ -1311,14 +2127,14 @@ class CNC:
                             break
                     else:
                         try:
-                            return compile(line, "", "exec")
+                            return compile(line, "", "exec"), comment
                         except Exception:
                             # FIXME show the error!!!!
-                            return None
+                            return None, comment
             elif ch == ";":
                 # Skip everything after the semicolon on normal lines
                 if not inComment and paren == 0 and bracket == 0:
-                    CNC.comment += line[i + 1:]
+                    comment += line[i + 1:]
                     break
                 else:
                     expr += ch
@@ -1334,17 +2150,17 @@ class CNC:
                     cmd += ch
 
             elif inComment:
-                CNC.comment += ch
+                comment += ch
 
         if cmd:
             out.append(cmd)
 
         # return output commands
         if len(out) == 0:
-            return None
+            return None, comment
         if len(out) > 1:
-            return out
-        return out[0]
+            return out, comment
+        return out[0], comment
 
     # ----------------------------------------------------------------------
     # Break line into commands
@@ -1357,6 +2173,56 @@ class CNC:
         line = CMDPAT.sub(r" \1", line).lstrip()
         return line.split()
 
+    # ----------------------------------------------------------------------
+    # @return (motion, axes) true if the commands of a line have a G0-G3
+    # word and axis words
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def motionWords(cmds):
+        motion = axes = False
+        for cmd in cmds:
+            c = cmd[0].upper()
+            if c in "XYZABC":
+                axes = True
+            elif c == "G":
+                try:
+                    motion = motion or float(cmd[1:]) in (0, 1, 2, 3)
+                except ValueError:
+                    pass
+        return motion, axes
+
+    # ----------------------------------------------------------------------
+    # @return true if the commands of a line have the G code, in any
+    # spelling (g4, G04, G4.0)
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def hasGcode(cmds, code):
+        for cmd in cmds:
+            if cmd[0] in "Gg":
+                try:
+                    if float(cmd[1:]) == code:
+                        return True
+                except ValueError:
+                    pass
+        return False
+
+    # ----------------------------------------------------------------------
+    # Compile a line once, to be shared by the loader, renderer and streamer
+    # @return (cmds, words, comment)
+    #   cmds    the result of compileLine()
+    #   words   tuple of commands if cmds is a plain g-code string,
+    #           None otherwise (expressions have to be evaluated first)
+    #   comment the comment of the line as parsed by compileLine()
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def compileCode(line):
+        cmds, comment = CNC._compileLine(line)
+        if isinstance(cmds, str):
+            words = tuple(CNC.breakLine(cmds))
+        else:
+            words = None
+        return cmds, words, comment
+
     # ----------------------------------------------------------------------
     # Create path for one g command
     # ----------------------------------------------------------------------
@@ -1440,7 +2306,11 @@ class CNC:
                         self.arcabsolute = False
 
                 elif gcode in (93, 94, 95):
-                    CNC.vars["feedmode"] = gcode
+                    self.vars["feedmode"] = gcode
+                    self.feedmode = gcode
+
+                elif 54 <= gcode <= 59 and decimal == 0:
+                    self.wcs = gcode
 
                 elif gcode == 98:
                     self.retractz = True
@@ -1471,6 +2341,10 @@ class CNC:
 
             elif c == "M":
                 self.mval = int(value)
+                if self.mval in (3, 4, 5):
+                    self.spindle = self.mval
+                elif self.mval in (7, 8, 9):
+                    self.coolant = self.mval
 
             elif c == "N":
                 pass
@@ -1484,6 +2358,9 @@ class CNC:
             elif c == "R":
                 self.rval = value * self.unit
 
+            elif c == "S":
+                self.sval = value
+
             elif c == "T":
                 self.tool = int(value)
 
@@ -1750,10 +2627,10 @@ class CNC:
             self.totalTime += length / self.feed
         else:
             try:
-                if CNC.vars["feedmode"] == 94:
+                if self.vars["feedmode"] == 94:
                     # Normal mode
                     t = length / self.feed
-                elif CNC.vars["feedmode"] == 93:
+                elif self.vars["feedmode"] == 93:
                     # Inverse mode
                     t = length * self.feed
                 block.time += t
@@ -1819,6 +2696,23 @@ class CNC:
             lines.append("".join(newcmd))
         return lines
 
+    # ----------------------------------------------------------------------
+    # Compile lazily a program generated while running.
+    # A None line from the program is passed through meaning that the
+    # program waits for the machine before producing the next lines
+    # @yield (line, None) as GCode.compileIter()
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def compileIter(program):
+        for line in program:
+            if line is None:
+                yield None, None
+                continue
+            for cmd in CNC.compile([line]):
+                if isinstance(cmd, str):
+                    cmd += "\n"
+                yield cmd, None
+
     # ----------------------------------------------------------------------
     # code to change manually tool
     # ----------------------------------------------------------------------
@@ -2014,6 +2908,8 @@ class Block(list):
         self.expand = False  # Expand in editor
         self.color = None  # Custom color for path
         self._path = []  # canvas drawing paths
+        self._compiled = {}  # compiled lines cache, see compiled()
+        self._drawState = None  # drawing state, see invalidatePath()
         self.sx = self.sy = self.sz = 0  # start  coordinates
         # (entry point first non rapid motion)
         self.ex = self.ey = self.ez = 0  # ending coordinates
@@ -2027,6 +2923,8 @@ class Block(list):
         self.color = src.color
         self[:] = src[:]
         self._path = []
+        self._compiled = src._compiled.copy()
+        self._drawState = None
         self.sx = src.sx
         self.sy = src.sy
         self.sz = src.sz
@@ -2231,6 +3129,44 @@ class Block(list):
                 self._name = pat.group(1)
         list.append(self, line)
 
+    # ----------------------------------------------------------------------
+    # Return the compiled form of line lid, see CNC.compileCode()
+    # The cache is keyed by the line text, so an edited line is always
+    # recompiled. The undo operations of GCode drop the stale entries.
+    # ----------------------------------------------------------------------
+    def compiled(self, lid):
+        line = self[lid]
+        code = self._compiled.get(line)
+        if code is None:
+            code = CNC.compileCode(line)
+            # depends on the running state, cannot be cached
+            if not line.strip().startswith("%if running"):
+                self._compiled[line] = code
+        return code
+
+    # ----------------------------------------------------------------------
+    def setCompiled(self, line, code):
+        if not line.strip().startswith("%if running"):
+            self._compiled[line] = code
+
+    # ----------------------------------------------------------------------
+    # Drop the compiled cache of lines, or everything if None
+    # ----------------------------------------------------------------------
+    def invalidate(self, lines=None):
+        if lines is None:
+            self._compiled.clear()
+        else:
+            for line in lines:
+                self._compiled.pop(line, None)
+
+    # ----------------------------------------------------------------------
+    # The canvas keeps in _drawState the interpreter state at the start and
+    # end of the block, to draw again only the modified blocks, and every
+    # RESUME_CHECKPOINT lines, to resume a program (see GCode.resumeState)
+    # ----------------------------------------------------------------------
+    def invalidatePath(self):
+        self._drawState = None
+
     # ----------------------------------------------------------------------
     def resetPath(self):
         del self._path[:]
@@ -2341,14 +3277,18 @@ class GCode:
             return None
 
         elif isinstance(line, list):
-            for i, expr in enumerate(line):
+            # do not modify the list, it can be shared from the compiled cache
+            out = []
+            for expr in line:
                 if isinstance(expr, types.CodeType):
                     result = eval(expr, CNC.vars, self.vars)
                     if isinstance(result, float):
-                        line[i] = str(round(result, CNC.digits))
+                        out.append(str(round(result, CNC.digits)))
                     else:
-                        line[i] = str(result)
-            return "".join(line)
+                        out.append(str(result))
+                else:
+                    out.append(expr)
+            return "".join(out)
 
         elif isinstance(line, types.CodeType):
             import traceback  # noqa: F401
@@ -2395,9 +3335,14 @@ class GCode:
         if not self.blocks:
             self.blocks.append(Block("Header"))
 
-        cmds = CNC.parseLine(line)
+        code = CNC.compileCode(line)
+        cmds = code[1]
+        if cmds is None and code[0] is not None:
+            # expressions, keep the legacy parsing for the block splitting
+            cmds = CNC.parseLine(line)
         if cmds is None:
             self.blocks[-1].append(line)
+            self.blocks[-1].setCompiled(line, code)
             return
 
         self.cnc.motionStart(cmds)
@@ -2413,6 +3358,7 @@ class GCode:
             self.blocks[-1].append(line)
         else:
             self.blocks[-1].append(line)
+        self.blocks[-1].setCompiled(line, code)
 
         self.cnc.motionEnd()
 
@@ -2914,7 +3860,7 @@ class GCode:
         truncate=None,
     ):
         # Recursion for multiple paths
-        if not isinstance(path, Path):
+        if not isinstance(path, (Path, CompactPath)):
             block = Block("new")
             for p in path:
                 block.extend(
@@ -2964,7 +3910,7 @@ class GCode:
 
         #
         if block is None:
-            if isinstance(path, Path):
+            if isinstance(path, (Path, CompactPath)):
                 block = Block(path.name)
             else:
                 block = Block(path[0].name)
@@ -3023,7 +3969,7 @@ class GCode:
                 return altz
 
         # Generate block from path
-        if isinstance(path, Path):
+        if isinstance(path, (Path, CompactPath)):
             x, y = path[0].A
 
             # decide if flat or ramp/helical:
@@ -3131,7 +4077,7 @@ class GCode:
     def importPath(
             self, pos, paths, newblocks=None, enable=True, multiblock=True):
         undoinfo = []
-        if isinstance(paths, Path):
+        if isinstance(paths, (Path, CompactPath)):
             block = self.fromPath(paths)
             block.enable = enable
             block.color = paths.color
@@ -3241,8 +4187,11 @@ class GCode:
     # Change a single line in a block
     # ----------------------------------------------------------------------
     def setLineUndo(self, bid, lid, line):
-        undoinfo = (self.setLineUndo, bid, lid, self.blocks[bid][lid])
-        self.blocks[bid][lid] = line
+        block = self.blocks[bid]
+        undoinfo = (self.setLineUndo, bid, lid, block[lid])
+        block.invalidate((block[lid],))
+        block.invalidatePath()
+        block[lid] = line
         return undoinfo
 
     # ----------------------------------------------------------------------
@@ -3251,6 +4200,7 @@ class GCode:
     def insLineUndo(self, bid, lid, line):
         undoinfo = (self.delLineUndo, bid, lid)
         block = self.blocks[bid]
+        block.invalidatePath()
         if lid >= len(block):
             block.append(line)
         else:
@@ -3269,6 +4219,8 @@ class GCode:
     def delLineUndo(self, bid, lid):
         block = self.blocks[bid]
         undoinfo = (self.insLineUndo, bid, lid, block[lid])
+        block.invalidate((block[lid],))
+        block.invalidatePath()
         del block[lid]
         return undoinfo
 
@@ -3344,6 +4296,7 @@ class GCode:
     def setBlockEnableUndo(self, bid, enable):
         undoinfo = (self.setBlockEnableUndo, bid, self.blocks[bid].enable)
         self.blocks[bid].enable = enable
+        self.blocks[bid].invalidatePath()
         return undoinfo
 
     # ----------------------------------------------------------------------
@@ -3352,6 +4305,7 @@ class GCode:
     def setBlockColorUndo(self, bid, color):
         undoinfo = (self.setBlockColorUndo, bid, self.blocks[bid].color)
         self.blocks[bid].color = color
+        self.blocks[bid].invalidatePath()
         return undoinfo
 
     # ----------------------------------------------------------------------
@@ -3459,6 +4413,8 @@ class GCode:
         block = self.blocks[bid]
         undoinfo = (self.setBlockLinesUndo, bid, block[:])
         del block[:]
+        block.invalidate()
+        block.invalidatePath()
         block.extend(lines)
         return undoinfo
 
@@ -3471,6 +4427,7 @@ class GCode:
         block = self.blocks[bid]
         undoinfo = (self.orderDownLineUndo, bid, lid - 1)
         block.insert(lid - 1, block.pop(lid))
+        block.invalidatePath()
         return undoinfo
 
     # ----------------------------------------------------------------------
@@ -3482,6 +4439,7 @@ class GCode:
             return None
         undoinfo = (self.orderUpLineUndo, bid, lid + 1)
         block.insert(lid + 1, block.pop(lid))
+        block.invalidatePath()
         return undoinfo
 
     # ----------------------------------------------------------------------
@@ -3489,14 +4447,15 @@ class GCode:
     # ----------------------------------------------------------------------
     def autolevelBlock(self, block):
         new = []
+        motions = []
         autolevel = not self.probe.isEmpty()
-        for line in block:
-            cmds = CNC.compileLine(line)
+        for j, line in enumerate(block):
+            cmds, words, comment = block.compiled(j)
             if cmds is None:
                 new.append(line)
                 continue
-            elif isinstance(cmds, str):
-                cmds = CNC.breakLine(cmds)
+            elif words is not None:
+                cmds = words
             else:
                 new.append(line)
                 continue
@@ -3504,41 +4463,111 @@ class GCode:
             self.cnc.motionStart(cmds)
             if (autolevel and self.cnc.gcode in (0, 1, 2, 3)
                     and self.cnc.mval == 0):
-                xyz = self.cnc.motionPath()
-                if not xyz:
+                motion = self.autolevelMotion(self.cnc, cmds)
+                if motion is None:
                     # while auto-levelling, do not ignore non-movement
                     # commands, just append the line as-is
                     new.append(line)
                 else:
-                    extra = ""
-                    for c in cmds:
-                        if (c[0].upper() not in
-                                ("G", "X", "Y", "Z", "I", "J", "K", "R")):
-                            extra += c
-                    x1, y1, z1 = xyz[0]
-                    if self.cnc.gcode == 0:
-                        g = 0
-                    else:
-                        g = 1
-                    for x2, y2, z2 in xyz[1:]:
-                        for x, y, z in self.probe.splitLine(x1, y1, z1, x2,
-                                                            y2, z2):
-                            new.append(
-                                "".join([
-                                    f"G{int(g)}",
-                                    f"{self.fmt('X', x / self.cnc.unit)}",
-                                    f"{self.fmt('Y', y / self.cnc.unit)}",
-                                    f"{self.fmt('Z', z / self.cnc.unit)}",
-                                    extra,
-                                ])
-                            )
-                            extra = ""
-                        x1, y1, z1 = x2, y2, z2
+                    # placeholder filled once the whole block is split
+                    new.append(len(motions))
+                    motions.append(motion)
                 self.cnc.motionEnd()
             else:
                 self.cnc.motionEnd()
                 new.append(line)
-        return new
+
+        if not motions:
+            return new
+        split = self.autolevelMotions(motions)
+        lines = []
+        for line in new:
+            if isinstance(line, int):
+                lines.extend(split[line])
+            else:
+                lines.append(line)
+        return lines
+
+    # ----------------------------------------------------------------------
+    # Return the motion to be autolevelled for the current cnc state
+    # as (xyz, g, extra, unit) or None if the line doesn't move
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def autolevelMotion(cnc, cmds):
+        xyz = cnc.motionPath()
+        if not xyz:
+            return None
+        extra = ""
+        for c in cmds:
+            if (c[0].upper() not in
+                    ("G", "X", "Y", "Z", "I", "J", "K", "R")):
+                extra += c
+        if cnc.gcode == 0:
+            g = 0
+        else:
+            g = 1
+        return xyz, g, extra, cnc.unit
+
+    # ----------------------------------------------------------------------
+    # Split a list of motions on the probe grid correcting the Z.
+    # All segments are processed at once when numpy is available
+    # @return a list of the new gcode lines for every motion
+    # ----------------------------------------------------------------------
+    def autolevelMotions(self, motions):
+        fmt = self.fmt
+        result = []
+        if numpy is None:
+            for xyz, g, extra, unit in motions:
+                lines = []
+                x1, y1, z1 = xyz[0]
+                for x2, y2, z2 in xyz[1:]:
+                    for x, y, z in self.probe.splitLine(x1, y1, z1,
+                                                        x2, y2, z2):
+                        lines.append("".join([
+                            f"G{int(g)}",
+                            fmt("X", x / unit),
+                            fmt("Y", y / unit),
+                            fmt("Z", z / unit),
+                            extra,
+                        ]))
+                        extra = ""
+                    x1, y1, z1 = x2, y2, z2
+                result.append(lines)
+            return result
+
+        p1 = []
+        p2 = []
+        owner = []
+        for k, (xyz, g, extra, unit) in enumerate(motions):
+            p1.extend(xyz[:-1])
+            p2.extend(xyz[1:])
+            owner.extend([k] * (len(xyz) - 1))
+        result = [[] for m in motions]
+        if not p1:
+            return result
+
+        points, seg = self.probe.splitLines(p1, p2)
+        owner = numpy.array(owner)[seg]
+        unit = numpy.array([m[3] for m in motions])[owner]
+        # same as fmt() but rounding all the coordinates at once
+        points = numpy.round(points / unit[:, None], CNC.digits).tolist()
+
+        last = -1
+        for k, (x, y, z) in zip(owner.tolist(), points):
+            xyz, g, extra, unit = motions[k]
+            if k == last:
+                extra = ""
+            last = k
+            result[k].append("".join([
+                f"G{int(g)}X",
+                ("%f" % x).rstrip("0").rstrip("."),
+                "Y",
+                ("%f" % y).rstrip("0").rstrip("."),
+                "Z",
+                ("%f" % z).rstrip("0").rstrip("."),
+                extra,
+            ]))
+        return result
 
     # ----------------------------------------------------------------------
     # Execute autolevel on selected blocks
@@ -4204,36 +5233,61 @@ class GCode:
     # ----------------------------------------------------------------------
     def reverse(self, items):
         undoinfo = []
-        remove = ["cut", "climb", "conventional", "cw", "ccw", "reverse"]
         for bid in items:
-            operation = "reverse"
-
             if self.blocks[bid].name() in ("Header", "Footer"):
                 continue
-            newpath = Path(self.blocks[bid].name())
-
-            # Not sure if this is good idea...
-            # Might get confusing if something goes wrong,
-            # but seems to work fine
-            if self.blocks[bid].operationTest("conventional"):
-                operation += ",climb"
-            if self.blocks[bid].operationTest("climb"):
-                operation += ",conventional"
-            if self.blocks[bid].operationTest("cw"):
-                operation += ",ccw"
-            if self.blocks[bid].operationTest("ccw"):
-                operation += ",cw"
-
-            for path in self.toPath(bid):
-                path.invert()
-                newpath.extend(path)
-            if newpath:
-                block = self.fromPath(newpath)
-                undoinfo.append(
-                    self.addBlockOperationUndo(bid, operation, remove))
-                undoinfo.append(self.setBlockLinesUndo(bid, block))
+            undoinfo.extend(self.reverseBlockUndo(bid))
         self.addUndo(undoinfo)
 
+    # ----------------------------------------------------------------------
+    # Reverse direction of cut of a block
+    # ----------------------------------------------------------------------
+    def reverseBlockUndo(self, bid):
+        undoinfo = []
+        remove = ["cut", "climb", "conventional", "cw", "ccw", "reverse"]
+        operation = "reverse"
+        newpath = Path(self.blocks[bid].name())
+
+        # Not sure if this is good idea...
+        # Might get confusing if something goes wrong,
+        # but seems to work fine
+        if self.blocks[bid].operationTest("conventional"):
+            operation += ",climb"
+        if self.blocks[bid].operationTest("climb"):
+            operation += ",conventional"
+        if self.blocks[bid].operationTest("cw"):
+            operation += ",ccw"
+        if self.blocks[bid].operationTest("ccw"):
+            operation += ",cw"
+
+        for path in self.toPath(bid):
+            path.invert()
+            newpath.extend(path)
+        if newpath:
+            block = self.fromPath(newpath)
+            undoinfo.append(
+                self.addBlockOperationUndo(bid, operation, remove))
+            undoinfo.append(self.setBlockLinesUndo(bid, block))
+        return undoinfo
+
+    # ----------------------------------------------------------------------
+    # reverseBlockUndo rebuilds the block from its path, which keeps only
+    # the xy motions at the surface. The block reverses without losing any
+    # depth, feed or other word only if it is rebuilt unchanged forwards
+    # @return True if the block is rebuilt unchanged from its path
+    # ----------------------------------------------------------------------
+    def reversibleBlock(self, bid):
+        block = self.blocks[bid]
+        if block.name() in ("Header", "Footer"):
+            return False
+        newpath = Path(block.name())
+        for path in self.toPath(bid):
+            newpath.extend(path)
+        if not newpath:
+            return False
+        lines = [line.strip() for line in self.fromPath(newpath)]
+        return lines == [line.strip() for line in block]
+
     # ----------------------------------------------------------------------
     # Change cut direction
     # 1     CW
@@ -4338,9 +5392,12 @@ class GCode:
     # ----------------------------------------------------------------------
     # make a profile on block
     # offset +/- defines direction = tool/2
+    # method OFFSET_POLYGON offsets the paths of a block as one area, the
+    # paths nested in others being islands
     # return new blocks inside the blocks list
     # ----------------------------------------------------------------------
-    def profile(self, blocks, offset, overcut=False, name=None, pocket=False):
+    def profile(self, blocks, offset, overcut=False, name=None, pocket=False,
+                method=OFFSET_PATH):
         undoinfo = []
         msg = ""
         newblocks = []
@@ -4360,6 +5417,7 @@ class GCode:
             if self.blocks[bid].name() in ("Header", "Footer"):
                 continue
             newpath = []
+            paths = []
             for path in self.toPath(bid):
                 if name is not None:
                     newname = Block.operationName(path.name, name)
@@ -4384,10 +5442,19 @@ class GCode:
                         if msg:
                             msg += "\n"
                         msg += m
+                    if method == OFFSET_POLYGON:
+                        # an open path has no area to offset
+                        continue
 
+                if method == OFFSET_POLYGON:
+                    path.name = newname
+                    paths.append(path)
+                    continue
                 opath = path.offsetClean(offset, overcut, newname)
                 if opath:
                     newpath.extend(opath)
+            if paths:
+                newpath = self._profilePolygon(paths, offset, overcut)
             if newpath:
                 # remember length to shift all new blocks the are inserted
                 # before
@@ -4409,7 +5476,8 @@ class GCode:
         # and profile
         if pocket:
             msg = msg + self.pocket(
-                sorted(newblocks), CNC.vars["diameter"], CNC.vars["stepover"] / 100, name, True, True
+                sorted(newblocks), CNC.vars["diameter"], CNC.vars["stepover"] / 100, name, True, True,
+                method
             )
             withpocketblocks=sorted(newblocks).copy()
             for i in range(0,len(withpocketblocks)):
@@ -4420,43 +5488,81 @@ class GCode:
         return msg
 
     # ----------------------------------------------------------------------
-    # Generate a pocket path
+    # Profile of the closed paths of a block offset as one area
+    # @return list of paths, CCW outside and CW inside (conventional)
     # ----------------------------------------------------------------------
-    def _pocket(self, path, diameter, stepover, depth):
-        # FIXME: recursions are slow and shall be avoided! Replace recursion
-        #        via a loop!
-
-        # python's internal recursion limit hit us before bCNC's
-        # limit came to place
-        # so i increased python's limit to bCNC's limit + 100
-        maxdepth = 10000
-        import sys
-
-        sys.setrecursionlimit(max(sys.getrecursionlimit(), maxdepth + 100))
-
-        newpath = []
-        if depth > maxdepth:
-            return None
-        if depth == 0:
-            offset = diameter / 2.0
-        else:
-            offset = diameter * stepover
-
-        opath = path.offset(offset)
-
-        if not opath:
-            return None
-
-        opath.intersectSelf()
-        opath.removeExcluded(path, offset)
-        opath.removeZeroLength(abs(offset) / 100.0)
-        opath = opath.split2contours()
+    @staticmethod
+    def _profilePolygon(paths, offset, overcut=False):
+        opaths = polyoffset.offset(paths, offset, name=paths[0].name)
+        for opath in opaths:
+            if overcut:
+                opath.overcut(-offset)
+            if offset < 0.0:
+                # the area is on the left, the tool must be on the right
+                opath.invert()
+        return opaths
+
+    # ----------------------------------------------------------------------
+    # Generate the pocket paths of a list of (path, diameter)
+    # The rings are generated level by level from a work queue: the first
+    # ring is offset by the tool radius and every contour left is offset
+    # again by the stepover. The contours of a level are independent and
+    # are offset in a process pool when there are enough of them. The rings
+    # are then joined from the innermost outwards.
+    # @return list with the pocket paths of every path
+    # ----------------------------------------------------------------------
+    def _pocket(self, paths, stepover):
+        rings = []  # path, diameter and depth of every ring
+        children = []  # contours of the next level, None if nothing left
+        queue = []
+        for path, diameter in paths:
+            queue.append(len(rings))
+            rings.append((path, diameter, 0))
+            children.append(None)
+
+        executor = None
+        try:
+            while queue:
+                jobs = []
+                for i in queue:
+                    path, diameter, depth = rings[i]
+                    if depth == 0:
+                        jobs.append((path, diameter / 2.0))
+                    else:
+                        jobs.append((path, diameter * stepover))
+                if executor is None and self._pocketParallel(jobs):
+                    executor = ProcessPoolExecutor(
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+                contours = self._pocketRings(jobs, executor)
 
-#        if not opath:
-#            return None
-        if opath:
-            for pout in opath:
-                pin = self._pocket(pout, diameter, stepover, depth + 1)
+                level = []
+                for i, opath in zip(queue, contours):
+                    path, diameter, depth = rings[i]
+                    if opath is None:
+                        continue
+                    children[i] = []
+                    for pout in opath:
+                        children[i].append(len(rings))
+                        if depth < POCKET_MAXDEPTH:
+                            level.append(len(rings))
+                        rings.append((pout, diameter, depth + 1))
+                        children.append(None)
+                queue = level
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        # join the rings, the children are always after their parent
+        result = [None] * len(rings)
+        for i in range(len(rings) - 1, -1, -1):
+            if children[i] is None:
+                continue
+            newpath = []
+            for j in children[i]:
+                pout = rings[j][0]
+                pin = result[j]
+                result[j] = None
                 if not pin:
                     newpath.append(pout)
 
@@ -4479,20 +5585,73 @@ class GCode:
                     # pin[-1].join(pout)
                     newpath.extend(pin)
                     newpath.append(pout)
+            result[i] = newpath
+        return [result[i] or [] for i in range(len(paths))]
+
+    # ----------------------------------------------------------------------
+    # @return True if the ring is worth offsetting in a process pool
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _pocketParallel(jobs):
+        if ProcessPoolExecutor is None or len(jobs) < POCKET_PARALLEL:
+            return False
+        if (os.cpu_count() or 1) < 2:
+            return False
+        return sum(len(path) for path, offset in jobs) >= POCKET_SEGMENTS
+
+    # ----------------------------------------------------------------------
+    # Offset the contours of a ring, in the process pool if any
+    # @return the list of contours left for every job
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _pocketRings(jobs, executor=None):
+        if executor is not None and len(jobs) >= POCKET_PARALLEL:
+            paths, offsets = zip(*jobs)
+            try:
+                return list(executor.map(offsetContours, paths, offsets))
+            except Exception:
+                # e.g. the pool cannot start, continue serially
+                pass
+        return [offsetContours(path, offset) for path, offset in jobs]
+
+    # ----------------------------------------------------------------------
+    # Pocket of the closed paths of a block as one area, the paths nested
+    # in others being islands. Every ring is offset from the paths, by the
+    # tool radius and one stepover more than the previous ring
+    # @return list of paths, from the innermost ring outwards, CW
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _pocketPolygon(paths, diameter, stepover):
+        step = abs(diameter) * stepover
+        rings = polyoffset.rings(
+            paths, -abs(diameter) / 2.0, -step, POCKET_MAXDEPTH,
+            name=paths[0].name
+        )
+        newpath = []
+        for ring in reversed(rings):
+            for opath in ring:
+                opath.invert()  # turn to CW (conventional)
+                newpath.append(opath)
         return newpath
 
     # ----------------------------------------------------------------------
     # make a pocket on block
+    # method OFFSET_POLYGON pockets the paths of a block as one area
     # return new blocks inside the blocks list
     # ----------------------------------------------------------------------
-    def pocket(self, blocks, diameter, stepover, name, nested=False, updown=False):
+    def pocket(self, blocks, diameter, stepover, name, nested=False, updown=False,
+               method=OFFSET_PATH):
         undoinfo = []
         msg = ""
         newblocks = []
+
+        # collect the paths of all the blocks to pocket them at once
+        pockets = []  # (bid, number of paths)
+        paths = []
         for bid in reversed(blocks):
             if self.blocks[bid].name() in ("Header", "Footer"):
                 continue
-            newpath = []
+            before = len(paths)
             for path in self.toPath(bid):
                 if not path.isClosed():
                     m = f"Path: '{path.name}' is OPEN"
@@ -4531,8 +5690,31 @@ class GCode:
                 else:
                     path.name = Block.operationName(path.name, name, remove)
 
-                newpath.extend(self._pocket(path, -D * diameter, stepover, 0))
+                paths.append((path, -D * diameter))
+            pockets.append((bid, len(paths) - before))
+
+        newpaths = []
+        if method == OFFSET_POLYGON:
+            first = 0
+            for bid, n in pockets:
+                if n:
+                    newpaths.append(self._pocketPolygon(
+                        [path for path, D in paths[first:first + n]],
+                        diameter, stepover))
+                else:
+                    newpaths.append([])
+                first += n
+        else:
+            result = self._pocket(paths, stepover)
+            first = 0
+            for bid, n in pockets:
+                newpath = []
+                for pin in result[first:first + n]:
+                    newpath.extend(pin)
+                newpaths.append(newpath)
+                first += n
 
+        for (bid, n), newpath in zip(pockets, newpaths):
             if newpath:
                 # remember length to shift all new blocks
                 # the are inserted before
@@ -5043,166 +6225,400 @@ class GCode:
         pass
 
     # ----------------------------------------------------------------------
-    # Re-arrange using genetic algorithms a set of blocks to minimize
-    # rapid movements.
+    # Re-arrange a set of blocks to minimize the rapid movements, with a
+    # nearest neighbour tour improved by 2-opt and Or-opt moves. The first
+    # block stays in place. With reverse the open blocks that reverse
+    # without losing anything (see reversibleBlock) may be reversed
     # ----------------------------------------------------------------------
-    def optimize(self, items):
+    def optimize(self, items, reverse=False, timeout=tour.OPTIMIZE_TIME):
         n = len(items)
-
-        matrix = []
-        for i in range(n):
-            matrix.append([0.0] * n)
-
-        # Find distances between blocks (end to start)
-        for i in range(n):
-            block = self.blocks[items[i]]
-            x1 = block.ex
-            y1 = block.ey
-            for j in range(n):
-                if i == j:
-                    continue
-                block = self.blocks[items[j]]
-                x2 = block.sx
-                y2 = block.sy
-                dx = x1 - x2
-                dy = y1 - y2
-                # Compensate for machines, which have different
-                # speed of X and Y:
-                dx /= CNC.feedmax_x
-                dy /= CNC.feedmax_y
-                matrix[i][j] = sqrt(dx * dx + dy * dy)
-
-        best = [0]
-        unvisited = list(range(1, n))
-        while unvisited:
-            last = best[-1]
-            row = matrix[last]
-            # from all the unvisited places search the closest one
-            mindist = 1e30
-            for i, u in enumerate(unvisited):
-                d = row[u]
-                if d < mindist:
-                    mindist = d
-                    si = i
-            best.append(unvisited.pop(si))
-
+        starts = []
+        ends = []
+        reversible = []
+        for bid in items:
+            block = self.blocks[bid]
+            # Compensate for machines, which have different
+            # speed of X and Y:
+            start = (block.sx / CNC.feedmax_x, block.sy / CNC.feedmax_y)
+            end = (block.ex / CNC.feedmax_x, block.ey / CNC.feedmax_y)
+            if abs(block.ex - block.sx) + abs(block.ey - block.sy) < 1e-6:
+                end = start  # closed
+            starts.append(start)
+            ends.append(end)
+            reversible.append(
+                reverse and end != start and self.reversibleBlock(bid))
+
+        best, flips = tour.optimize(starts, ends, reversible, timeout)
+
+        # move the blocks with swaps, at[i] is the block now in slot i
         undoinfo = []
-        for i in range(len(best)):
-            b = best[i]
-            if i == b:
+        at = list(range(n))
+        where = list(range(n))
+        for i in range(n):
+            j = where[best[i]]
+            if i == j:
                 continue
-            ptr = best.index(i)
-            undoinfo.append(self.swapBlockUndo(items[i], items[b]))
-            best[i], best[ptr] = best[ptr], best[i]
+            undoinfo.append(self.swapBlockUndo(items[i], items[j]))
+            at[i], at[j] = at[j], at[i]
+            where[at[i]] = i
+            where[at[j]] = j
+        for b in flips:
+            undoinfo.extend(self.reverseBlockUndo(items[where[b]]))
         self.addUndo(undoinfo, "Optimize")
 
     # ----------------------------------------------------------------------
-    # Use probe information to modify the g-code to autolevel
+    # Compile the enabled blocks and send them to the queue
+    # @return the list of paths (bid,lid) of every queued command
+    #         None if stopFunc requested to abort
     # ----------------------------------------------------------------------
     def compile(self, queue, stopFunc=None):
         paths = []
+        every = 1
+        for line, path in self.compileIter():
+            every -= 1
+            if every <= 0:
+                if stopFunc is not None and stopFunc():
+                    return None
+                every = 50
+            queue.put(line)
+            paths.append(path)
+        return paths
 
-        def add(line, path):
-            if line is not None:
-                if isinstance(line, str):
-                    queue.put(line + "\n")
+    # ----------------------------------------------------------------------
+    # Estimate the number of commands compileIter() will generate.
+    # Expansions (autolevel, canned cycles, tool changes) are not counted.
+    # @param start    (bid,lid) to count from the line resumed
+    # @param preamble lines sent before resuming, see resumePreamble()
+    # ----------------------------------------------------------------------
+    def countLines(self, start=None, preamble=()):
+        n = len(CNC.compile(CNC.startup.splitlines() + list(preamble)))
+        bid, lid = start or (0, 0)
+        for i, block in enumerate(self.blocks[bid:], bid):
+            if not block.enable and i != bid:
+                continue
+            for j in range(lid if i == bid else 0, len(block)):
+                if block.compiled(j)[0] is not None:
+                    n += 1
+        return n
+
+    # ----------------------------------------------------------------------
+    # Estimate the execution time of the enabled blocks with the kinematic
+    # planner, following them as they are streamed. Updates the block times
+    # and the total time in minutes, the disabled blocks keep their
+    # feed only estimate
+    # @return the time of the enabled blocks in minutes
+    # ----------------------------------------------------------------------
+    def estimateTime(self, app=None):
+        cnc = copy.copy(self.cnc)
+        cnc.vars = CNC.vars.copy()  # private feedmode
+        cnc.initPath()
+        planner = Planner.machine()
+        marks = []  # (block, first segment, dwell in s)
+        for block in self.blocks:
+            if not block.enable:
+                continue
+            first = len(planner)
+            dwell = 0.0
+            for j in range(len(block)):
+                try:
+                    cmd, words, comment = block.compiled(j)
+                    if words is not None:
+                        cmd = words
+                    else:
+                        cmd = self.evaluate(cmd, app)
+                        if isinstance(cmd, tuple):
+                            cmd = None
+                        else:
+                            cmd = CNC.breakLine(cmd)
+                except Exception:
+                    cmd = None
+                if cmd is None:
+                    continue
+
+                cnc.motionStart(cmd)
+                xyz = cnc.motionPath()
+                cnc.motionEnd()
+                if CNC.hasGcode(cmd, 4):  # dwell
+                    dwell += cnc.pval
+                    planner.stop()
+                elif cnc.mval:
+                    planner.stop()  # controller waits for the spindle...
+                if not xyz:
+                    continue
+                if cnc.gcode == 0:
+                    planner.add(xyz)
+                elif cnc.feedmode == 93 and cnc.feed > 0.0:
+                    # inverse time, the whole motion lasts 1/F minutes
+                    length = sum(
+                        math.dist(a, b) for a, b in zip(xyz, xyz[1:]))
+                    planner.add(xyz, length * cnc.feed)
                 else:
-                    queue.put(line)
-            paths.append(path)
+                    planner.add(xyz, cnc.feed)
+            marks.append((block, first, dwell))
+
+        times = [0.0]
+        times.extend(itertools.accumulate(planner.plan()))
+        marks.append((None, len(planner), 0.0))
+        for (block, first, dwell), (_next, last, _d) in zip(
+            marks, marks[1:]
+        ):
+            block.time = (times[last] - times[first] + dwell) / 60.0
+        self.cnc.totalTime = sum(block.time for block in self.blocks)
+        return (times[-1] + sum(m[2] for m in marks)) / 60.0
+
+    # ----------------------------------------------------------------------
+    # @return the (bid, lid) of the program line number n starting from 1,
+    #         counting the lines of all blocks in order
+    # ----------------------------------------------------------------------
+    def lineIndex(self, n):
+        n -= 1
+        for bid, block in enumerate(self.blocks):
+            if n < len(block):
+                return bid, max(n, 0)
+            n -= len(block)
+        raise IndexError(_("Line number out of range"))
+
+    # ----------------------------------------------------------------------
+    # Interpreter state just before the line (bid, lid) of a run.
+    # The canvas saves the state at the start of every block and every
+    # RESUME_CHECKPOINT lines, so only the lines from the closest saved
+    # state are executed. A state after a disabled block cannot be used
+    # as the run skips the disabled blocks
+    # @return a copy of the cnc
+    # ----------------------------------------------------------------------
+    def resumeState(self, bid, lid, app=None):
+        cnc = copy.copy(self.cnc)
+        cnc.initPath()
+        last = bid
+        for k in range(bid):
+            if not self.blocks[k].enable:
+                last = k
+                break
+
+        # closest saved state
+        first = 0
+        line = 0
+        for k in range(last, -1, -1):
+            info = self.blocks[k]._drawState
+            if info is None:
+                continue
+            state = info[0][0]
+            first = k
+            if k == bid:
+                for j, checkpoint in info[6]:
+                    if j > lid:
+                        break
+                    state = checkpoint[0]
+                    line = j
+            cnc.__dict__.update(state)
+            break
+
+        for k in range(first, bid + 1):
+            block = self.blocks[k]
+            if not block.enable and k != bid:
+                continue
+            end = lid if k == bid else len(block)
+            for j in range(line, end):
+                cmds, words, comment = block.compiled(j)
+                if words is not None:
+                    cmds = words
+                elif cmds is None or isinstance(cmds, tuple):
+                    continue
+                else:
+                    try:
+                        cmds = self.evaluate(cmds, app)
+                    except Exception:
+                        continue
+                    if not isinstance(cmds, str):
+                        continue
+                    cmds = CNC.breakLine(cmds)
+                cnc.motionStart(cmds)
+                cnc.motionEnd()
+            line = 0
+        return cnc
+
+    # ----------------------------------------------------------------------
+    # Lines restoring the modal state of cnc and moving safely to its
+    # position: raise to the safe height, start the spindle, move above
+    # and plunge with the feed. An arc motion mode is not restored, as G2
+    # or G3 without axis words is an error, compileIter() prefixes it to
+    # the first resumed motion instead
+    # ----------------------------------------------------------------------
+    def resumePreamble(self, cnc):
+        unit = cnc.unit
+        inches = abs(unit - (1.0 if CNC.inch else 25.4)) < TOLERANCE
+        lines = [
+            "G20" if inches else "G21",
+            f"G{cnc.wcs}",
+            ("G17", "G18", "G19")[cnc.plane],
+            "G90 G94",
+        ]
+        if cnc.tool:
+            lines.append(f"T{cnc.tool}")
+
+        z = cnc.z
+        if not self.probe.isEmpty():
+            z += self.probe.interpolate(cnc.x, cnc.y)
+        safe = max(CNC.vars["safe"], z)
+        lines.append(CNC.grapid(z=safe / unit))
+        if cnc.spindle in (3, 4):
+            lines.append(f"M{cnc.spindle} S{cnc.sval:g}")
+            lines.append(CNC._gcode(4, p=RESUME_DWELL))
+        if cnc.coolant in (7, 8):
+            lines.append(f"M{cnc.coolant}")
+        lines.append(CNC.grapid(cnc.x / unit, cnc.y / unit))
+        if cnc.feedmode != 94:
+            # the feed is inverse time or per revolution
+            lines.append(CNC.gline(z=z / unit, f=CNC.vars["cutfeedz"]))
+        elif cnc.feed > 0.0:
+            lines.append(CNC.gline(z=z / unit, f=cnc.feed / unit))
+        else:
+            lines.append(CNC.grapid(z=z / unit))
+
+        # remaining modal state
+        modal = []
+        if cnc.gcode in (0, 1):
+            modal.append(f"G{cnc.gcode}")
+        if not cnc.absolute:
+            modal.append("G91")
+        if cnc.arcabsolute:
+            modal.append("G90.1")
+        if not cnc.retractz:
+            modal.append("G99")
+        if cnc.feedmode == 95:
+            modal.append(f"G95 {self.fmt('F', cnc.feed / unit)}")
+        elif cnc.feedmode != 94:
+            modal.append(f"G{cnc.feedmode}")
+        if modal:
+            lines.append(" ".join(modal))
+        return lines
+
+    # ----------------------------------------------------------------------
+    # Generator compiling lazily the enabled blocks to be streamed.
+    # Uses its own copy of the cnc state so it can be consumed from
+    # the serial thread while the canvas is redrawn.
+    # Use probe information to modify the g-code to autolevel
+    # @param start (bid,lid) to resume the program from that line
+    # @param cnc   state at start from resumeState(), computed if None.
+    #              It is modified while compiling
+    # @yield (line, path) line is the string (with newline) or the compiled
+    #        command to queue, path the (bid,lid) of the line or None
+    # ----------------------------------------------------------------------
+    def compileIter(self, start=None, app=None, cnc=None):
+        if start is None:
+            cnc = copy.copy(self.cnc)
+            cnc.initPath()
+            preamble = []
+        else:
+            if cnc is None:
+                cnc = self.resumeState(*start, app)
+            preamble = self.resumePreamble(cnc)
 
         autolevel = not self.probe.isEmpty()
-        self.initPath()
-        for line in CNC.compile(self.cnc.startup.splitlines()):
-            add(line, None)
+        for line in CNC.compile(CNC.startup.splitlines() + preamble):
+            if isinstance(line, str):
+                line += "\n"
+            yield line, None
+
+        # motions to autolevel are collected and split on the probe grid
+        # in chunks, the lines in between wait in pending to keep the order
+        pending = []
+        motions = []
+        for line, path, motion in self._compileBlocks(cnc, autolevel, start):
+            if motion is None and not motions:
+                yield line, path
+                continue
+            if motion is not None:
+                line = len(motions)
+                motions.append(motion)
+            pending.append((line, path, motion))
+            if len(motions) >= AUTOLEVEL_CHUNK:
+                yield from self._autolevelPending(pending, motions)
+                pending = []
+                motions = []
+        yield from self._autolevelPending(pending, motions)
 
-        every = 1
-        for i, block in enumerate(self.blocks):
-            if not block.enable:
+    # ----------------------------------------------------------------------
+    # Yield the pending lines with the motions autolevelled
+    # ----------------------------------------------------------------------
+    def _autolevelPending(self, pending, motions):
+        if not pending:
+            return
+        split = self.autolevelMotions(motions)
+        for line, path, motion in pending:
+            if motion is None:
+                yield line, path
+            else:
+                for newline in split[line]:
+                    yield newline + "\n", path
+
+    # ----------------------------------------------------------------------
+    # Compile the enabled blocks starting from the line start=(bid,lid)
+    # @yield (line, path, motion) motion is the (xyz, g, extra, unit) to be
+    #        autolevelled in place of line, otherwise None
+    # ----------------------------------------------------------------------
+    def _compileBlocks(self, cnc, autolevel, start=None):
+        bid, lid = start or (0, 0)
+        # arc motion mode left out of the resume preamble
+        arc = f"G{cnc.gcode}" if start and cnc.gcode in (2, 3) else None
+        for i, block in enumerate(self.blocks[bid:], bid):
+            if not block.enable and i != bid:
                 continue
             for j, line in enumerate(block):
-                every -= 1
-                if every <= 0:
-                    if stopFunc is not None and stopFunc():
-                        return None
-                    every = 50
-
+                if i == bid and j < lid:
+                    continue
                 newcmd = []
-                cmds = CNC.compileLine(line)
+                cmds, words, CNC.comment = block.compiled(j)
                 if cmds is None:
                     continue
-                elif isinstance(cmds, str):
-                    cmds = CNC.breakLine(cmds)
+                elif words is not None:
+                    cmds = words
                 else:
                     # either CodeType or tuple, list[] append at it as is
                     if (isinstance(cmds, types.CodeType)
                             or isinstance(cmds, int)):
-                        add(cmds, None)
+                        yield cmds, None, None
                     else:
-                        add(cmds, (i, j))
+                        yield cmds, (i, j), None
                     continue
 
+                if arc is not None:
+                    motion, axes = CNC.motionWords(cmds)
+                    if motion:
+                        arc = None
+                    elif axes:
+                        cmds = (arc,) + tuple(cmds)
+                        arc = None
+
                 skip = False
                 expand = None
-                self.cnc.motionStart(cmds)
+                cnc.motionStart(cmds)
 
                 # FIXME append feed on cut commands. It will be obsolete
                 # in grbl v1.0
-                if CNC.appendFeed and self.cnc.gcode in (1, 2, 3):
+                if CNC.appendFeed and cnc.gcode in (1, 2, 3):
                     # Check is not existing in cmds
                     for c in cmds:
                         if c[0] in ("f", "F"):
                             break
                     else:
-                        cmds.append(
-                            self.fmt("F", self.cnc.feed / self.cnc.unit))
+                        cmds += (self.fmt("F", cnc.feed / cnc.unit),)
 
-                if (autolevel and self.cnc.gcode in (0, 1, 2, 3)
-                        and self.cnc.mval == 0):
-                    xyz = self.cnc.motionPath()
-                    if not xyz:
+                if (autolevel and cnc.gcode in (0, 1, 2, 3)
+                        and cnc.mval == 0):
+                    motion = self.autolevelMotion(cnc, cmds)
+                    if motion is None:
                         # while auto-levelling, do not ignore non-movement
                         # commands, just append the line as-is
-                        add(line, None)
+                        yield line + "\n", None, None
                     else:
-                        extra = ""
-                        for c in cmds:
-                            if c[0].upper() not in (
-                                "G",
-                                "X",
-                                "Y",
-                                "Z",
-                                "I",
-                                "J",
-                                "K",
-                                "R",
-                            ):
-                                extra += c
-                        x1, y1, z1 = xyz[0]
-                        if self.cnc.gcode == 0:
-                            g = 0
-                        else:
-                            g = 1
-                        for x2, y2, z2 in xyz[1:]:
-                            for x, y, z in self.probe.splitLine(x1, y1, z1,
-                                                                x2, y2, z2):
-                                add(
-                                    "".join([
-                                        f"G{int(g)}",
-                                        f"{self.fmt('X', x / self.cnc.unit)}",
-                                        f"{self.fmt('Y', y / self.cnc.unit)}",
-                                        f"{self.fmt('Z', z / self.cnc.unit)}",
-                                        f"{extra}",
-                                    ]),
-                                    (i, j),
-                                )
-                                extra = ""
-                            x1, y1, z1 = x2, y2, z2
-                    self.cnc.motionEnd()
+                        yield None, (i, j), motion
+                    cnc.motionEnd()
                     continue
                 else:
                     # FIXME expansion policy here variable needed
                     # Canned cycles
-                    if CNC.drillPolicy == 1 and self.cnc.gcode in (
+                    if CNC.drillPolicy == 1 and cnc.gcode in (
                         81,
                         82,
                         83,
@@ -5210,20 +6626,22 @@ class GCode:
                         86,
                         89,
                     ):
-                        expand = self.cnc.macroGroupG8X()
+                        expand = cnc.macroGroupG8X()
                     # Tool change
-                    elif self.cnc.mval == 6:
+                    elif cnc.mval == 6:
                         if CNC.toolPolicy == 0:
                             pass  # send to grbl
                         elif CNC.toolPolicy == 1:
                             skip = True  # skip whole line
                         elif CNC.toolPolicy >= 2:
-                            expand = CNC.compile(self.cnc.toolChange())
-                    self.cnc.motionEnd()
+                            expand = CNC.compile(cnc.toolChange())
+                    cnc.motionEnd()
 
                 if expand is not None:
                     for line in expand:
-                        add(line, None)
+                        if isinstance(line, str):
+                            line += "\n"
+                        yield line, None, None
                     expand = None
                     continue
                 elif skip:
@@ -5246,6 +6664,5 @@ class GCode:
                     if cmd is not None:
                         newcmd.append(cmd)
 
-                add("".join(newcmd), (i, j))
-
-        return paths
+                newcmd.append("\n")
+                yield "".join(newcmd), (i, j), None
@@ -3,9 +3,14 @@
 # Author:       vvlachoudis@gmail.com
 # Date: 24-Aug-2014
 
+import copy
+import itertools
 import math
-import time
+import queue
 import sys
+import threading
+import time
+import types
 
 from tkinter import (
     TclError,
@@ -48,19 +53,22 @@ import bmath
 import Camera
 import tkExtra
 import Utils
-from CNC import CNC
+from CNC import CNC, RESUME_CHECKPOINT, Block
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Probe mapping we need PIL and numpy
 try:
     from PIL import Image, ImageTk
-    import numpy
 
     # Resampling image based on PIL library and converting to RGB.
     # options possible: NEAREST, BILINEAR, BICUBIC, ANTIALIAS
     RESAMPLE = Image.NEAREST  # resize type
 except Exception:
     from tkinter import Image
-    numpy = None
     RESAMPLE = None
 
 ANTIALIAS_CHEAP = False
@@ -79,6 +87,12 @@ GANTRY_X = GANTRY_R * 2  # 10
 GANTRY_Y = GANTRY_R  # 5
 GANTRY_H = GANTRY_R * 5  # 20
 DRAW_TIME = 5  # Maximum draw time permitted
+DRAW_THREAD_LINES = 20000  # compute the geometry in a thread above
+DRAW_SLICE = 0.05  # s, time creating items before returning to Tk
+DRAW_POLL = 20  # ms, between the slices
+LOD_LINES = 50000  # merge motions in polylines above this number of lines
+LOD_TOLERANCE = 0.5  # pixels, simplification of the merged polylines
+LOD_REFINE = 2.0  # zoom in factor to refine again the polylines
 
 INSERT_COLOR = "Blue"
 GANTRY_COLOR = "Red"
@@ -132,6 +146,17 @@ ZOOM = 1.25
 S60 = math.sin(math.radians(60))
 C60 = math.cos(math.radians(60))
 
+# Projection matrices of the views, (x,y,z) -> (i,j)
+PROJECTION = (
+    ((1.0, 0.0), (0.0, -1.0), (0.0, 0.0)),  # XY
+    ((1.0, 0.0), (0.0, 0.0), (0.0, -1.0)),  # XZ
+    ((0.0, 0.0), (1.0, 0.0), (0.0, -1.0)),  # YZ
+    ((S60, C60), (S60, -C60), (0.0, -1.0)),  # ISO1
+    ((S60, -C60), (-S60, -C60), (0.0, -1.0)),  # ISO2
+    ((-S60, -C60), (-S60, C60), (0.0, -1.0)),  # ISO3
+)
+PROJECT_NUMPY = 64  # project with numpy paths longer than this
+
 DEF_CURSOR = ""
 MOUSE_CURSOR = {
     ACTION_SELECT: DEF_CURSOR,
@@ -152,6 +177,134 @@ def mouseCursor(action):
     return MOUSE_CURSOR.get(action, DEF_CURSOR)
 
 
+# -----------------------------------------------------------------------------
+# Return plotting coordinates for a 3d xyz path in view with zoom
+# -----------------------------------------------------------------------------
+def project(xyz, view, zoom):
+    if numpy is not None and len(xyz) > PROJECT_NUMPY:
+        flat = projectFlat(xyz, view, zoom)
+        return list(zip(flat[0::2], flat[1::2]))
+
+    coords = None
+    if view == VIEW_XY:
+        coords = [(p[0] * zoom, -p[1] * zoom) for p in xyz]
+    elif view == VIEW_XZ:
+        coords = [(p[0] * zoom, -p[2] * zoom) for p in xyz]
+    elif view == VIEW_YZ:
+        coords = [(p[1] * zoom, -p[2] * zoom) for p in xyz]
+    elif view == VIEW_ISO1:
+        coords = [
+            (
+                (p[0] * S60 + p[1] * S60) * zoom,
+                (+p[0] * C60 - p[1] * C60 - p[2]) * zoom,
+            )
+            for p in xyz
+        ]
+    elif view == VIEW_ISO2:
+        coords = [
+            (
+                (p[0] * S60 - p[1] * S60) * zoom,
+                (-p[0] * C60 - p[1] * C60 - p[2]) * zoom,
+            )
+            for p in xyz
+        ]
+    elif view == VIEW_ISO3:
+        coords = [
+            (
+                (-p[0] * S60 - p[1] * S60) * zoom,
+                (-p[0] * C60 + p[1] * C60 - p[2]) * zoom,
+            )
+            for p in xyz
+        ]
+    # Check limits
+    for i, (x, y) in enumerate(coords):
+        if abs(x) > MAXDIST or abs(y) > MAXDIST:
+            if x < -MAXDIST:
+                x = -MAXDIST
+            elif x > MAXDIST:
+                x = MAXDIST
+            if y < -MAXDIST:
+                y = -MAXDIST
+            elif y > MAXDIST:
+                y = MAXDIST
+            coords[i] = (x, y)
+    return coords
+
+
+# -----------------------------------------------------------------------------
+# Same as project() returning the flat list of coordinates [x0,y0,x1,y1,...]
+# as expected by Tk. Long paths are projected with a single matrix product
+# -----------------------------------------------------------------------------
+def projectFlat(xyz, view, zoom):
+    if numpy is None or len(xyz) <= PROJECT_NUMPY:
+        return list(itertools.chain.from_iterable(project(xyz, view, zoom)))
+    array = numpy.fromiter(
+        itertools.chain.from_iterable(xyz), float, 3 * len(xyz)
+    ).reshape(-1, 3)
+    coords = array.dot(numpy.array(PROJECTION[view]) * zoom)
+    numpy.clip(coords, -MAXDIST, MAXDIST, out=coords)
+    return coords.ravel().tolist()
+
+
+# -----------------------------------------------------------------------------
+# Simplify a polyline of screen coordinates with the Douglas-Peucker
+# algorithm keeping only the points deviating more than tolerance pixels
+# @param coords list of (x,y)
+# @return the new list of (x,y)
+# -----------------------------------------------------------------------------
+def simplify(coords, tolerance=LOD_TOLERANCE):
+    if len(coords) <= 2:
+        return coords
+    t2 = tolerance * tolerance
+
+    # cheap first pass, drop points too close to the previous one
+    px, py = coords[0]
+    pts = [coords[0]]
+    for x, y in coords[1:-1]:
+        if (x - px) ** 2 + (y - py) ** 2 > t2:
+            pts.append((x, y))
+            px = x
+            py = y
+    pts.append(coords[-1])
+    n = len(pts)
+    if n <= 2:
+        return pts
+
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = pts[first]
+        dx = pts[last][0] - x1
+        dy = pts[last][1] - y1
+        d2 = dx * dx + dy * dy
+        worst = t2
+        index = -1
+        for k in range(first + 1, last):
+            x, y = pts[k]
+            x -= x1
+            y -= y1
+            # distance from the segment, toolpaths often go back and forth
+            if d2 > 0.0:
+                t = (x * dx + y * dy) / d2
+                if t < 0.0:
+                    t = 0.0
+                elif t > 1.0:
+                    t = 1.0
+                x -= t * dx
+                y -= t * dy
+            dist = x * x + y * y
+            if dist > worst:
+                worst = dist
+                index = k
+        if index >= 0:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(pts, keep) if k]
+
+
 # =============================================================================
 # Raise an alarm exception
 # =============================================================================
@@ -212,6 +365,17 @@ class CNCCanvas(Canvas):
         self.zoom = 1.0
         self.__tzoom = 1.0  # delayed zoom (temporary)
         self._items = {}
+        self._xyz = {}  # 3D points of the path items
+        self._lod = set()  # simplified path items
+        self._lodZoom = 1.0  # zoom the polylines were simplified for
+        self._drawGen = 0  # drawing generation, to cancel the drawing thread
+        self._drawing = False  # paths are being drawn in the background
+        self._drawItems = None
+        self._drawZoom = 1.0  # zoom of the coordinates from the thread
+        self._fitPending = False  # fit to screen once drawing is finished
+        self._drawnBlocks = None  # blocks of the last complete drawing
+        self._drawingBlocks = None  # blocks drawn in the background
+        self._drawLod = False  # last drawing merged the motions
 
         self._x = self._y = 0
         self._xp = self._yp = 0
@@ -861,8 +1025,7 @@ class CNCCanvas(Canvas):
         x0 = self.canvasx(0)
         y0 = self.canvasy(0)
 
-        for i in self.find_all():
-            self.scale(i, 0, 0, zoom, zoom)
+        self.scale(ALL, 0, 0, zoom, zoom)
 
         # Update last insert
         if self._lastGantry:
@@ -870,6 +1033,12 @@ class CNCCanvas(Canvas):
         else:
             self._drawGantry(0, 0)
 
+        # Refine the merged polylines when zooming in
+        if self._lod and self.zoom > self._lodZoom * LOD_REFINE:
+            self._lodZoom = self.zoom
+            for item in self._lod:
+                self.coords(item, simplify(self.plotCoords(self._xyz[item])))
+
         self._updateScrollBars()
         x0 -= self.canvasx(0)
         y0 -= self.canvasy(0)
@@ -916,6 +1085,9 @@ class CNCCanvas(Canvas):
     # New approach by onekk https://github.com/vlachoudis/bCNC/issues/1311
     def fit2Screen(self, event=None):
         """Zoom to Fit to Screen"""
+        if self._drawing:
+            self._fitPending = True
+            return
 
         bb = self.selBbox()
         if bb is None:
@@ -1386,7 +1558,6 @@ class CNCCanvas(Canvas):
         if view is not None:
             self.view = view
 
-        self._last = (0.0, 0.0, 0.0)
         self.initPosition()
 
         self.drawPaths()
@@ -1410,6 +1581,68 @@ class CNCCanvas(Canvas):
 
         self._inDraw = False
 
+    # ----------------------------------------------------------------------
+    # Switch view by re-projecting the cached 3D points of the paths,
+    # without evaluating the gcode again
+    # @return False if the paths have to be drawn from scratch
+    # ----------------------------------------------------------------------
+    def changeView(self, view):
+        if self._inDraw or self._drawing or view == self.view:
+            return False
+        self._inDraw = True
+
+        self.__tzoom = 1.0
+        xyz = self.canvas2xyz(
+            self.canvasx(self.winfo_width() / 2),
+            self.canvasy(self.winfo_height() / 2)
+        )
+        self.view = view
+
+        # keep only the paths, everything else is view dependent
+        self.delete(*[i for i in self.find_all() if i not in self._xyz])
+        self._cameraImage = None
+        self._lastInsert = None
+        self._select = None
+        self._vector = None
+        self.createGantry()
+
+        # project all the points at once
+        items = list(self._xyz.items())
+        coords = projectFlat(
+            [p for item, points in items for p in points],
+            self.view, self.zoom)
+        start = 0
+        for item, points in items:
+            end = start + 2 * len(points)
+            if item in self._lod:
+                self.coords(item, simplify(list(zip(
+                    coords[start:end:2], coords[start + 1:end:2]))))
+            else:
+                self.coords(item, coords[start:end])
+            start = end
+        self._lodZoom = self.zoom
+
+        self.drawGrid()
+        self.drawMargin()
+        self.drawWorkarea()
+        self.drawProbe()
+        self.drawOrient()
+        self.drawAxes()
+        if self._gantry1:
+            self.tag_raise(self._gantry1)
+        if self._gantry2:
+            self.tag_raise(self._gantry2)
+        self._updateScrollBars()
+
+        ij = self.plotCoords([xyz])[0]
+        dx = int(round(self.canvasx(self.winfo_width() / 2) - ij[0]))
+        dy = int(round(self.canvasy(self.winfo_height() / 2) - ij[1]))
+        self.scan_mark(0, 0)
+        self.scan_dragto(int(round(dx)), int(round(dy)), 1)
+
+        self._inDraw = False
+        return True
+
     # ----------------------------------------------------------------------
     # Initialize gantry position
     # ----------------------------------------------------------------------
@@ -1417,6 +1650,23 @@ class CNCCanvas(Canvas):
         self.configure(background=CANVAS_COLOR)
         self.delete(ALL)
         self._cameraImage = None
+        self.createGantry()
+
+        self._lastInsert = None
+        self._lastActive = None
+        self._select = None
+        self._vector = None
+        self._items.clear()
+        self._xyz.clear()
+        self._lod.clear()
+        self._lodZoom = self.zoom
+        self.cnc.initPath()
+        self.cnc.resetAllMargins()
+
+    # ----------------------------------------------------------------------
+    # Create the gantry items for the current view
+    # ----------------------------------------------------------------------
+    def createGantry(self):
         gr = max(3, int(CNC.vars["diameter"] / 2.0 * self.zoom))
         if self.view == VIEW_XY:
             self._gantry1 = self.create_oval(
@@ -1442,14 +1692,6 @@ class CNCCanvas(Canvas):
                     (-gx, -gh, 0, 0, gx, -gh), width=2, fill=GANTRY_COLOR
                 )
 
-        self._lastInsert = None
-        self._lastActive = None
-        self._select = None
-        self._vector = None
-        self._items.clear()
-        self.cnc.initPath()
-        self.cnc.resetAllMargins()
-
     # ----------------------------------------------------------------------
     # Draw gantry location
     # ----------------------------------------------------------------------
@@ -1775,9 +2017,10 @@ class CNCCanvas(Canvas):
             )
             self.tag_lower(item)
 
-        # Draw image map if numpy exists
+        # Draw image map if numpy and PIL exist
         if (
             numpy is not None
+            and RESAMPLE is not None
             and probe.matrix
             and self.view in (VIEW_XY, VIEW_ISO1, VIEW_ISO2, VIEW_ISO3)
         ):
@@ -1898,96 +2141,290 @@ class CNCCanvas(Canvas):
     # Draw the paths for the whole gcode file
     # ----------------------------------------------------------------------
     def drawPaths(self):
+        # cancel any drawing in progress
+        self._drawGen += 1
+        self._drawing = False
+        # the items are deleted, forget them also in the blocks removed
+        # since the last drawing, they may come back e.g. with an undo
+        for blocks in (self._drawnBlocks, self._drawingBlocks):
+            for block in blocks or ():
+                block.resetPath()
+                block.invalidatePath()
+        self._drawnBlocks = None
+        self._drawingBlocks = None
+        for block in self.gcode.blocks:
+            block.invalidatePath()
+
         if not self.draw_paths:
             for block in self.gcode.blocks:
                 block.resetPath()
             return
 
+        nlines = sum(len(block) for block in self.gcode.blocks)
+        # big files are drawn with one polyline per run of motions
+        lod = 0 < LOD_LINES < nlines
+        self._drawLod = lod
+
+        if 0 < DRAW_THREAD_LINES < nlines:
+            self._drawPathsThread(lod)
+            return
+
+        geometry = PathGeometry(self, self.cnc, lod)
         try:
-            n = 1
             startTime = before = time.time()
-            self.cnc.resetAllMargins()
-            drawG = self.draw_rapid or self.draw_paths or self.draw_margin
             for i, block in enumerate(self.gcode.blocks):
-                start = True  # start location found
-                block.resetPath()
-
-                # Draw block
-                for j, line in enumerate(block):
-                    n -= 1
-                    if n == 0:
-                        if time.time() - startTime > DRAW_TIME:
-                            raise AlarmException()
-                        # Force a periodic update since this loop can take time
-                        if time.time() - before > 1.0:
-                            self.update()
-                            before = time.time()
-                        n = 1000
-                    try:
-                        cmd = self.gcode.evaluate(
-                            CNC.compileLine(line), self.app)
-                        if isinstance(cmd, tuple):
-                            cmd = None
-                        else:
-                            cmd = CNC.breakLine(cmd)
-                    except AlarmException:
-                        raise
-                    except Exception:
-                        sys.stderr.write(
-                            _(">>> ERROR: {}\n").format(str(sys.exc_info()[1]))
-                        )
-                        sys.stderr.write(_("     line: {}\n").format(line))
-                        cmd = None
-                    if cmd is None or not drawG:
-                        block.addPath(None)
-                    else:
-                        path = self.drawPath(block, cmd)
-                        self._items[path] = i, j
-                        block.addPath(path)
-                        if start and self.cnc.gcode in (1, 2, 3):
-                            # Mark as start the first non-rapid motion
-                            block.startPath(self.cnc.x, self.cnc.y, self.cnc.z)
-                            start = False
-                block.endPath(self.cnc.x, self.cnc.y, self.cnc.z)
+                if time.time() - startTime > DRAW_TIME:
+                    raise AlarmException()
+                # Force a periodic update since this loop can take time
+                if time.time() - before > 1.0:
+                    self.update()
+                    before = time.time()
+                stats, start, runs = geometry.block(block)
+                self._applyStats(block, stats, start)
+                for run in runs:
+                    self._drawRun(i, block, *run)
+            self._drawnBlocks = list(self.gcode.blocks)
         except AlarmException:
             self.status("Rendering takes TOO Long. Interrupted...")
 
     # ----------------------------------------------------------------------
-    # Create path for one g command
+    # Draw again only the blocks modified since the last drawing, and the
+    # ones following them whose starting state (position, modal codes...)
+    # has changed
+    # @return False if the whole drawing has to be redone
     # ----------------------------------------------------------------------
-    def drawPath(self, block, cmds):
-        self.cnc.motionStart(cmds)
-        xyz = self.cnc.motionPath()
-        self.cnc.motionEnd()
-        if xyz:
-            self.cnc.pathLength(block, xyz)
-            if self.cnc.gcode in (1, 2, 3):
-                block.pathMargins(xyz)
-                self.cnc.pathMargins(block)
-            if block.enable:
-                if self.cnc.gcode == 0 and self.draw_rapid:
-                    xyz[0] = self._last
-                self._last = xyz[-1]
+    def drawModified(self):
+        if self._inDraw or self._drawing or self._drawnBlocks is None:
+            return False
+        blocks = self.gcode.blocks
+        nlines = sum(len(block) for block in blocks)
+        lod = 0 < LOD_LINES < nlines
+        if lod != self._drawLod:
+            return False
+        self._inDraw = True
+
+        # remove the paths of the deleted blocks
+        current = set(map(id, blocks))
+        for block in self._drawnBlocks:
+            if id(block) not in current:
+                self._deletePaths(block)
+                block.resetPath()
+                block.invalidatePath()
+
+        self.cnc.initPath()
+        geometry = PathGeometry(self, self.cnc, lod)
+        state = geometry.state()
+        drawn = self._drawnBlocks
+        items = self._items
+        for i, block in enumerate(blocks):
+            info = block._drawState
+            redraw = (info is None or info[0] != state
+                      or info[2] != block.enable or info[3] != block.color)
+            if not redraw and (i >= len(drawn) or drawn[i] is not block):
+                # block moved, update the index of its items to the first
+                # line of every item
+                for j, path in enumerate(block._path):
+                    if path is None:
+                        continue
+                    item = items.get(path)
+                    if item is None:
+                        redraw = True  # items lost, draw it again
+                        break
+                    if item[0] != i:
+                        items[path] = i, j
+            if redraw:
+                self._deletePaths(block)
+                geometry.setState(state)
+                stats, start, runs = geometry.block(block)
+                self._applyStats(block, stats, start)
+                for run in runs:
+                    self._drawRun(i, block, *run)
+            state = block._drawState[1]
+        self._drawnBlocks = list(blocks)
+
+        # totals and margins from the block statistics
+        self.cnc.totalTime = sum(block._drawState[4] for block in blocks)
+        self.cnc.totalLength = sum(block._drawState[5] for block in blocks)
+        self.cnc.resetAllMargins()
+        for block in blocks:
+            self.cnc.pathMargins(block)
+
+        self.drawGrid()
+        self.drawMargin()
+        if self._gantry1:
+            self.tag_raise(self._gantry1)
+        if self._gantry2:
+            self.tag_raise(self._gantry2)
+        self._updateScrollBars()
+        self._inDraw = False
+        return True
+
+    # ----------------------------------------------------------------------
+    # Delete the canvas items of a block
+    # ----------------------------------------------------------------------
+    def _deletePaths(self, block):
+        paths = {path for path in block._path if path is not None}
+        if not paths:
+            return
+        self.delete(*paths)
+        for path in paths:
+            self._items.pop(path, None)
+            self._xyz.pop(path, None)
+            self._lod.discard(path)
+        if self._lastActive in paths:
+            self._lastActive = None
+
+    # ----------------------------------------------------------------------
+    # Compute the geometry in a background thread and create the canvas
+    # items in short slices from the Tk loop, keeping the GUI responsive
+    # ----------------------------------------------------------------------
+    def _drawPathsThread(self, lod):
+        cnc = copy.copy(self.cnc)
+        cnc.vars = CNC.vars.copy()  # private feedmode of the thread
+        geometry = PathGeometry(self, cnc, lod)
+        results = queue.Queue()
+        gen = self._drawGen
+        blocks = list(self.gcode.blocks)
+
+        def worker():
+            try:
+                for i, block in enumerate(blocks):
+                    if gen != self._drawGen:
+                        return
+                    if not geometry.evaluates(block):
+                        results.put((i, *geometry.block(block)))
+                        continue
+                    # the expressions and user code have to run in the Tk
+                    # thread, wait for it to draw the block
+                    done = threading.Event()
+                    results.put((i, done))
+                    while not done.wait(DRAW_POLL / 1000.0):
+                        if gen != self._drawGen:
+                            return
+            except Exception:
+                # most probably the gcode changed, a new draw will follow
+                sys.stderr.write(
+                    _(">>> ERROR: {}\n").format(str(sys.exc_info()[1])))
+            results.put(None)
+
+        self._drawing = True
+        self._drawingBlocks = blocks
+        self._drawZoom = self.zoom
+        self._drawItems = self._drawResults(gen, results, geometry, blocks)
+        threading.Thread(target=worker, daemon=True).start()
+        self.after(DRAW_POLL, self._drawSlice, gen)
+
+    # ----------------------------------------------------------------------
+    # Create the items received from the geometry thread for DRAW_SLICE
+    # ----------------------------------------------------------------------
+    def _drawSlice(self, gen):
+        if gen != self._drawGen:
+            return
+        end = time.time() + DRAW_SLICE
+        for busy in self._drawItems:
+            if not busy or time.time() > end:
+                self.after(DRAW_POLL, self._drawSlice, gen)
+                return
+
+    # ----------------------------------------------------------------------
+    # Generator creating the items, yields False while waiting for results
+    # ----------------------------------------------------------------------
+    def _drawResults(self, gen, results, geometry, blocks):
+        while True:
+            try:
+                result = results.get_nowait()
+            except queue.Empty:
+                yield False
+                continue
+            if result is None:
+                break
+            i = result[0]
+            block = blocks[i]
+            if len(result) == 2:
+                # the thread waits while the block is evaluated here
+                try:
+                    stats, start, runs = geometry.block(block)
+                finally:
+                    result[1].set()
             else:
-                if self.cnc.gcode == 0:
-                    return None
-            coords = self.plotCoords(xyz)
-            if coords:
-                if block.enable:
-                    if block.color:
-                        fill = block.color
-                    else:
-                        fill = ENABLE_COLOR
-                else:
-                    fill = DISABLE_COLOR
-                if self.cnc.gcode == 0:
-                    if self.draw_rapid:
-                        return self.create_line(coords, fill=fill,
-                                                width=0, dash=(4, 3))
-                elif self.draw_paths:
-                    return self.create_line(
-                        coords, fill=fill, width=0, cap="projecting"
-                    )
+                i, stats, start, runs = result
+            self._applyStats(block, stats, start)
+            for run in runs:
+                path = self._drawRun(i, block, *run)
+                # the view was zoomed while drawing
+                if path is not None and self.zoom != self._drawZoom:
+                    r = self.zoom / self._drawZoom
+                    self.scale(path, 0, 0, r, r)
+                yield True
+
+        self._drawing = False
+        self._drawnBlocks = blocks
+        self._drawingBlocks = None
+        self.cnc.totalTime = geometry.cnc.totalTime
+        self.cnc.totalLength = geometry.cnc.totalLength
+        self.drawGrid()
+        self.drawMargin()
+        self._updateScrollBars()
+        if self._fitPending:
+            self._fitPending = False
+            self.fit2Screen()
+        self.app.selectionChange()
+
+    # ----------------------------------------------------------------------
+    # Set the length, margins and start/end points computed for a block
+    # ----------------------------------------------------------------------
+    def _applyStats(self, block, stats, start):
+        block.resetPath()
+        block._path.extend([None] * len(block))
+        block.length = stats.length
+        block.rapid = stats.rapid
+        block.time = stats.time
+        block.xmin = stats.xmin
+        block.ymin = stats.ymin
+        block.zmin = stats.zmin
+        block.xmax = stats.xmax
+        block.ymax = stats.ymax
+        block.zmax = stats.zmax
+        if start is not None:
+            block.startPath(*start)
+        block.endPath(stats.ex, stats.ey, stats.ez)
+        block._drawState = stats._drawState
+        self.cnc.pathMargins(block)
+
+    # ----------------------------------------------------------------------
+    # Create the item of a run of motions
+    # ----------------------------------------------------------------------
+    def _drawRun(self, i, block, rapid, lines, coords, xyz):
+        path = self._createPath(block, coords, rapid)
+        if path is None:
+            return None
+        self._items[path] = i, lines[0]
+        self._xyz[path] = xyz
+        if len(lines) > 1:
+            self._lod.add(path)
+        for j in lines:
+            block._path[j] = path
+        return path
+
+    # ----------------------------------------------------------------------
+    # Create the canvas line of a path
+    # ----------------------------------------------------------------------
+    def _createPath(self, block, coords, rapid):
+        if block.enable:
+            if block.color:
+                fill = block.color
+            else:
+                fill = ENABLE_COLOR
+        else:
+            fill = DISABLE_COLOR
+        if rapid:
+            if self.draw_rapid:
+                return self.create_line(coords, fill=fill,
+                                        width=0, dash=(4, 3))
+        elif self.draw_paths:
+            return self.create_line(
+                coords, fill=fill, width=0, cap="projecting"
+            )
         return None
 
     # ----------------------------------------------------------------------
@@ -1996,50 +2433,7 @@ class CNCCanvas(Canvas):
     # NOTE: Use the tkinter._flatten() to pass to self.coords() function
     # ----------------------------------------------------------------------
     def plotCoords(self, xyz):
-        coords = None
-        if self.view == VIEW_XY:
-            coords = [(p[0] * self.zoom, -p[1] * self.zoom) for p in xyz]
-        elif self.view == VIEW_XZ:
-            coords = [(p[0] * self.zoom, -p[2] * self.zoom) for p in xyz]
-        elif self.view == VIEW_YZ:
-            coords = [(p[1] * self.zoom, -p[2] * self.zoom) for p in xyz]
-        elif self.view == VIEW_ISO1:
-            coords = [
-                (
-                    (p[0] * S60 + p[1] * S60) * self.zoom,
-                    (+p[0] * C60 - p[1] * C60 - p[2]) * self.zoom,
-                )
-                for p in xyz
-            ]
-        elif self.view == VIEW_ISO2:
-            coords = [
-                (
-                    (p[0] * S60 - p[1] * S60) * self.zoom,
-                    (-p[0] * C60 - p[1] * C60 - p[2]) * self.zoom,
-                )
-                for p in xyz
-            ]
-        elif self.view == VIEW_ISO3:
-            coords = [
-                (
-                    (-p[0] * S60 - p[1] * S60) * self.zoom,
-                    (-p[0] * C60 + p[1] * C60 - p[2]) * self.zoom,
-                )
-                for p in xyz
-            ]
-        # Check limits
-        for i, (x, y) in enumerate(coords):
-            if abs(x) > MAXDIST or abs(y) > MAXDIST:
-                if x < -MAXDIST:
-                    x = -MAXDIST
-                elif x > MAXDIST:
-                    x = MAXDIST
-                if y < -MAXDIST:
-                    y = -MAXDIST
-                elif y > MAXDIST:
-                    y = MAXDIST
-                coords[i] = (x, y)
-        return coords
+        return project(xyz, self.view, self.zoom)
 
     # ----------------------------------------------------------------------
     # Canvas to real coordinates
@@ -2078,6 +2472,145 @@ class CNCCanvas(Canvas):
         return x, y, z
 
 
+# =============================================================================
+# Toolpath geometry of the blocks, evaluating the gcode and projecting the
+# motions for the view. It doesn't touch Tk so it can run in a thread
+# =============================================================================
+class PathGeometry:
+    def __init__(self, canvas, cnc, lod):
+        self.gcode = canvas.gcode
+        self.app = canvas.app
+        self.cnc = cnc
+        self.lod = lod  # merge consecutive motions
+        self.view = canvas.view
+        self.zoom = canvas.zoom
+        self.drawRapid = canvas.draw_rapid
+        self.last = (0.0, 0.0, 0.0)
+
+    # ----------------------------------------------------------------------
+    # @return the state of the interpreter, position and modal codes
+    # ----------------------------------------------------------------------
+    def state(self):
+        state = self.cnc.__dict__.copy()
+        del state["totalLength"]
+        del state["totalTime"]
+        state.pop("vars", None)
+        return state, self.last
+
+    # ----------------------------------------------------------------------
+    # @return true if the block has expressions or python code to evaluate
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def evaluates(block):
+        for j in range(len(block)):
+            cmd, words, comment = block.compiled(j)
+            if words is None and isinstance(cmd, (list, types.CodeType)):
+                return True
+        return False
+
+    # ----------------------------------------------------------------------
+    def setState(self, state):
+        self.cnc.__dict__.update(state[0])
+        self.last = state[1]
+
+    # ----------------------------------------------------------------------
+    # @return (stats, start, runs) stats is a Block holding the length,
+    #         margins and drawing state, start the first cutting location
+    #         or None and runs a list of (rapid, lines, coords, xyz) to draw
+    # ----------------------------------------------------------------------
+    def block(self, block):
+        stats = Block()
+        stats.enable = block.enable
+        color = block.color
+        before = self.state()
+        totalTime = self.cnc.totalTime
+        totalLength = self.cnc.totalLength
+        start = None
+        runs = []
+        run = []  # merged motions
+        runLines = []
+        rapid = False
+        checkpoints = []  # (lid, state) to resume the program quickly
+        for j, line in enumerate(block):
+            if j and j % RESUME_CHECKPOINT == 0:
+                checkpoints.append((j, self.state()))
+            try:
+                cmd, words, comment = block.compiled(j)
+                if words is not None:
+                    cmd = words
+                else:
+                    cmd = self.gcode.evaluate(cmd, self.app)
+                    if isinstance(cmd, tuple):
+                        cmd = None
+                    else:
+                        cmd = CNC.breakLine(cmd)
+            except Exception:
+                sys.stderr.write(
+                    _(">>> ERROR: {}\n").format(str(sys.exc_info()[1])))
+                sys.stderr.write(_("     line: {}\n").format(line))
+                cmd = None
+            if cmd is None:
+                continue
+
+            xyz = self.motion(stats, cmd)
+            g0 = self.cnc.gcode == 0
+            if start is None and self.cnc.gcode in (1, 2, 3):
+                # Mark as start the first non-rapid motion
+                start = (self.cnc.x, self.cnc.y, self.cnc.z)
+            if not xyz or (g0 and not self.drawRapid):
+                xyz = None
+
+            if run and (not self.lod or xyz is None or g0 != rapid
+                        or xyz[0] != run[-1]):
+                runs.append(self._run(rapid, runLines, run))
+                run = []
+                runLines = []
+            if xyz is not None:
+                if run:
+                    run.extend(xyz[1:])
+                else:
+                    run.extend(xyz)
+                    rapid = g0
+                runLines.append(j)
+        if run:
+            runs.append(self._run(rapid, runLines, run))
+        stats.endPath(self.cnc.x, self.cnc.y, self.cnc.z)
+        stats._drawState = (
+            before, self.state(), stats.enable, color,
+            self.cnc.totalTime - totalTime,
+            self.cnc.totalLength - totalLength,
+            checkpoints)
+        return stats, start, runs
+
+    # ----------------------------------------------------------------------
+    def _run(self, rapid, lines, xyz):
+        coords = project(xyz, self.view, self.zoom)
+        if len(lines) > 1:
+            coords = simplify(coords)
+        return rapid, lines, coords, xyz
+
+    # ----------------------------------------------------------------------
+    # Execute one g command updating the block length and margins
+    # @return the 3D points of the motion to draw or None
+    # ----------------------------------------------------------------------
+    def motion(self, block, cmds):
+        self.cnc.motionStart(cmds)
+        xyz = self.cnc.motionPath()
+        self.cnc.motionEnd()
+        if xyz:
+            self.cnc.pathLength(block, xyz)
+            if self.cnc.gcode in (1, 2, 3):
+                block.pathMargins(xyz)
+            if block.enable:
+                if self.cnc.gcode == 0 and self.drawRapid:
+                    xyz[0] = self.last
+                self.last = xyz[-1]
+            else:
+                if self.cnc.gcode == 0:
+                    return None
+        return xyz
+
+
 # =============================================================================
 # Canvas Frame with toolbar
 # =============================================================================
@@ -2129,7 +2662,7 @@ class CanvasFrame(Frame):
         global BOX_SELECT, ENABLE_COLOR, DISABLE_COLOR, SELECT_COLOR
         global SELECT2_COLOR, PROCESS_COLOR, MOVE_COLOR, RULER_COLOR
         global CAMERA_COLOR, PROBE_TEXT_COLOR, CANVAS_COLOR
-        global DRAW_TIME
+        global DRAW_TIME, LOD_LINES
 
         self.draw_axes.set(bool(int(Utils.getBool("Canvas", "axes", True))))
         self.draw_grid.set(bool(int(Utils.getBool("Canvas", "grid", True))))
@@ -2142,6 +2675,7 @@ class CanvasFrame(Frame):
         self.view.set(Utils.getStr("Canvas", "view", VIEWS[0]))
 
         DRAW_TIME = Utils.getInt("Canvas", "drawtime", DRAW_TIME)
+        LOD_LINES = Utils.getInt("Canvas", "lodlines", LOD_LINES)
 
         INSERT_COLOR = Utils.getStr("Color", "canvas.insert", INSERT_COLOR)
         GANTRY_COLOR = Utils.getStr("Color", "canvas.gantry", GANTRY_COLOR)
@@ -2163,6 +2697,7 @@ class CanvasFrame(Frame):
     # ----------------------------------------------------------------------
     def saveConfig(self):
         Utils.setInt("Canvas", "drawtime", DRAW_TIME)
+        Utils.setInt("Canvas", "lodlines", LOD_LINES)
         Utils.setStr("Canvas", "view", self.view.get())
         Utils.setBool("Canvas", "axes", self.draw_axes.get())
         Utils.setBool("Canvas", "grid", self.draw_grid.get())
@@ -183,6 +183,20 @@ class RunGroup(CNCRibbon.ButtonGroup):
             b, _("Run g-code commands from editor to controller"))
         self.addWidget(b)
 
+        b = Ribbon.LabelButton(
+            self.frame,
+            self,
+            "<<RunFrom>>",
+            image=Utils.icons["start32"],
+            text=_("Start from"),
+            compound=TOP,
+            background=Ribbon._BACKGROUND,
+        )
+        b.pack(side=LEFT, fill=BOTH)
+        tkExtra.Balloon.set(
+            b, _("Resume the program from the selected line of the editor"))
+        self.addWidget(b)
+
         b = Ribbon.LabelButton(
             self.frame,
             self,
@@ -480,6 +480,11 @@ class OrderGroup(CNCRibbon.ButtonMenuGroup):
                     "optimize",
                     lambda a=app: a.insertCommand("OPTIMIZE", True),
                 ),
+                (
+                    _("Optimize reversing paths"),
+                    "optimize",
+                    lambda a=app: a.insertCommand("OPTIMIZE REVERSE", True),
+                ),
             ],
         )
         self.grid2rows()
@@ -9,18 +9,12 @@ import re
 import tempfile
 import threading
 
-import Camera
 from CNC import CNC
 from Utils import prgpath
 
 import urllib.parse as urlparse
 import http.server as httpserver
 
-try:
-    from PIL import Image
-except ImportError:
-    Image = None
-
 __author__ = "Vasilis Vlachoudis"
 __email__ = "Vasilis.Vlachoudis@cern.ch"
 
@@ -128,7 +122,12 @@ class Pendant(httpserver.BaseHTTPRequestHandler):
                 pass
 
         elif page == "/canvas":
-            if not Image:
+            # no canvas when running headless
+            if getattr(httpd.app, "canvas", None) is None:
+                return
+            try:
+                from PIL import Image
+            except ImportError:
                 return
             with tempfile.NamedTemporaryFile(suffix=".ps") as tmp:
                 httpd.app.canvas.postscript(
@@ -159,6 +158,7 @@ class Pendant(httpserver.BaseHTTPRequestHandler):
                         pass
 
         elif page == "/camera":
+            import Camera
             if not Camera.hasOpenCV():
                 return
             if Pendant.camera is None:
@@ -48,7 +48,7 @@ import CNCRibbon
 import Ribbon
 import tkExtra
 import Utils
-from CNC import CNC, Block
+from CNC import CNC, Block, PROBE_BILINEAR
 
 from Helpers import N_
 
@@ -72,6 +72,9 @@ TOOL_POLICY = [
 
 TOOL_WAIT = [_("ONLY before probing"), _("BEFORE & AFTER probing")]
 
+# same order as the CNC.PROBE_* methods
+PROBE_METHOD = [_("Bilinear"), _("Bicubic"), _("Thin plate spline")]
+
 CAMERA_LOCATION = {
     "Gantry": NONE,
     "Top-Left": NW,
@@ -1323,6 +1326,56 @@ class AutolevelFrame(CNCRibbon.PageFrame):
         tkExtra.Balloon.set(self.probeZmax, _("Z safe to move"))
         self.addWidget(self.probeZmax)
 
+        # Interpolation
+        row += 1
+        col = 0
+        Label(lframe, text=_("Surface:")).grid(row=row, column=col, sticky=E)
+        col += 1
+        self.probeMethod = tkExtra.Combobox(
+            lframe,
+            True,
+            background=tkExtra.GLOBAL_CONTROL_BACKGROUND,
+            command=self.methodChange,
+            width=16,
+        )
+        self.probeMethod.grid(row=row, column=col, columnspan=3, sticky=EW)
+        self.probeMethod.fill(PROBE_METHOD)
+        self.probeMethod.set(PROBE_METHOD[PROBE_BILINEAR])
+        tkExtra.Balloon.set(
+            self.probeMethod,
+            _("Interpolation of the probed surface. Bicubic and spline "
+              "allow sparser probing grids"),
+        )
+        self.addWidget(self.probeMethod)
+
+        # Adaptive scan
+        row += 1
+        col = 0
+        Label(lframe, text=_("Adaptive:")).grid(row=row, column=col, sticky=E)
+        col += 1
+        self.probeTolerance = tkExtra.FloatEntry(
+            lframe, background=tkExtra.GLOBAL_CONTROL_BACKGROUND, width=5
+        )
+        self.probeTolerance.grid(row=row, column=col, sticky=EW)
+        tkExtra.Balloon.set(
+            self.probeTolerance,
+            _("Adaptive scan tolerance. Refine the grid only where the "
+              "surface deviates more from a plane. 0 to probe every point"),
+        )
+        self.addWidget(self.probeTolerance)
+
+        col += 1
+        self.probeClearance = tkExtra.FloatEntry(
+            lframe, background=tkExtra.GLOBAL_CONTROL_BACKGROUND, width=5
+        )
+        self.probeClearance.grid(row=row, column=col, sticky=EW)
+        tkExtra.Balloon.set(
+            self.probeClearance,
+            _("Adaptive scan retract above the probed points when moving "
+              "to a neighboring point"),
+        )
+        self.addWidget(self.probeClearance)
+
         lframe.grid_columnconfigure(1, weight=2)
         lframe.grid_columnconfigure(2, weight=2)
         lframe.grid_columnconfigure(3, weight=1)
@@ -1357,6 +1410,12 @@ class AutolevelFrame(CNCRibbon.PageFrame):
         Utils.setInt("Probe", "yn", self.probeYbins.get())
         Utils.setFloat("Probe", "zmin", self.probeZmin.get())
         Utils.setFloat("Probe", "zmax", self.probeZmax.get())
+        Utils.setInt(
+            "Probe", "interpolation",
+            PROBE_METHOD.index(self.probeMethod.get())
+        )
+        Utils.setFloat("Probe", "tolerance", self.probeTolerance.get())
+        Utils.setFloat("Probe", "clearance", self.probeClearance.get())
 
     # -----------------------------------------------------------------------
     def loadConfig(self):
@@ -1372,8 +1431,23 @@ class AutolevelFrame(CNCRibbon.PageFrame):
 
         self.probeYbins.delete(0, END)
         self.probeYbins.insert(0, max(2, Utils.getInt("Probe", "yn", 5)))
+
+        try:
+            method = PROBE_METHOD[Utils.getInt("Probe", "interpolation", 0)]
+        except IndexError:
+            method = PROBE_METHOD[PROBE_BILINEAR]
+        self.probeMethod.set(method)
+        self.methodChange()
+
+        self.probeTolerance.set(Utils.getFloat("Probe", "tolerance", 0.0))
+        self.probeClearance.set(Utils.getFloat("Probe", "clearance", 1.0))
         self.change(False)
 
+    # -----------------------------------------------------------------------
+    def methodChange(self):
+        self.app.gcode.probe.setMethod(
+            PROBE_METHOD.index(self.probeMethod.get()))
+
     # -----------------------------------------------------------------------
     def getMargins(self, event=None):
         self.probeXmin.set(str(CNC.vars["xmin"]))
@@ -1497,8 +1571,17 @@ class AutolevelFrame(CNCRibbon.PageFrame):
         if self.change():
             return
         self.event_generate("<<DrawProbe>>")
+        probe = self.app.gcode.probe
+        try:
+            tolerance = float(self.probeTolerance.get())
+            clearance = float(self.probeClearance.get())
+        except ValueError:
+            tolerance = 0.0
         # absolute
-        self.app.run(lines=self.app.gcode.probe.scan())
+        if tolerance > 0.0:
+            self.app.run(lines=probe.scanAdaptive(tolerance, clearance))
+        else:
+            self.app.run(lines=probe.scan())
 
     # -----------------------------------------------------------------------
     # Scan autolevel margins
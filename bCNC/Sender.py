@@ -7,13 +7,14 @@
 import glob
 import os
 import re
+import select
 import sys
 import threading
 import time
 import traceback
 import webbrowser
+from collections import deque
 from datetime import datetime
-from tkinter import messagebox
 from queue import (
     Empty,
     Queue,
@@ -21,6 +22,7 @@ from queue import (
 
 import Pendant
 import rexx
+import Telemetry
 import Utils
 from CNC import CNC, MSG, UPDATE, WAIT, GCode
 
@@ -34,10 +36,13 @@ except ImportError:
 
 WIKI = "https://github.com/vlachoudis/bCNC/wiki"
 
-SERIAL_POLL = 0.125  # s
+SERIAL_POLL = 0.125  # s, initial, then the controller pollInterval()
 SERIAL_TIMEOUT = 0.10  # s
+SERIAL_SELECT = os.name == "posix"  # event driven serial I/O
 G_POLL = 10  # s
-RX_BUFFER_SIZE = 128
+RX_BUFFER_SIZE = 128  # default size of the controller serial buffer
+COMPILE_AHEAD = 256  # commands compiled ahead of the serial line
+LOG_CHUNK = 5000  # log messages processed at once by the gui
 
 GPAT = re.compile(r"[A-Za-z]\s*[-+]?\d+.*")
 FEEDPAT = re.compile(r"^(.*)[fF](\d+\.?\d+)(.*)$")
@@ -68,6 +73,87 @@ STATECOLOR = {
 }
 
 
+# =============================================================================
+# Command queue waking up the serial thread when a command is added
+# =============================================================================
+class CommandQueue(Queue):
+    def __init__(self):
+        Queue.__init__(self)
+        self.wakeup = None  # file descriptor to write to
+        self._wakeupLock = threading.Lock()
+
+    # ----------------------------------------------------------------------
+    # Set the file descriptor to write to, None before closing it. Once
+    # returned no put() is writing to the previous one
+    # ----------------------------------------------------------------------
+    def setWakeup(self, fd):
+        with self._wakeupLock:
+            self.wakeup = fd
+
+    # ----------------------------------------------------------------------
+    def put(self, item, block=True, timeout=None):
+        Queue.put(self, item, block, timeout)
+        with self._wakeupLock:
+            if self.wakeup is not None:
+                try:
+                    os.write(self.wakeup, b"\0")
+                except OSError:
+                    pass  # full pipe, the thread is already woken up
+
+
+# =============================================================================
+# Log of the serial thread consumed in chunks from the gui.
+# A deque is thread safe for append and popleft without locking. In quiet
+# mode the streamed lines and their ok are only counted
+# =============================================================================
+class LogQueue(deque):
+    def __init__(self):
+        deque.__init__(self)
+        self.quiet = False
+        self.sent = 0  # lines not logged in quiet mode
+        self.ok = 0  # ok not logged in quiet mode
+
+    # ----------------------------------------------------------------------
+    def put(self, item, block=True, timeout=None):
+        if self.quiet:
+            if item[0] == Sender.MSG_BUFFER:
+                self.sent += 1
+                return
+            elif item[0] == Sender.MSG_OK:
+                self.ok += 1
+                return
+        self.append(item)
+
+    # ----------------------------------------------------------------------
+    def get_nowait(self):
+        try:
+            return self.popleft()
+        except IndexError:
+            raise Empty
+
+    get = get_nowait
+
+    # ----------------------------------------------------------------------
+    def qsize(self):
+        return len(self)
+
+    # ----------------------------------------------------------------------
+    def empty(self):
+        return not self
+
+    # ----------------------------------------------------------------------
+    # @return a list with up to n messages removed from the log
+    # ----------------------------------------------------------------------
+    def getChunk(self, n=LOG_CHUNK):
+        chunk = []
+        try:
+            for _i in range(min(n, len(self))):
+                chunk.append(self.popleft())
+        except IndexError:
+            pass
+        return chunk
+
+
 # =============================================================================
 # bCNC Sender class
 # =============================================================================
@@ -95,11 +181,14 @@ class Sender:
         self.gcode = GCode()
         self.cnc = self.gcode.cnc
 
-        self.log = Queue()  # Log queue returned from GRBL
-        self.queue = Queue()  # Command queue to be send to GRBL
+        self.log = LogQueue()  # Log queue returned from GRBL
+        self.queue = CommandQueue()  # Command queue to be send to GRBL
         self.pendant = Queue()  # Command queue to be executed from Pendant
         self.serial = None
         self.thread = None
+        self._compiler = None  # streaming compiler of the running program
+        self._paths = None  # (bid,lid) of every compiled command
+        self._dequeued = 0  # commands taken from the queue in the run
 
         self._posUpdate = False  # Update position
         self._probeUpdate = False  # Update probe
@@ -116,6 +205,13 @@ class Sender:
         self._alarm = True  # Display alarm message if true
         self._msg = None
         self._sumcline = 0
+        self._rxBuffer = 0  # configured rx buffer size, 0 to detect it
+        self.rxBufferSize = RX_BUFFER_SIZE  # actual streaming window
+        self.plannerSize = 0  # planner blocks of the controller
+        self.quiet = False  # log only counters while streaming
+        self.telemetry = False  # record the execution of the runs
+        self._recorder = None
+        self._acks = deque()  # paths of the commands waiting for the ok
         self._lastFeed = 0
         self._newFeed = 0
 
@@ -156,11 +252,16 @@ class Sender:
     def loadConfig(self):
         self.controllerSet(Utils.getStr("Connection", "controller"))
         Pendant.port = Utils.getInt("Connection", "pendantport", Pendant.port)
+        self._rxBuffer = Utils.getInt("Connection", "rxbuffer", 0)
+        self.quiet = Utils.getBool("Connection", "quiet", False)
+        self.telemetry = Utils.getBool("Connection", "telemetry", False)
         GCode.LOOP_MERGE = Utils.getBool("File", "dxfloopmerge")
         self.loadHistory()
 
     # ----------------------------------------------------------------------
     def saveConfig(self):
+        Utils.setBool("Connection", "quiet", self.quiet)
+        Utils.setBool("Connection", "telemetry", self.telemetry)
         self.saveHistory()
 
     # ----------------------------------------------------------------------
@@ -260,9 +361,12 @@ class Sender:
         elif cmd == "RESET":
             self.softReset()
 
-        # RUN: run g-code
+        # RUN [line]: run g-code, optionally starting from the line number
         elif cmd == "RUN":
-            self.run()
+            if len(line) > 1:
+                self.runFrom(line[1])
+            else:
+                self.run()
 
         # SAFE [z]: safe z to move
         elif cmd == "SAFE":
@@ -327,6 +431,13 @@ class Sender:
         elif cmd == "STOP":
             self.stopRun()
 
+        # TEL*EMETRY ON|OFF: record the execution of the next runs
+        elif rexx.abbrev("TELEMETRY", cmd, 3) and len(line) > 1:
+            self.telemetry = line[1].upper() == "ON"
+            self.log.put((Sender.MSG_RUNEND, _(
+                "Telemetry recording {}").format(
+                    _("on") if self.telemetry else _("off"))))
+
         # UNL*OCK: unlock grbl
         elif rexx.abbrev("UNLOCK", cmd, 3):
             self.unlock()
@@ -413,6 +524,7 @@ class Sender:
             # save orientation file
             self.gcode.orient.load(filename)
         elif ext == ".stl" or ext == ".ply":
+            from tkinter import messagebox
             messagebox.showinfo(
                 "Open 3D Mesh",
                 "Importing of 3D mesh files in .STL and .PLY format is "
@@ -512,6 +624,8 @@ class Sender:
             pass
         time.sleep(1)
         self.serial_write("\n\n")
+        self.rxBufferSize = self._rxBuffer or RX_BUFFER_SIZE
+        self.plannerSize = 0
         self.mcontrol.initController()
         self._gcount = 0
         self._alarm = True
@@ -530,6 +644,7 @@ class Sender:
         except Exception:
             pass
         self._runLines = 0
+        self._compiler = None
         self.thread = None
         time.sleep(1)
         try:
@@ -635,6 +750,34 @@ class Sender:
             except Empty:
                 break
 
+    # ----------------------------------------------------------------------
+    # Pull lines from the streaming compiler into the queue keeping at most
+    # COMPILE_AHEAD commands in advance. Called from the serial thread.
+    # A None line means nothing more is available yet, retry later
+    # ----------------------------------------------------------------------
+    def compileAhead(self):
+        compiler = self._compiler
+        try:
+            while self.queue.qsize() < COMPILE_AHEAD:
+                line, path = next(compiler)
+                if line is None:
+                    # the program waits for the machine
+                    break
+                self.queue.put(line)
+                self._paths.append(path)
+            if len(self._paths) >= self._runLines:
+                self._runLines = len(self._paths) + 1  # plus the wait
+        except StopIteration:
+            self.queue.put((WAIT,))  # wait at the end to become idle
+            # set the real number of lines before releasing the compiler
+            self._runLines = len(self._paths) + 1  # plus the wait
+            self._compiler = None
+        except Exception:
+            for s in str(sys.exc_info()[1]).splitlines():
+                self.log.put((Sender.MSG_ERROR, s))
+            self._compiler = None
+            self._stop = True
+
     # ----------------------------------------------------------------------
     def stopProbe(self):
         if self.gcode.probe.start:
@@ -642,22 +785,70 @@ class Sender:
 
     # ----------------------------------------------------------------------
     def getBufferFill(self):
-        return self._sumcline * 100.0 / RX_BUFFER_SIZE
+        return self._sumcline * 100.0 / self.rxBufferSize
+
+    # ----------------------------------------------------------------------
+    # Buffer state reported by the controller (free planner blocks and rx
+    # bytes). With nothing in flight the free rx bytes is the size of the
+    # controller buffer, use it as streaming window e.g. for 1024 bytes
+    # builds of grbl
+    # ----------------------------------------------------------------------
+    def bufferReport(self, planner, rxbytes, cline):
+        if cline:
+            return
+        self.plannerSize = max(self.plannerSize, planner)
+        if not self._rxBuffer and rxbytes > self.rxBufferSize:
+            self.rxBufferSize = rxbytes
+            self.log.put((
+                Sender.MSG_RECEIVE,
+                _("Controller buffers: {} planner blocks, {} rx bytes").format(
+                    self.plannerSize, rxbytes)))
 
     # ----------------------------------------------------------------------
     def initRun(self):
         self._quit = 0
         self._pause = False
         self._paths = None
+        self._compiler = None
         self.running = True
         self.disable()
         self.emptyQueue()
+        self._dequeued = 0
         time.sleep(1)
+        self.log.sent = self.log.ok = 0
+        self.log.quiet = self.quiet
+        self._acks.clear()
+        if self.telemetry:
+            try:
+                self._recorder = Telemetry.Recorder(
+                    self.telemetryFile(), self.plannerSize)
+            except OSError as e:
+                self.log.put((Sender.MSG_ERROR, str(e)))
+
+    # ----------------------------------------------------------------------
+    # Telemetry file of the loaded program
+    # ----------------------------------------------------------------------
+    def telemetryFile(self):
+        if self.gcode.filename:
+            return os.path.splitext(self.gcode.filename)[0] + ".tlm"
+        return f"{Utils.iniUser}.tlm"
 
     # ----------------------------------------------------------------------
     # Called when run is finished
     # ----------------------------------------------------------------------
     def runEnded(self):
+        recorder = self._recorder
+        if recorder is not None:
+            self._recorder = None
+            recorder.close()
+            self.log.put((Sender.MSG_RUNEND, _(
+                "Telemetry: {} records saved in {}").format(
+                    recorder.count, recorder.filename)))
+        if self.log.quiet:
+            self.log.quiet = False
+            self.log.put((Sender.MSG_RUNEND, _(
+                "Quiet streaming: {} lines sent, {} ok").format(
+                    self.log.sent, self.log.ok)))
         if self.running:
             self.log.put((Sender.MSG_RUNEND, _("Run ended")))
             self.log.put((Sender.MSG_RUNEND, str(datetime.now())))
@@ -668,6 +859,7 @@ class Sender:
                 except Exception:
                     pass
         self._runLines = 0
+        self._compiler = None
         self._quit = 0
         self._msg = None
         self._pause = False
@@ -711,6 +903,168 @@ class Sender:
             self.cleanAfter = False
             self.jobDone()
 
+    # ----------------------------------------------------------------------
+    # Pop from the queue the next command to send to the controller,
+    # executing the internal ones (messages, updates, python code...)
+    # @return the string to send or None
+    # ----------------------------------------------------------------------
+    def _nextCommand(self):
+        while not self.sio_wait and not self._pause and self.queue.qsize() > 0:
+            try:
+                tosend = self.queue.get_nowait()
+            except Empty:
+                return None
+            # while running only the program is queued, in its order
+            self._dequeued += 1
+            if isinstance(tosend, tuple):
+                # wait to empty the grbl buffer and status is Idle
+                if tosend[0] == WAIT:
+                    # Don't count WAIT until we are idle!
+                    self.sio_wait = True
+                elif tosend[0] == MSG:
+                    # Count executed commands as well
+                    self._gcount += 1
+                    if tosend[1] is not None:
+                        # show our message on machine status
+                        self._msg = tosend[1]
+                elif tosend[0] == UPDATE:
+                    # Count executed commands as well
+                    self._gcount += 1
+                    self._update = tosend[1]
+                else:
+                    # Count executed commands as well
+                    self._gcount += 1
+                continue
+
+            elif not isinstance(tosend, str):
+                try:
+                    tosend = self.gcode.evaluate(tosend, self)
+                    if isinstance(tosend, str):
+                        tosend += "\n"
+                    else:
+                        # Count executed commands as well
+                        self._gcount += 1
+                        continue
+                except Exception:
+                    for s in str(sys.exc_info()[1]).splitlines():
+                        self.log.put((Sender.MSG_ERROR, s))
+                    self._gcount += 1
+                    continue
+            return self._overrideFeed(tosend)
+        return None
+
+    # ----------------------------------------------------------------------
+    # All modification in tosend should be done before adding it to cline
+    # ----------------------------------------------------------------------
+    def _overrideFeed(self, tosend):
+        # Keep track of last feed
+        pat = FEEDPAT.match(tosend)
+        if pat is not None:
+            self._lastFeed = pat.group(2)
+
+        # Modify sent g-code to reflect overridden feed for
+        # controllers without override support
+        if not self.mcontrol.has_override:
+            if CNC.vars["_OvChanged"]:
+                CNC.vars["_OvChanged"] = False
+                self._newFeed = (
+                    float(self._lastFeed) * CNC.vars["_OvFeed"] / 100.0
+                )
+                if (
+                    pat is None
+                    and self._newFeed != 0
+                    and not tosend.startswith("$")
+                ):
+                    tosend = f"f{self._newFeed:g}{tosend}"
+
+            # Apply override Feed
+            if CNC.vars["_OvFeed"] != 100 and self._newFeed != 0:
+                pat = FEEDPAT.match(tosend)
+                if pat is not None:
+                    try:
+                        tosend = "{}f{:g}{}\n".format(
+                            pat.group(1),
+                            self._newFeed,
+                            pat.group(3),
+                        )
+                    except Exception:
+                        pass
+        return tosend
+
+    # ----------------------------------------------------------------------
+    # Write a command to the controller
+    # ----------------------------------------------------------------------
+    def _sendCommand(self, tosend, cline):
+        self._sumcline = sum(cline)
+        if self._recorder is not None:
+            path = None
+            if self._paths:
+                # commands are dequeued in the order they were compiled
+                i = self._dequeued - 1
+                if 0 <= i < len(self._paths):
+                    path = self._paths[i]
+            self._acks.append(path)
+            self._recorder.put(Telemetry.SEND, path, self._sumcline)
+        if self.mcontrol.gcode_case > 0:
+            tosend = tosend.upper()
+        if self.mcontrol.gcode_case < 0:
+            tosend = tosend.lower()
+        self.serial_write(tosend)
+        self.log.put((Sender.MSG_BUFFER, tosend))
+
+    # ----------------------------------------------------------------------
+    # Process a line received from the controller
+    # ----------------------------------------------------------------------
+    def _receiveLine(self, line, cline, sline):
+        if not line:
+            pass
+        elif self._recorder is not None:
+            self._recordLine(line, cline, sline)
+        elif self.mcontrol.parseLine(line, cline, sline):
+            pass
+        else:
+            self.log.put((Sender.MSG_RECEIVE, line))
+
+    # ----------------------------------------------------------------------
+    # Process a received line recording the acknowledges and status reports
+    # ----------------------------------------------------------------------
+    def _recordLine(self, line, cline, sline):
+        gcount = self._gcount
+        if not self.mcontrol.parseLine(line, cline, sline):
+            self.log.put((Sender.MSG_RECEIVE, line))
+        recorder = self._recorder
+        if recorder is None:
+            return
+        if self._gcount > gcount and self._acks:
+            path = self._acks.popleft()
+            kind = Telemetry.OK if "ok" in line else Telemetry.ERROR
+            recorder.put(kind, path, sum(cline))
+        elif line[0] == "<":
+            recorder.put(Telemetry.STATUS, None, sum(cline))
+
+    # ----------------------------------------------------------------------
+    # Received external message to stop
+    # ----------------------------------------------------------------------
+    def _stopIO(self):
+        self._compiler = None
+        self.emptyQueue()
+        self.log.put((Sender.MSG_CLEAR, ""))
+        # WARNING if runLines==maxint then it means we are
+        # still preparing/sending lines from from bCNC.run(),
+        # so don't stop
+        if self._runLines != sys.maxsize:
+            self._stop = False
+
+    # ----------------------------------------------------------------------
+    # Periodic status report request
+    # ----------------------------------------------------------------------
+    def _pollStatus(self):
+        self.mcontrol.viewStatusReport()
+
+        # If Override change, attach feed
+        if CNC.vars["_OvChanged"]:
+            self.mcontrol.overrideSet()
+
     # ----------------------------------------------------------------------
     # thread performing I/O on serial line
     # ----------------------------------------------------------------------
@@ -718,104 +1072,36 @@ class Sender:
         # wait for commands to complete (status change to Idle)
         self.sio_wait = False
         self.sio_status = False  # waiting for status <...> report
+        try:
+            fd = self.serial.fileno()
+        except Exception:
+            fd = None
+        if SERIAL_SELECT and fd is not None:
+            self._serialIOSelect(fd)
+            return
+
         cline = []  # length of pipeline commands
         sline = []  # pipeline commands
         tosend = None  # next string to send
         tr = tg = time.time()  # last time a ? or $G was send to grbl
+        poll = SERIAL_POLL
 
         while self.thread:
             t = time.time()
             # refresh machine position?
-            if t - tr > SERIAL_POLL:
-                self.mcontrol.viewStatusReport()
+            if t - tr > poll:
+                self._pollStatus()
                 tr = t
+                poll = self.mcontrol.pollInterval(sline)
 
-                # If Override change, attach feed
-                if CNC.vars["_OvChanged"]:
-                    self.mcontrol.overrideSet()
+            # Compile ahead the running program
+            if self._compiler is not None and not self._stop:
+                self.compileAhead()
 
             # Fetch new command to send if...
-            if (
-                tosend is None
-                and not self.sio_wait
-                and not self._pause
-                and self.queue.qsize() > 0
-            ):
-                try:
-                    tosend = self.queue.get_nowait()
-                    if isinstance(tosend, tuple):
-                        # wait to empty the grbl buffer and status is Idle
-                        if tosend[0] == WAIT:
-                            # Don't count WAIT until we are idle!
-                            self.sio_wait = True
-                        elif tosend[0] == MSG:
-                            # Count executed commands as well
-                            self._gcount += 1
-                            if tosend[1] is not None:
-                                # show our message on machine status
-                                self._msg = tosend[1]
-                        elif tosend[0] == UPDATE:
-                            # Count executed commands as well
-                            self._gcount += 1
-                            self._update = tosend[1]
-                        else:
-                            # Count executed commands as well
-                            self._gcount += 1
-                        tosend = None
-
-                    elif not isinstance(tosend, str):
-                        try:
-                            tosend = self.gcode.evaluate(tosend, self)
-                            if isinstance(tosend, str):
-                                tosend += "\n"
-                            else:
-                                # Count executed commands as well
-                                self._gcount += 1
-                        except Exception:
-                            for s in str(sys.exc_info()[1]).splitlines():
-                                self.log.put((Sender.MSG_ERROR, s))
-                            self._gcount += 1
-                            tosend = None
-                except Empty:
-                    break
-
+            if tosend is None:
+                tosend = self._nextCommand()
                 if tosend is not None:
-                    # All modification in tosend should be
-                    # done before adding it to cline
-
-                    # Keep track of last feed
-                    pat = FEEDPAT.match(tosend)
-                    if pat is not None:
-                        self._lastFeed = pat.group(2)
-
-                    # Modify sent g-code to reflect overridden feed for
-                    # controllers without override support
-                    if not self.mcontrol.has_override:
-                        if CNC.vars["_OvChanged"]:
-                            CNC.vars["_OvChanged"] = False
-                            self._newFeed = (
-                                float(self._lastFeed) * CNC.vars["_OvFeed"] / 100.0
-                            )
-                            if (
-                                pat is None
-                                and self._newFeed != 0
-                                and not tosend.startswith("$")
-                            ):
-                                tosend = f"f{self._newFeed:g}{tosend}"
-
-                        # Apply override Feed
-                        if CNC.vars["_OvFeed"] != 100 and self._newFeed != 0:
-                            pat = FEEDPAT.match(tosend)
-                            if pat is not None:
-                                try:
-                                    tosend = "{}f{:g}{}\n".format(
-                                        pat.group(1),
-                                        self._newFeed,
-                                        pat.group(3),
-                                    )
-                                except Exception:
-                                    pass
-
                     # Bookkeeping of the buffers
                     sline.append(tosend)
                     cline.append(len(tosend))
@@ -829,37 +1115,100 @@ class Sender:
                     self.emptyQueue()
                     self.close()
                     return
-
-                if not line:
-                    pass
-                elif self.mcontrol.parseLine(line, cline, sline):
-                    pass
-                else:
-                    self.log.put((Sender.MSG_RECEIVE, line))
+                self._receiveLine(line, cline, sline)
 
             # Received external message to stop
             if self._stop:
-                self.emptyQueue()
+                self._stopIO()
                 tosend = None
-                self.log.put((Sender.MSG_CLEAR, ""))
-                # WARNING if runLines==maxint then it means we are
-                # still preparing/sending lines from from bCNC.run(),
-                # so don't stop
-                if self._runLines != sys.maxsize:
-                    self._stop = False
-
-            if tosend is not None and sum(cline) < RX_BUFFER_SIZE:
-                self._sumcline = sum(cline)
-                if self.mcontrol.gcode_case > 0:
-                    tosend = tosend.upper()
-                if self.mcontrol.gcode_case < 0:
-                    tosend = tosend.lower()
-
-                self.serial_write(tosend)
-
-                self.log.put((Sender.MSG_BUFFER, tosend))
 
+            if tosend is not None and sum(cline) < self.rxBufferSize:
+                self._sendCommand(tosend, cline)
                 tosend = None
                 if not self.running and t - tg > G_POLL:
                     self.mcontrol.viewState()
                     tg = t
+
+    # ----------------------------------------------------------------------
+    # Event driven version of serialIO, sleeping in select() until the
+    # controller sends something, a new command is queued or it is time to
+    # poll the status. Commands are written as soon as there is room in the
+    # controller buffer
+    # ----------------------------------------------------------------------
+    def _serialIOSelect(self, fd):
+        cline = []  # length of pipeline commands
+        sline = []  # pipeline commands
+        tosend = None  # next string to send
+        received = bytearray()  # incomplete line received
+        tr = tg = time.time()  # last time a ? or $G was send to grbl
+        poll = SERIAL_POLL
+        wakeup = os.pipe()  # written when a command is queued
+        os.set_blocking(wakeup[1], False)
+        self.queue.setWakeup(wakeup[1])
+
+        try:
+            while self.thread:
+                t = time.time()
+                if t - tr > poll:
+                    self._pollStatus()
+                    tr = t
+                    poll = self.mcontrol.pollInterval(sline)
+
+                # Compile ahead the running program
+                if self._compiler is not None and not self._stop:
+                    self.compileAhead()
+
+                # Send as many commands as the controller can buffer
+                while True:
+                    if tosend is None:
+                        tosend = self._nextCommand()
+                        if tosend is None:
+                            break
+                        # Bookkeeping of the buffers
+                        sline.append(tosend)
+                        cline.append(len(tosend))
+                    if sum(cline) >= self.rxBufferSize:
+                        break
+                    self._sendCommand(tosend, cline)
+                    tosend = None
+                    if not self.running and t - tg > G_POLL:
+                        self.mcontrol.viewState()
+                        tg = t
+
+                # Sleep until something happens. With a full buffer only
+                # the controller answer can unblock us
+                if tosend is None and not self.sio_wait and not self._pause:
+                    rlist = [fd, wakeup[0]]
+                else:
+                    rlist = [fd]
+                timeout = max(0.0, tr + poll - time.time())
+                ready = select.select(rlist, [], [], timeout)[0]
+                if wakeup[0] in ready:
+                    os.read(wakeup[0], 4096)
+
+                if fd in ready:
+                    try:
+                        received += self.serial.read(
+                            max(1, self.serial.inWaiting()))
+                    except Exception:
+                        self.log.put(
+                            (Sender.MSG_RECEIVE, str(sys.exc_info()[1])))
+                        self.emptyQueue()
+                        self.close()
+                        return
+                    while True:
+                        eol = received.find(b"\n")
+                        if eol < 0:
+                            break
+                        line = received[:eol].decode("ascii", "ignore").strip()
+                        del received[: eol + 1]
+                        self._receiveLine(line, cline, sline)
+
+                # Received external message to stop
+                if self._stop:
+                    self._stopIO()
+                    tosend = None
+        finally:
+            self.queue.setWakeup(None)
+            os.close(wakeup[0])
+            os.close(wakeup[1])
@@ -0,0 +1,279 @@
+# $Id$
+#
+# Headless g-code streamer, runs a program without the Tk interface
+# e.g. bCNC --stream file.nc --serial /dev/ttyUSB0
+#
+# Only the Sender machinery is used: no tkinter, PIL or plugins are imported
+
+import os
+import sys
+import time
+from datetime import timedelta
+from queue import Empty
+
+import Pendant
+import Utils
+from CNC import CNC
+from Sender import NOT_CONNECTED, Sender
+
+MONITOR_AFTER = 0.200  # s, same as bmain.MONITOR_AFTER
+PROGRESS_AFTER = 1.0  # s, progress report on a terminal
+PROGRESS_LOG = 30.0  # s, progress report when the output is not a terminal
+
+
+# =============================================================================
+# Sender without GUI, the progress is printed on stdout
+# =============================================================================
+class Streamer(Sender):
+    def __init__(self, device, baudrate):
+        Sender.__init__(self)
+        self.loadConfig()
+        self.device = device
+        self.baudrate = baudrate
+        self.canvas = None  # for the pendant
+        self._pendantFileUploaded = None
+        self._done = False
+        self._failed = False
+        self._start = None
+        self._estimate = 0.0  # estimated time of the program in s
+        self._tty = sys.stdout.isatty()
+        self._report = 0.0
+        CNC.vars["state"] = NOT_CONNECTED
+
+    # ----------------------------------------------------------------------
+    # Interface used by the Sender and the controllers in place of the GUI
+    # ----------------------------------------------------------------------
+    def disable(self):
+        pass
+
+    def enable(self):
+        pass
+
+    def busy(self):
+        pass
+
+    def notBusy(self):
+        pass
+
+    def acceptKey(self, skipRun=False):
+        return True
+
+    def setStatus(self, msg, force_update=False):
+        self.write(msg)
+
+    def event_generate(self, event, **kw):
+        if event == "<<Run>>":
+            # cycle start button of the machine
+            self.run()
+        elif event == "<<Status>>":
+            self.setStatus(kw.get("data", ""))
+
+    def get(self, section, item):
+        return Utils.config.get(section, item)
+
+    # ----------------------------------------------------------------------
+    # Print a message, clearing the progress line if any
+    # ----------------------------------------------------------------------
+    def write(self, msg, stream=None):
+        if self._tty:
+            sys.stdout.write("\r\033[K")
+        (stream or sys.stdout).write(f"{msg}\n")
+        (stream or sys.stdout).flush()
+
+    # ----------------------------------------------------------------------
+    def open(self, device, baudrate):
+        try:
+            return Sender.open(self, device, baudrate)
+        except Exception:
+            self.serial = None
+            self.thread = None
+            self.write(_("Error opening serial {}: {}").format(
+                device, sys.exc_info()[1]), sys.stderr)
+        return False
+
+    # ----------------------------------------------------------------------
+    def openClose(self, event=None):
+        if self.serial is not None:
+            self.close()
+        else:
+            self.open(self.device, self.baudrate)
+
+    # ----------------------------------------------------------------------
+    def load(self, filename):
+        Sender.load(self, filename)
+        self._estimate = self.gcode.estimateTime(self) * 60.0
+        self.write(_("Loaded {}: {} lines, estimated time {}").format(
+            filename, self.gcode.countLines(), _hms(self._estimate)))
+
+    # ----------------------------------------------------------------------
+    def execute(self, line):
+        try:
+            line = self.evaluate(line)
+        except Exception:
+            self.write(_("Evaluation error: {}").format(sys.exc_info()[1]),
+                       sys.stderr)
+            return
+        if line is None or self.executeGcode(line):
+            return
+        self.executeCommand(line)
+
+    # ----------------------------------------------------------------------
+    def quit(self, event=None):
+        self._done = True
+
+    # ----------------------------------------------------------------------
+    # Same as Application.run() for the loaded program
+    # ----------------------------------------------------------------------
+    def run(self, lines=None, start=None, resume=None):
+        if self.serial is None:
+            self.write(_("Serial is not connected"), sys.stderr)
+            return
+        if self.running:
+            if self._pause:
+                self.resume()
+            return
+        preamble = []
+        if start is not None:
+            if resume is None:
+                resume = self.gcode.resumeState(*start, self)
+            preamble = self.gcode.resumePreamble(resume)
+        n = self.gcode.countLines(start, preamble)
+        if n == 0:
+            self.write(_("Not gcode file was loaded"), sys.stderr)
+            return
+
+        CNC.vars["errline"] = ""
+        self.cleanAfter = True
+        self.initRun()
+        self._gcount = 0
+        CNC.vars["running"] = True
+        CNC.vars["_OvChanged"] = True  # force a feed change if any
+        if self._onStart:
+            try:
+                os.system(self._onStart)
+            except Exception:
+                pass
+        self._paths = []
+        self._runLines = n + 1  # plus the wait
+        self._compiler = self.gcode.compileIter(start, self, resume)
+        self._start = time.time()
+        self._report = 0.0
+        self._failed = False
+        self.write(_("Running..."))
+
+    # ----------------------------------------------------------------------
+    def runFrom(self, line=None):
+        try:
+            bid, lid = self.gcode.lineIndex(int(line))
+        except (TypeError, ValueError, IndexError):
+            self.write(_("Invalid line number"), sys.stderr)
+            return
+        if lid >= len(self.gcode[bid]):
+            return
+        resume = self.gcode.resumeState(bid, lid, self)
+        preamble = self.gcode.resumePreamble(resume)
+        self.write(_("Start from block {} line {}: {}").format(
+            bid + 1, lid + 1, self.gcode[bid][lid]))
+        for cmd in preamble:
+            self.write(f"  {cmd}")
+        self.run(start=(bid, lid), resume=resume)
+
+    # ----------------------------------------------------------------------
+    # Progress of the running program with the remaining time, from the
+    # planner estimate until enough of the program is executed
+    # ----------------------------------------------------------------------
+    def progress(self):
+        done = min(self._gcount, self._runLines)
+        total = max(1, self._runLines)
+        elapsed = time.time() - self._start
+        fraction = done / total
+        if fraction > 0.05 or not self._estimate:
+            eta = elapsed / fraction - elapsed if fraction > 0.0 else 0.0
+        else:
+            eta = max(0.0, self._estimate - elapsed)
+        return _("{:>8d}/{:d} {:5.1f}% {} elapsed {} ETA {}").format(
+            done,
+            total,
+            100.0 * fraction,
+            CNC.vars["state"],
+            _hms(elapsed),
+            _hms(eta),
+        )
+
+    # ----------------------------------------------------------------------
+    # Process the messages of the serial thread and the pendant requests,
+    # like Application._monitorSerial
+    # ----------------------------------------------------------------------
+    def monitor(self):
+        t = time.time()
+        while self.log.qsize() > 0 and time.time() - t < 0.1:
+            try:
+                msg, line = self.log.get_nowait()
+            except Empty:
+                break
+            if msg == Sender.MSG_ERROR:
+                self.write(line, sys.stderr)
+                if self.running:
+                    self._failed = True
+            elif msg == Sender.MSG_RUNEND:
+                self.write(line)
+            elif msg == Sender.MSG_CLEAR and self.running:
+                # the run was stopped
+                self.runEnded()
+
+        try:
+            self.execute(self.pendant.get_nowait())
+        except Empty:
+            pass
+
+        if self._pendantFileUploaded is not None:
+            if not self.running:
+                self.load(self._pendantFileUploaded)
+            self._pendantFileUploaded = None
+
+        if not self.running:
+            return
+        if self._compiler is None and self._gcount >= self._runLines:
+            self.write(self.progress())
+            self.runEnded()
+        elif t - self._report >= (PROGRESS_AFTER if self._tty
+                                  else PROGRESS_LOG):
+            self._report = t
+            if self._tty:
+                sys.stdout.write("\r\033[K" + self.progress())
+                sys.stdout.flush()
+            else:
+                self.write(self.progress())
+
+    # ----------------------------------------------------------------------
+    # Stream the program and return when finished or on ^C
+    # @return 0 on success
+    # ----------------------------------------------------------------------
+    def stream(self, pendant=False):
+        if not self.open(self.device, self.baudrate):
+            return 1
+        if pendant and Pendant.start(self):
+            self.write(_("Pendant started on port {}").format(Pendant.port))
+        time.sleep(1.0)  # welcome message and state of the controller
+        self.run()
+        try:
+            while self.running and not self._done:
+                time.sleep(MONITOR_AFTER)
+                self.monitor()
+            self.monitor()  # messages of the end of the run
+        except KeyboardInterrupt:
+            self.write(_("Stopping..."))
+            self.stopRun()
+            time.sleep(1.0)
+            self.runEnded()
+            self.monitor()
+            self._failed = True
+        finally:
+            Pendant.stop()
+            self.close()
+        return int(self._failed or self._start is None)
+
+
+# -----------------------------------------------------------------------------
+def _hms(seconds):
+    return str(timedelta(seconds=int(seconds)))
@@ -0,0 +1,185 @@
+# $Id$
+#
+# Per line execution telemetry of the streamed programs
+#
+# The Sender records for every command sent to the controller the send and
+# the acknowledge time, the fill of the rx buffer and the last status report
+# (free planner blocks, feed and machine position). The status reports
+# themselves are recorded as well. The records are fixed size and appended
+# to a binary file, so a recording can be read back to find where the
+# controller was starved or could not reach the programmed feed.
+
+import copy
+import struct
+import threading
+import time
+
+from CNC import CNC
+
+MAGIC = b"bCNCtlm1"
+HEADER = struct.Struct("<8sdH")  # magic, start time, planner blocks
+# kind, free planner blocks, rx buffer fill, block, line, time [s],
+# feed, machine x, y, z
+RECORD = struct.Struct("<BBHiidffff")
+FLUSH = 1024  # records buffered before writing
+
+SEND = 0  # command written to the controller
+OK = 1  # command acknowledged with ok
+ERROR = 2  # command acknowledged with an error or alarm
+STATUS = 3  # status report
+
+KINDS = ("send", "ok", "error", "status")
+
+# colour of the feed ratio (achieved / programmed) and when starved
+FEED_COLORS = ((0.95, "DarkGreen"), (0.8, "Gold"), (0.5, "Orange"),
+               (0.0, "Red"))
+STARVED_COLOR = "Magenta"
+
+
+# =============================================================================
+# Append only recorder, written from the serial thread
+# =============================================================================
+class Recorder:
+    def __init__(self, filename, plannerSize=0):
+        self.filename = filename
+        self.start = time.time()
+        self.count = 0
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._file = open(filename, "wb")
+        self._file.write(HEADER.pack(MAGIC, self.start, plannerSize))
+
+    # ----------------------------------------------------------------------
+    # Append a record with the last reported status of the controller
+    # ----------------------------------------------------------------------
+    def put(self, kind, path, fill):
+        bid, lid = path or (-1, -1)
+        v = CNC.vars
+        with self._lock:
+            if self._file is None:
+                return
+            self._buffer += RECORD.pack(
+                kind,
+                min(255, max(0, int(v.get("planner", 0)))),
+                min(65535, fill),
+                bid,
+                lid,
+                time.time() - self.start,
+                v.get("curfeed", 0.0),
+                v["mx"],
+                v["my"],
+                v["mz"],
+            )
+            self.count += 1
+            if len(self._buffer) >= FLUSH * RECORD.size:
+                self._flush()
+
+    # ----------------------------------------------------------------------
+    def _flush(self):
+        self._file.write(self._buffer)
+        self._buffer.clear()
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            self._file.close()
+            self._file = None
+
+
+# -----------------------------------------------------------------------------
+# Read a recording
+# @return planner blocks, start time and the list of records
+# -----------------------------------------------------------------------------
+def load(filename):
+    with open(filename, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(_("Invalid telemetry file {}").format(filename))
+    magic, start, plannerSize = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(_("Invalid telemetry file {}").format(filename))
+    end = len(data) - (len(data) - HEADER.size) % RECORD.size
+    records = list(RECORD.iter_unpack(memoryview(data)[HEADER.size:end]))
+    return plannerSize, start, records
+
+
+# -----------------------------------------------------------------------------
+# Feed reached while executing every line. The controller acknowledges a
+# line when it enters the planner, so the line in execution at a status
+# report is the one acknowledged as many blocks before as the planner holds
+# @return {(bid,lid): [sum of feed, samples, starved samples]}
+# -----------------------------------------------------------------------------
+def lineFeeds(records, plannerSize=0):
+    if not plannerSize:
+        plannerSize = max(
+            (r[1] for r in records if r[0] == STATUS), default=0)
+    acked = []  # paths in the order of acknowledge
+    lines = {}
+    for kind, free, fill, bid, lid, t, feed, x, y, z in records:
+        if kind == OK or kind == ERROR:
+            acked.append((bid, lid))
+        elif kind == STATUS and acked:
+            used = max(0, plannerSize - free)
+            path = acked[max(0, len(acked) - max(1, used))]
+            if path[0] < 0:
+                continue
+            info = lines.get(path)
+            if info is None:
+                info = lines[path] = [0.0, 0, 0]
+            info[0] += feed
+            info[1] += 1
+            if plannerSize and used <= 1 and feed > 0.0:
+                info[2] += 1  # moving with the planner running dry
+    return lines
+
+
+# -----------------------------------------------------------------------------
+# Programmed feed of the feed moves of the enabled blocks
+# @return {(bid,lid): feed}
+# -----------------------------------------------------------------------------
+def programFeeds(gcode, app=None):
+    cnc = copy.copy(gcode.cnc)
+    cnc.vars = CNC.vars.copy()  # private feedmode
+    cnc.initPath()
+    feeds = {}
+    for bid, block in enumerate(gcode.blocks):
+        if not block.enable:
+            continue
+        for lid in range(len(block)):
+            try:
+                cmd, words, comment = block.compiled(lid)
+                if words is not None:
+                    cmd = words
+                else:
+                    cmd = gcode.evaluate(cmd, app)
+                    if isinstance(cmd, tuple):
+                        cmd = None
+                    else:
+                        cmd = CNC.breakLine(cmd)
+            except Exception:
+                cmd = None
+            if cmd is None:
+                continue
+            cnc.motionStart(cmd)
+            xyz = cnc.motionPath()
+            cnc.motionEnd()
+            if cnc.feedmode == 93:
+                continue  # inverse time
+            if xyz and cnc.gcode in (1, 2, 3) and cnc.feed > 0.0:
+                feeds[(bid, lid)] = cnc.feed
+    return feeds
+
+
+# -----------------------------------------------------------------------------
+# Colour of a line from the achieved over the programmed feed
+# -----------------------------------------------------------------------------
+def feedColor(ratio, starved=False):
+    if starved:
+        return STARVED_COLOR
+    for limit, color in FEED_COLORS:
+        if ratio >= limit:
+            return color
+    return FEED_COLORS[-1][1]
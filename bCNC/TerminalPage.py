@@ -13,6 +13,7 @@ from tkinter import (
     TOP,
     VERTICAL,
     END,
+    BooleanVar,
     NORMAL,
     DISABLED,
     EXTENDED,
@@ -49,6 +50,61 @@ class TerminalGroup(CNCRibbon.ButtonGroup):
         b.pack(fill=BOTH, expand=YES)
         tkExtra.Balloon.set(b, _("Clear terminal"))
 
+        self.quiet = BooleanVar()
+        self.quiet.set(Utils.getBool("Connection", "quiet", False))
+        b = Ribbon.LabelCheckbutton(
+            self.frame,
+            image=Utils.icons["terminal"],
+            text=_("Quiet"),
+            compound=LEFT,
+            variable=self.quiet,
+            anchor=W,
+            command=self.quietCommand,
+            background=Ribbon._BACKGROUND,
+        )
+        b.pack(fill=BOTH)
+        tkExtra.Balloon.set(
+            b, _("Log only errors and counters of the streamed lines"))
+
+        self.telemetry = BooleanVar()
+        self.telemetry.set(Utils.getBool("Connection", "telemetry", False))
+        b = Ribbon.LabelCheckbutton(
+            self.frame,
+            image=Utils.icons["stats"],
+            text=_("Record"),
+            compound=LEFT,
+            variable=self.telemetry,
+            anchor=W,
+            command=self.telemetryCommand,
+            background=Ribbon._BACKGROUND,
+        )
+        b.pack(fill=BOTH)
+        tkExtra.Balloon.set(
+            b, _("Record the telemetry of the runs next to the g-code file"))
+
+        b = Ribbon.LabelButton(
+            self.frame,
+            image=Utils.icons["stats"],
+            text=_("Telemetry"),
+            compound=LEFT,
+            anchor=W,
+            command=app.showTelemetry,
+            background=Ribbon._BACKGROUND,
+        )
+        b.pack(fill=BOTH)
+        tkExtra.Balloon.set(
+            b, _("Colour the toolpath by the feed achieved in the recorded "
+                 "run: green programmed, yellow to red slower, magenta "
+                 "starved"))
+
+    # ----------------------------------------------------------------------
+    def quietCommand(self, event=None):
+        self.app.quiet = self.quiet.get()
+
+    # ----------------------------------------------------------------------
+    def telemetryCommand(self, event=None):
+        self.app.telemetry = self.telemetry.get()
+
 
 # =============================================================================
 # Commands Group
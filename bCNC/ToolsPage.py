@@ -1026,6 +1026,15 @@ class Profile(DataBase):
                     + "pockets with overcuts."
                 ),
             ),
+            (
+                "method",
+                "path,polygon",
+                "path",
+                _("Offset method"),
+                _("path offsets every path on its own, polygon offsets the "
+                  + "paths of a block as one area with the nested paths as "
+                  + "islands"),
+            ),
         ]
         self.buttons.append("exe")
         self.help = "\n".join([
@@ -1056,7 +1065,8 @@ class Profile(DataBase):
         pocket = self["pocket"]
         if name == "default" or name == "":
             name = None
-        app.profile(direction, self["offset"], self["overcut"], name, pocket)
+        app.profile(direction, self["offset"], self["overcut"], name, pocket,
+                    self["method"])
         app.setStatus(_("Generate profile path"))
 
 
@@ -1070,6 +1080,15 @@ class Pocket(DataBase):
         self.variables = [
             ("name", "db", "", _("Name")),
             ("endmill", "db", "", _("End Mill")),
+            (
+                "method",
+                "path,polygon",
+                "path",
+                _("Offset method"),
+                _("path offsets every path on its own, polygon offsets the "
+                  + "paths of a block as one area with the nested paths as "
+                  + "islands"),
+            ),
         ]
         self.buttons.append("exe")
         self.help = """Remove all material inside selected shape
@@ -1082,7 +1101,7 @@ class Pocket(DataBase):
         name = self["name"]
         if name == "default" or name == "":
             name = None
-        app.pocket(name)
+        app.pocket(name, self["method"])
         app.setStatus(_("Generate pocket path"))
 
 
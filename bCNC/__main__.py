@@ -3,6 +3,7 @@
 import os
 import sys
 import getopt
+import multiprocessing
 
 PRGPATH = os.path.abspath(os.path.dirname(__file__))
 sys.path.append(PRGPATH)
@@ -36,17 +37,16 @@ def usage(rc):
     wrt("\t-s # | --serial #\tOpen serial port specified\n")
     wrt("\t-S\t\t\tDo not open serial port\n")
     wrt("\t--run\t\t\tDirectly run the file once loaded\n")
+    wrt("\t--stream #\t\tStream the file without the GUI to the serial\n")
+    wrt("\t\t\t\tport given with -s | --serial | --port\n")
     wrt("\n")
     sys.exit(rc)
 
 
 # -----------------------------------------------------------------------------
 def main():
-    import Helpers
-    import bmain
-    import tkExtra
+    import Helpers  # noqa: F401 - installs _()
     import Utils
-    import Updates
     from CNC import CNC
     try:
         import serial
@@ -69,6 +69,8 @@ def main():
                 "serial=",
                 "baud=",
                 "run",
+                "stream=",
+                "port=",
             ],
         )
     except getopt.GetoptError:
@@ -77,6 +79,11 @@ def main():
     recent = None
     run = False
     fullscreen = False
+    stream = None
+    device = None
+    baudrate = None
+    pendant = None
+    pendantport = None
     for opt, val in optlist:
         if opt in ("-h", "-?", "--help"):
             usage(0)
@@ -139,17 +146,34 @@ def main():
             fullscreen = True
 
         elif opt == "-p":
-            pass  # startPendant()
+            pendant = True  # startPendant()
 
         elif opt == "-P":
-            pass  # stopPendant()
+            pendant = False  # stopPendant()
 
         elif opt == "--pendant":
-            pass  # startPendant on port
+            pendant = True  # startPendant on port
+            pendantport = int(val)
+
+        elif opt in ("-s", "--serial", "--port"):
+            device = val
+
+        elif opt in ("-b", "--baud"):
+            baudrate = int(val)
 
         elif opt == "--run":
             run = True
 
+        elif opt == "--stream":
+            stream = val
+
+    if stream is not None:
+        return streamFile(stream, device, baudrate, pendant, pendantport)
+
+    import bmain
+    import tkExtra
+    import Updates
+
     application = bmain.Application(className=f"  {Utils.__prg__}  ")
 
     palette = {"background": application.cget("background")}
@@ -208,7 +232,38 @@ def main():
     application.close()
     Utils.saveConfiguration()
 
+
+# -----------------------------------------------------------------------------
+# Stream a file without loading the GUI
+# -----------------------------------------------------------------------------
+def streamFile(filename, device=None, baudrate=None, pendant=None,
+               pendantport=None):
+    import Pendant
+    import Utils
+    from Streamer import Streamer
+
+    Utils.loadConfiguration()
+    if device is None:
+        device = Utils.getStr("Connection", "port")
+    if baudrate is None:
+        baudrate = Utils.getInt("Connection", "baud", 115200)
+    if pendant is None:
+        pendant = Utils.getBool("Connection", "pendant")
+    if not device:
+        sys.stderr.write("ERROR: No serial port specified\n")
+        return 1
+
+    streamer = Streamer(device, baudrate)
+    if pendantport is not None:
+        Pendant.port = pendantport
+    streamer.load(filename)
+    return streamer.stream(pendant)
+
+
 if __name__ == "__main__":
+	# the process pool of the pocket starts bCNC again in the children
+	# of a frozen executable, run them instead of the GUI
+	multiprocessing.freeze_support()
 	sys.stdout.write("=" * 80 + "\n")
 	sys.stdout.write(
 		"WARNING: bCNC was recently ported to only support \n"
@@ -223,4 +278,4 @@ if __name__ == "__main__":
 	)
 	sys.stdout.write("=" * 80 + "\n")
 
-	main()
+	sys.exit(main())
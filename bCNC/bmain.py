@@ -62,6 +62,7 @@ import bFileDialog
 import CNCCanvas
 
 import rexx
+import Telemetry
 import Updates
 import tkDialogs
 import tkExtra
@@ -104,6 +105,7 @@ _baud = None
 
 MONITOR_AFTER = 200  # ms
 DRAW_AFTER = 300  # ms
+TERMINAL_LINES = 1000  # maximum lines kept in the terminal
 
 RX_BUFFER_SIZE = 128
 
@@ -360,6 +362,7 @@ class Application(Tk, Sender):
         self.bind("<<FeedHold>>", lambda e, s=self: s.feedHold())
         self.bind("<<Resume>>", lambda e, s=self: s.resume())
         self.bind("<<Run>>", lambda e, s=self: s.run())
+        self.bind("<<RunFrom>>", lambda e, s=self: s.runFrom())
         self.bind("<<Stop>>", self.stopRun)
         self.bind("<<Pause>>", self.pause)
 
@@ -438,7 +441,7 @@ class Application(Tk, Sender):
         self.bind("<Control-Key-l>", self.editor.toggleEnable)
         self.bind("<Control-Key-q>", self.quit)
         self.bind("<Control-Key-o>", self.loadDialog)
-        self.bind("<Control-Key-r>", self.drawAfter)
+        self.bind("<Control-Key-r>", lambda e, s=self: s.draw())
         self.bind("<Control-Key-s>", self.saveAll)
         self.bind("<Control-Key-y>", self.redo)
         self.bind("<Control-Key-z>", self.undo)
@@ -536,7 +539,9 @@ class Application(Tk, Sender):
         self._inFocus = False
         # END - insertCount lines where ok was applied to for $xxx commands
         self._insertCount = (0)
+        self._bufferLines = deque()  # commands waiting for the ok
         self._selectI = 0
+        self._selectPath = None  # last canvas item colored as processed
         self.monitorSerial()
         self.canvasFrame.toggleDrawFlag()
 
@@ -1115,13 +1120,12 @@ class Application(Tk, Sender):
         e = 0
         le = 0
         r = 0
-        t = 0
+        t = self.gcode.estimateTime(self)
         for block in self.gcode.blocks:
             if block.enable:
                 e += 1
                 le += block.length
                 r += block.rapid
-                t += block.time
 
         # ===========
         frame = LabelFrame(toplevel, text=_(
@@ -1320,7 +1324,13 @@ class Application(Tk, Sender):
     def viewChange(self, event=None):
         if self.running:
             self._selectI = 0  # last selection pointer in items
-        self.draw()
+            self._selectPath = None
+        view = CNCCanvas.VIEWS.index(self.canvasFrame.view.get())
+        # a pending redraw means the cached paths are outdated
+        if self._drawAfter is None and self.canvas.changeView(view):
+            self.selectionChange()
+        else:
+            self.draw()
 
     # ----------------------------------------------------------------------
     def refresh(self, event=None):
@@ -1329,17 +1339,31 @@ class Application(Tk, Sender):
 
     # ----------------------------------------------------------------------
     def draw(self):
+        if self._drawAfter is not None:
+            self.after_cancel(self._drawAfter)
+            self._drawAfter = None
         view = CNCCanvas.VIEWS.index(self.canvasFrame.view.get())
         self.canvas.draw(view)
         self.selectionChange()
 
+    # ----------------------------------------------------------------------
+    # Draw only the modified blocks when possible
+    # ----------------------------------------------------------------------
+    def drawModified(self):
+        self._drawAfter = None
+        view = CNCCanvas.VIEWS.index(self.canvasFrame.view.get())
+        if view == self.canvas.view and self.canvas.drawModified():
+            self.selectionChange()
+        else:
+            self.draw()
+
     # ----------------------------------------------------------------------
     # Redraw with a small delay
     # ----------------------------------------------------------------------
     def drawAfter(self, event=None):
         if self._drawAfter is not None:
             self.after_cancel(self._drawAfter)
-        self._drawAfter = self.after(DRAW_AFTER, self.draw)
+        self._drawAfter = self.after(DRAW_AFTER, self.drawModified)
         return "break"
 
     # -----------------------------------------------------------------------
@@ -1719,7 +1743,8 @@ class Application(Tk, Sender):
                     dz = 0.0
             self.executeOnSelection("MOVE", False, dx, dy, dz)
 
-        # OPT*IMIZE: reorder selected blocks to minimize rapid motions
+        # OPT*IMIZE [REV*ERSE]: reorder selected blocks to minimize rapid
+        # motions, reversing the open blocks if requested
         elif rexx.abbrev("OPTIMIZE", cmd, 3):
             if not self.editor.curselection():
                 messagebox.showinfo(
@@ -1729,7 +1754,9 @@ class Application(Tk, Sender):
                     parent=self,
                 )
             else:
-                self.executeOnSelection("OPTIMIZE", True)
+                reverse = len(line) > 1 and rexx.abbrev(
+                    "REVERSE", line[1].upper(), 3)
+                self.executeOnSelection("OPTIMIZE", True, reverse)
 
         # # FIXME comment for ORIENT not OPTIMIZE
         # OPT*IMIZE: reorder selected blocks to minimize rapid motions
@@ -1883,6 +1910,15 @@ class Application(Tk, Sender):
             self.executeOnSelection(
                 "TABS", True, ntabs, dtabs, dx, dy, z, circular)
 
+        # TEL*EMETRY [file]: colour the toolpath from a telemetry recording
+        elif rexx.abbrev("TELEMETRY", cmd, 3) and (
+            len(line) == 1 or line[1].upper() not in ("ON", "OFF")
+        ):
+            if len(line) > 1:
+                self.showTelemetry(oline.split(None, 1)[1])
+            else:
+                self.showTelemetry()
+
         # TERM*INAL: switch to terminal tab
         elif rexx.abbrev("TERMINAL", cmd, 4):
             self.ribbon.changePage("Terminal")
@@ -2008,7 +2044,7 @@ class Application(Tk, Sender):
         elif cmd == "MOVE":
             self.gcode.moveLines(items, *args)
         elif cmd == "OPTIMIZE":
-            self.gcode.optimize(items)
+            self.gcode.optimize(items, *args)
         elif cmd == "ORIENT":
             self.gcode.orientLines(items)
         elif cmd == "REVERSE":
@@ -2041,6 +2077,7 @@ class Application(Tk, Sender):
         overcut=False,
         name=None,
         pocket=False,
+        method="path",
     ):
         tool = self.tools["EndMill"]
         ofs = self.tools.fromMm(tool["diameter"]) / 2.0
@@ -2067,7 +2104,8 @@ class Application(Tk, Sender):
         self.busy()
         blocks = self.editor.getSelectedBlocks()
         # on return we have the blocks with the new blocks to select
-        msg = self.gcode.profile(blocks, ofs * sign, overcut, name, pocket)
+        msg = self.gcode.profile(
+            blocks, ofs * sign, overcut, name, pocket, method)
         if msg:
             messagebox.showwarning(
                 "Open paths", f"WARNING: {msg}", parent=self)
@@ -2078,7 +2116,7 @@ class Application(Tk, Sender):
         self.setStatus(_("Profile block distance={:g}").format(ofs * sign))
 
     # -----------------------------------------------------------------------
-    def pocket(self, name=None):
+    def pocket(self, name=None, method="path"):
         tool = self.tools["EndMill"]
         diameter = self.tools.fromMm(tool["diameter"])
         try:
@@ -2089,7 +2127,8 @@ class Application(Tk, Sender):
         self.busy()
         blocks = self.editor.getSelectedBlocks()
         # on return we have the blocks with the new blocks to select
-        msg = self.gcode.pocket(blocks, diameter, stepover, name)
+        msg = self.gcode.pocket(blocks, diameter, stepover, name,
+                               method=method)
         if msg:
             messagebox.showwarning(
                 _("Open paths"), _("WARNING: {}").format(msg), parent=self
@@ -2536,8 +2575,10 @@ class Application(Tk, Sender):
 
     # -----------------------------------------------------------------------
     # Send enabled gcode file to the CNC machine
+    # @param start  (bid,lid) to resume the program from
+    # @param resume state at start from GCode.resumeState(), if known
     # -----------------------------------------------------------------------
-    def run(self, lines=None):
+    def run(self, lines=None, start=None, resume=None):
         self.cleanAfter = True  # Clean when this operation stops
         print("Will clean after this operation")
 
@@ -2567,6 +2608,7 @@ class Application(Tk, Sender):
         # are still sending or we finished
         self._gcount = 0  # count executed lines
         self._selectI = 0  # last selection pointer in items
+        self._selectPath = None
         self._paths = None  # temporary
         CNC.vars["running"] = True  # enable running status
         CNC.vars["_OvChanged"] = True  # force a feed change if any
@@ -2577,14 +2619,13 @@ class Application(Tk, Sender):
                 pass
 
         if lines is None:
-            self.statusbar.setLimits(0, 9999)
-            self.statusbar.setProgress(0, 0)
-            self._paths = self.gcode.compile(self.queue, self.checkStop)
-            if self._paths is None:
-                self.emptyQueue()
-                self.purgeController()
-                return
-            elif not self._paths:
+            preamble = []
+            if start is not None:
+                if resume is None:
+                    resume = self.gcode.resumeState(*start, self)
+                preamble = self.gcode.resumePreamble(resume)
+            n = self.gcode.countLines(start, preamble)
+            if n == 0:
                 self.runEnded()
                 messagebox.showerror(
                     _("Empty gcode"),
@@ -2595,23 +2636,36 @@ class Application(Tk, Sender):
 
             # reset colors
             before = time.time()
-            for ij in self._paths:  # Slow loop
-                if not ij:
+            for block in self.gcode.blocks:  # Slow loop
+                if not block.enable:
                     continue
-                path = self.gcode[ij[0]].path(ij[1])
-                if path:
+                last = None
+                for path in block._path:
+                    # merged polylines are shared by consecutive lines
+                    if not path or path == last:
+                        continue
+                    last = path
                     color = self.canvas.itemcget(path, "fill")
                     if color != CNCCanvas.ENABLE_COLOR:
                         self.canvas.itemconfig(
                             path, width=1, fill=CNCCanvas.ENABLE_COLOR
                         )
-                    # Force a periodic update since this loop can take time
-                    if time.time() - before > 0.25:
-                        self.update()
-                        before = time.time()
-
-            # the buffer of the machine should be empty?
-            self._runLines = len(self._paths) + 1  # plus the wait
+                # Force a periodic update since this loop can take time
+                if time.time() - before > 0.25:
+                    self.update()
+                    before = time.time()
+
+            # Lines are compiled on demand from the serial thread.
+            # The estimated number of lines is replaced by the real one
+            # once the compilation is finished
+            self._paths = []
+            self._runLines = n + 1  # plus the wait
+            self._compiler = self.gcode.compileIter(start, self, resume)
+        elif hasattr(lines, "__next__"):
+            # lines generated while running e.g. the adaptive probe scan
+            self._paths = []
+            self._runLines = 1
+            self._compiler = CNC.compileIter(lines)
         else:
             n = 1  # including one wait command
             for line in CNC.compile(lines):
@@ -2623,7 +2677,7 @@ class Application(Tk, Sender):
                     n += 1
             # set it at the end to be sure that all lines are queued
             self._runLines = n
-        self.queue.put((WAIT,))  # wait at the end to become idle
+            self.queue.put((WAIT,))  # wait at the end to become idle
 
         self.setStatus(_("Running..."))
         self.statusbar.setLimits(0, self._runLines)
@@ -2634,6 +2688,76 @@ class Application(Tk, Sender):
         self.bufferbar.config(background="DarkGray")
         self.bufferbar.setText("")
 
+    # -----------------------------------------------------------------------
+    # Resume the program from a line, the active line of the editor or
+    # the program line number
+    # -----------------------------------------------------------------------
+    def runFrom(self, line=None):
+        if line is None:
+            active = self.editor.getActive()
+            if active is None:
+                return
+            bid, lid = active
+            lid = lid or 0
+        else:
+            try:
+                bid, lid = self.gcode.lineIndex(int(line))
+            except (ValueError, IndexError):
+                messagebox.showerror(
+                    _("Start from"), _("Invalid line number"), parent=self)
+                return
+        if lid >= len(self.gcode[bid]):
+            return
+
+        resume = self.gcode.resumeState(bid, lid, self)
+        preamble = self.gcode.resumePreamble(resume)
+        if not messagebox.askokcancel(
+            _("Start from"),
+            _("Start from block {} line {}:\n{}\n\nafter sending:\n{}").format(
+                bid + 1, lid + 1, self.gcode[bid][lid], "\n".join(preamble)),
+            parent=self,
+        ):
+            return
+        self.run(start=(bid, lid), resume=resume)
+
+    # -----------------------------------------------------------------------
+    # Colour the toolpath by the feed achieved over the programmed one, from
+    # the telemetry recorded while running the program
+    # -----------------------------------------------------------------------
+    def showTelemetry(self, filename=None):
+        if filename is None:
+            filename = self.telemetryFile()
+        try:
+            plannerSize, start, records = Telemetry.load(filename)
+        except (OSError, ValueError):
+            messagebox.showerror(
+                _("Telemetry"), sys.exc_info()[1], parent=self)
+            return
+
+        feeds = Telemetry.programFeeds(self.gcode, self)
+        slow = starved = 0
+        for (bid, lid), (total, n, dry) in Telemetry.lineFeeds(
+            records, plannerSize
+        ).items():
+            feed = feeds.get((bid, lid))
+            if not feed or bid >= len(self.gcode.blocks):
+                continue  # rapid motion or another program
+            path = self.gcode[bid].path(lid)
+            if not path:
+                continue
+            ratio = total / n / feed
+            dry = 2 * dry > n
+            if dry:
+                starved += 1
+            elif ratio < Telemetry.FEED_COLORS[0][0]:
+                slow += 1
+            self.canvas.itemconfig(
+                path, width=2, fill=Telemetry.feedColor(ratio, dry))
+        self.setStatus(
+            _("Telemetry {}: {} lines below the programmed feed, "
+              "{} lines starved").format(
+                os.path.basename(filename), slow, starved))
+
     # -----------------------------------------------------------------------
     # Start the web pendant
     # -----------------------------------------------------------------------
@@ -2674,22 +2798,25 @@ class Application(Tk, Sender):
         t = time.time()
 
         # dump in the terminal what ever you can in less than 0.1s
-        inserted = False
-        while self.log.qsize() > 0 and time.time() - t < 0.1:
-            try:
-                msg, line = self.log.get_nowait()
+        # the new lines are collected and inserted at once
+        lines = []
+        colors = []  # (index in lines, color)
+        buffer = self._bufferLines
+        bufferChanged = False
+        while self.log and time.time() - t < 0.1:
+            for msg, line in self.log.getChunk():
                 line = str(line).rstrip("\n")
-                inserted = True
 
                 if msg == Sender.MSG_BUFFER:
-                    self.buffer.insert(END, line)
+                    buffer.append(line)
+                    bufferChanged = True
 
                 elif msg == Sender.MSG_SEND:
-                    self.terminal.insert(END, line)
-                    self.terminal.itemconfig(END, foreground="Blue")
+                    colors.append((len(lines), "Blue"))
+                    lines.append(line)
 
                 elif msg == Sender.MSG_RECEIVE:
-                    self.terminal.insert(END, line)
+                    lines.append(line)
                     if self._insertCount:
                         # when counting is started, then continue
                         self._insertCount += 1
@@ -2698,51 +2825,48 @@ class Application(Tk, Sender):
                         # starting with $ or [
                         self._insertCount = 1
 
-                elif msg == Sender.MSG_OK:
-                    if self.terminal.size() > 0:
-                        if self._insertCount:
-                            pos = self.terminal.size() - self._insertCount
-                            self._insertCount = 0
-                        else:
-                            pos = END
-                        self.terminal.insert(pos, self.buffer.get(0))
-                        self.terminal.itemconfig(pos, foreground="Blue")
-                        self.buffer.delete(0)
-                    self.terminal.insert(END, line)
-
-                elif msg == Sender.MSG_ERROR:
-                    if self.terminal.size() > 0:
-                        if self._insertCount:
-                            pos = self.terminal.size() - self._insertCount
-                            self._insertCount = 0
-                        else:
-                            pos = END
-                        self.terminal.insert(pos, self.buffer.get(0))
-                        self.terminal.itemconfig(pos, foreground="Blue")
-                        self.buffer.delete(0)
-                    self.terminal.insert(END, line)
-                    self.terminal.itemconfig(END, foreground="Red")
+                elif msg in (Sender.MSG_OK, Sender.MSG_ERROR):
+                    if buffer:
+                        self._terminalCommand(lines, colors, buffer.popleft())
+                        bufferChanged = True
+                    if msg == Sender.MSG_ERROR:
+                        colors.append((len(lines), "Red"))
+                    lines.append(line)
 
                 elif msg == Sender.MSG_RUNEND:
-                    self.terminal.insert(END, line)
-                    self.terminal.itemconfig(END, foreground="Magenta")
+                    colors.append((len(lines), "Magenta"))
+                    lines.append(line)
                     self.setStatus(line)
                     self.enable()
 
                 elif msg == Sender.MSG_CLEAR:
-                    self.buffer.delete(0, END)
+                    buffer.clear()
+                    bufferChanged = True
 
                 else:
                     # Unknown?
-                    self.buffer.insert(END, line)
-                    self.terminal.itemconfig(END, foreground="Magenta")
-
-                if self.terminal.size() > 1000:
-                    self.terminal.delete(0, 500)
-            except Empty:
-                break
-
-        if inserted:
+                    colors.append((len(lines), "Magenta"))
+                    lines.append(line)
+
+        if bufferChanged:
+            self.buffer.delete(0, END)
+            if buffer:
+                self.buffer.insert(END, *buffer)
+
+        if lines:
+            if len(lines) > TERMINAL_LINES:
+                # only the last ones would remain visible
+                skip = len(lines) - TERMINAL_LINES
+                del lines[:skip]
+                colors = [(i - skip, color) for i, color in colors
+                          if i >= skip]
+            self.terminal.insert(END, *lines)
+            size = self.terminal.size()
+            first = size - len(lines)
+            for i, color in colors:
+                self.terminal.itemconfig(first + i, foreground=color)
+            if size > TERMINAL_LINES:
+                self.terminal.delete(0, size - TERMINAL_LINES // 2 - 1)
             self.terminal.see(END)
 
         # Check pendant
@@ -2803,9 +2927,15 @@ class Application(Tk, Sender):
             self._update = None
 
         if self.running:
-            self.statusbar.setProgress(
-                self._runLines - self.queue.qsize(), self._gcount
-            )
+            if self._paths is not None:
+                # streaming compile, the real number of lines is known
+                # only at the end
+                if self.statusbar.high != self._runLines:
+                    self.statusbar.setHigh(self._runLines)
+                sent = self._dequeued
+            else:
+                sent = self._runLines - self.queue.qsize()
+            self.statusbar.setProgress(sent, self._gcount)
             CNC.vars["msg"] = self.statusbar.msg
             self.bufferbar.setProgress(Sender.getBufferFill(self))
             self.bufferbar.setText(f"{Sender.getBufferFill(self):3.0f}%")
@@ -2817,15 +2947,37 @@ class Application(Tk, Sender):
                     if self._paths[self._selectI]:
                         i, j = self._paths[self._selectI]
                         path = self.gcode[i].path(j)
-                        if path:
+                        if path and path != self._selectPath:
                             self.canvas.itemconfig(
                                 path, width=2, fill=CNCCanvas.PROCESS_COLOR
                             )
+                            self._selectPath = path
                     self._selectI += 1
 
-            if self._gcount >= self._runLines:
+            if self._compiler is None and self._gcount >= self._runLines:
                 self.runEnded()
 
+    # -----------------------------------------------------------------------
+    # Add the command acknowledged by the controller to the terminal lines,
+    # before the reply lines of $ and [ commands
+    # -----------------------------------------------------------------------
+    def _terminalCommand(self, lines, colors, command):
+        count = self._insertCount
+        self._insertCount = 0
+        if count > len(lines):
+            # the reply started in a previous update
+            pos = self.terminal.size() - (count - len(lines))
+            self.terminal.insert(pos, command)
+            self.terminal.itemconfig(pos, foreground="Blue")
+            return
+        pos = len(lines) - count
+        lines.insert(pos, command)
+        if count:
+            for k, (i, color) in enumerate(colors):
+                if i >= pos:
+                    colors[k] = (i + 1, color)
+        colors.append((pos, "Blue"))
+
     # -----------------------------------------------------------------------
     # "thread" timed function looking for messages in the serial thread
     # and reporting back in the terminal
@@ -1,5 +1,7 @@
 # GRBL 1.0+ motion controller plugin
 
+import re
+
 from _GenericController import SPLITPAT
 from _GenericGRBL import _GenericGRBL
 from CNC import CNC
@@ -26,11 +28,90 @@ OV_FLOOD_TOGGLE = chr(0xA0)
 OV_MIST_TOGGLE = chr(0xA1)
 
 
+MPOS = ("mx", "my", "mz", "ma", "mb", "mc")
+WPOS = ("wx", "wy", "wz", "wa", "wb", "wc")
+WCO = ("wcox", "wcoy", "wcoz", "wcoa", "wcob", "wcoc")
+
+# status report field: slot of the Status record
+STATUS_FIELDS = {
+    "MPos": "mpos",
+    "WPos": "wpos",
+    "WCO": "wco",
+    "FS": "fs",
+    "F": "fs",
+    "Bf": "bf",
+    "Ov": "ov",
+    "Pn": "pn",
+}
+
+# status report in the field order of grbl with MPos ($10=1 or 3), the
+# other layouts are split field by field
+STATUSPAT = re.compile(
+    r"<([^|>]*)\|MPos:([^|>]*)(?:\|Bf:([^|>]*))?(?:\|Ln:[^|>]*)?"
+    r"\|FS?:([^|>]*)(?:\|Pn:([^|>]*))?(?:\|WCO:([^|>]*))?"
+    r"(?:\|Ov:([^|>]*))?(?:\|A:[^|>]*)?>$"
+)
+
+
+# =============================================================================
+# Fields of a status report <Idle|MPos:0.000,0.000,0.000|FS:0,0|...>
+# The values are kept as received, so that unchanged fields are detected
+# with a string comparison and never converted. Missing fields are None
+# =============================================================================
+class Status:
+    __slots__ = ("state", "mpos", "wpos", "wco", "fs", "bf", "ov", "pn")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.state = ""
+        self.mpos = self.wpos = self.wco = None
+        self.fs = self.bf = self.ov = None
+        self.pn = ""
+
+
+# -----------------------------------------------------------------------------
+# Split a status report in a single pass
+# @return status filled with the fields of the line
+# -----------------------------------------------------------------------------
+def parseStatus(line, status=None):
+    if status is None:
+        status = Status()
+    match = STATUSPAT.match(line)
+    if match is not None:
+        (status.state, status.mpos, status.bf, status.fs, pn,
+         status.wco, status.ov) = match.groups()
+        status.wpos = None
+        status.pn = pn or ""
+        return status
+    status.clear()
+    fields = line[1:-1].split("|")
+    status.state = fields[0]
+    get = STATUS_FIELDS.get
+    for field in fields[1:]:
+        name, sep, value = field.partition(":")
+        slot = get(name)
+        if slot is not None:
+            setattr(status, slot, value)
+    return status
+
+
+# -----------------------------------------------------------------------------
+def _position(value):
+    position = tuple(map(float, value.split(",")))
+    if len(position) < 3:
+        raise ValueError(value)
+    return position
+
+
 class Controller(_GenericGRBL):
     def __init__(self, master):
         self.gcode_case = 0
         self.has_override = True
         self.master = master
+        self._status = Status()  # last report
+        self._report = Status()  # record reused for the next report
 
     def jog(self, direction):
         self.master.sendGCode(f"$J=G91 {direction} F100000")
@@ -91,139 +172,138 @@ class Controller(_GenericGRBL):
             self.master.serial_write(OV_SPINDLE_d1)
             CNC.vars["_OvChanged"] = diff < -1
 
+    def initController(self):
+        self._status.clear()  # forget the last reported values
+        _GenericGRBL.initController(self)
+
+    # ----------------------------------------------------------------------
+    # Update CNC.vars only with the values changed since the last report
+    # ----------------------------------------------------------------------
     def parseBracketAngle(self, line, cline):
         self.master.sio_status = False
-        fields = line[1:-1].split("|")
-        CNC.vars["pins"] = ""
+        last = self._status
+        status = parseStatus(line, self._report)
+        state = status.state
 
         # Report if state has changed
-        if (
-            CNC.vars["state"] != fields[0]
-            or self.master.runningPrev != self.master.running
-        ):
-            self.master.controllerStateChange(fields[0])
-        self.master.runningPrev = self.master.running
-
-        self.displayState(fields[0])
-
-        for field in fields[1:]:
-            word = SPLITPAT.split(field)
-            if word[0] == "MPos":
-                try:
-                    CNC.vars["mx"] = float(word[1])
-                    CNC.vars["my"] = float(word[2])
-                    CNC.vars["mz"] = float(word[3])
-                    CNC.vars["wx"] = round(
-                        CNC.vars["mx"] - CNC.vars["wcox"], CNC.digits
-                    )
-                    CNC.vars["wy"] = round(
-                        CNC.vars["my"] - CNC.vars["wcoy"], CNC.digits
-                    )
-                    CNC.vars["wz"] = round(
-                        CNC.vars["mz"] - CNC.vars["wcoz"], CNC.digits
-                    )
-                    if len(word) > 4:
-                        CNC.vars["ma"] = float(word[4])
-                        CNC.vars["wa"] = round(
-                            CNC.vars["ma"] - CNC.vars["wcoa"], CNC.digits
-                        )
-                    if len(word) > 5:
-                        CNC.vars["mb"] = float(word[5])
-                        CNC.vars["wb"] = round(
-                            CNC.vars["mb"] - CNC.vars["wcob"], CNC.digits
-                        )
-                    if len(word) > 6:
-                        CNC.vars["mc"] = float(word[6])
-                        CNC.vars["wc"] = round(
-                            CNC.vars["mc"] - CNC.vars["wcoc"], CNC.digits
-                        )
-                    self.master._posUpdate = True
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "F":
-                try:
-                    CNC.vars["curfeed"] = float(word[1])
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "FS":
-                try:
-                    CNC.vars["curfeed"] = float(word[1])
-                    CNC.vars["curspindle"] = float(word[2])
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "Bf":
-                try:
-                    CNC.vars["planner"] = int(word[1])
-                    CNC.vars["rxbytes"] = int(word[2])
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "Ov":
-                try:
-                    CNC.vars["OvFeed"] = int(word[1])
-                    CNC.vars["OvRapid"] = int(word[2])
-                    CNC.vars["OvSpindle"] = int(word[3])
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "WCO":
-                try:
-                    CNC.vars["wcox"] = float(word[1])
-                    CNC.vars["wcoy"] = float(word[2])
-                    CNC.vars["wcoz"] = float(word[3])
-
-                    if len(word) > 4:
-                        CNC.vars["wcoa"] = float(word[4])
-                    if len(word) > 5:
-                        CNC.vars["wcob"] = float(word[5])
-                    if len(word) > 6:
-                        CNC.vars["wcoc"] = float(word[6])
-                except (ValueError, IndexError):
-                    CNC.vars["state"] = f"Garbage receive {word[0]}: {line}"
-                    self.master.log.put(
-                        (self.master.MSG_RECEIVE, CNC.vars["state"]))
-                    break
-            elif word[0] == "Pn":
-                try:
-                    CNC.vars["pins"] = word[1]
-                    if "S" in word[1]:
-                        if (CNC.vars["state"] == "Idle"
-                                and not self.master.running):
-                            print("Stream requested by CYCLE START "
-                                  + "machine button")
-                            self.master.event_generate("<<Run>>", when="tail")
-                        else:
-                            print(
-                                "Ignoring machine stream request, "
-                                + "because of state: ",
-                                CNC.vars["state"],
-                                self.master.running,
-                            )
-                except (ValueError, IndexError):
-                    break
+        master = self.master
+        if CNC.vars["state"] != state:
+            master.controllerStateChange(state)
+            self.displayState(state)
+        elif master.runningPrev != master.running:
+            master.controllerStateChange(state)
+        master.runningPrev = master.running
+
+        try:
+            changed = self._updateStatus(status, last, cline)
+        except (ValueError, IndexError):
+            CNC.vars["state"] = f"Garbage receive {status.state}: {line}"
+            self.master.log.put((self.master.MSG_RECEIVE, CNC.vars["state"]))
+            status.clear()
+            changed = True
+        if changed:
+            self.master._posUpdate = True
+        self._status, self._report = status, last
+
+        if "S" in status.pn:
+            if CNC.vars["state"] == "Idle" and not self.master.running:
+                print("Stream requested by CYCLE START machine button")
+                self.master.event_generate("<<Run>>", when="tail")
+            else:
+                print(
+                    "Ignoring machine stream request, because of state: ",
+                    CNC.vars["state"],
+                    self.master.running,
+                )
 
         # Machine is Idle buffer is empty stop waiting and go on
         if (
             self.master.sio_wait
             and not cline
-            and fields[0] not in ("Run", "Jog", "Hold")
+            and state not in ("Run", "Jog", "Hold")
         ):
             self.master.sio_wait = False
             self.master._gcount += 1
 
+    # ----------------------------------------------------------------------
+    # Convert and store in CNC.vars the fields that differ from the last
+    # report. Fields not reported keep their last value
+    # @return True if anything displayed changed
+    # ----------------------------------------------------------------------
+    def _updateStatus(self, status, last, cline):
+        v = CNC.vars
+        changed = status.state != last.state
+
+        if status.wco is None:
+            status.wco = last.wco
+        moved = status.wco != last.wco
+        if moved:
+            for key, value in zip(WCO, _position(status.wco)):
+                v[key] = value
+
+        if status.mpos is not None:
+            if moved or status.mpos != last.mpos:
+                digits = CNC.digits
+                pos = status.mpos.split(",")
+                x = v["mx"] = float(pos[0])
+                y = v["my"] = float(pos[1])
+                z = v["mz"] = float(pos[2])
+                v["wx"] = round(x - v["wcox"], digits)
+                v["wy"] = round(y - v["wcoy"], digits)
+                v["wz"] = round(z - v["wcoz"], digits)
+                if len(pos) > 3:
+                    for mkey, wkey, key, value in zip(
+                        MPOS[3:], WPOS[3:], WCO[3:], pos[3:]
+                    ):
+                        v[mkey] = value = float(value)
+                        v[wkey] = round(value - v[key], digits)
+                changed = True
+        elif status.wpos is not None:
+            # $10 reporting the work position
+            if moved or status.wpos != last.wpos:
+                digits = CNC.digits
+                for mkey, wkey, key, value in zip(
+                    MPOS, WPOS, WCO, _position(status.wpos)
+                ):
+                    v[wkey] = value
+                    v[mkey] = round(value + v[key], digits)
+                changed = True
+        else:
+            status.mpos = last.mpos
+            status.wpos = last.wpos
+
+        if status.fs is None:
+            status.fs = last.fs
+        elif status.fs != last.fs:
+            fs = status.fs.split(",")
+            v["curfeed"] = float(fs[0])
+            if len(fs) > 1:
+                v["curspindle"] = float(fs[1])
+            changed = True
+
+        if status.bf is None:
+            status.bf = last.bf
+        else:
+            if status.bf != last.bf:
+                planner, rxbytes = status.bf.split(",")
+                v["planner"] = int(planner)
+                v["rxbytes"] = int(rxbytes)
+            self.master.bufferReport(v["planner"], v["rxbytes"], cline)
+
+        if status.ov is None:
+            status.ov = last.ov
+        elif status.ov != last.ov:
+            feed, rapid, spindle = status.ov.split(",")
+            v["OvFeed"] = int(feed)
+            v["OvRapid"] = int(rapid)
+            v["OvSpindle"] = int(spindle)
+            changed = True
+
+        if status.pn != last.pn:
+            v["pins"] = status.pn
+            changed = True
+        return changed
+
     def parseBracketSquare(self, line):
         word = SPLITPAT.split(line[1:-1])
         if word[0] == "PRB":
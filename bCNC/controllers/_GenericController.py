@@ -26,8 +26,15 @@ DOLLARPAT = re.compile(r"^\[G\d* .*\]$")
 # Only used in this file
 VARPAT = re.compile(r"^\$(\d+)=(\d*\.?\d*) *\(?.*")
 
+POLL_DEEP = 64  # queued commands of a long streaming run
+
 
 class _GenericController:
+    # Status report polling intervals in s, see pollInterval()
+    poll_idle = 0.125
+    poll_fast = 0.125  # jogging, homing and probing
+    poll_run = 0.125  # streaming with a deep queue
+
     def test(self):
         print("test supergen")
 
@@ -112,6 +119,23 @@ class _GenericController:
         self.master.serial_write(b"?")
         self.master.sio_status = True
 
+    # ----------------------------------------------------------------------
+    # Interval to the next status report request. Fast while the position
+    # changes interactively, slow while streaming a long program where the
+    # reports only take bandwidth from the streamed lines
+    # @param sline commands sent and not yet acknowledged
+    # ----------------------------------------------------------------------
+    def pollInterval(self, sline):
+        state = CNC.vars["state"]
+        if state.startswith(("Jog", "Home")) or any(
+            "G38" in cmd or "g38" in cmd or cmd.startswith("$J=")
+            for cmd in sline
+        ):
+            return self.poll_fast
+        if self.master.running and self.master.queue.qsize() >= POLL_DEEP:
+            return self.poll_run
+        return self.poll_idle
+
     def viewParameters(self):
         self.master.sendGCode("$#")
 
@@ -219,6 +219,11 @@ for e1, e0 in (
 
 
 class _GenericGRBL(_GenericController):
+    # "?" is a realtime command of grbl, it is answered at once without
+    # entering the rx buffer, so it can be polled fast
+    poll_fast = 0.05
+    poll_run = 0.25
+
     def test(self):
         print("test supergen grbl")
 
@@ -6,6 +6,7 @@
 # Contributor: @harvie Tomas Mudrunka (2018)
 # Date:   10-Mar-2015
 
+from array import array
 from copy import deepcopy
 from math import (
     atan,
@@ -13,6 +14,7 @@ from math import (
     ceil,
     cos,
     degrees,
+    floor,
     pi,
     sin,
     sqrt
@@ -22,6 +24,11 @@ from operator import itemgetter
 from bmath import Vector, quadratic
 from Helpers import to_zip
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 __author__ = "Vasilis Vlachoudis"
 __email__ = "Vasilis.Vlachoudis@cern.ch"
 
@@ -30,6 +37,7 @@ EPS2 = EPS**2
 EPSV = EPS * 10  # relaxed tolerances for vectors
 EPSV2 = EPSV**2
 PI2 = 2.0 * pi
+PI_2 = pi / 2.0
 
 
 # -----------------------------------------------------------------------------
@@ -195,11 +203,27 @@ class Segment:
             self.miny = min(self.A[1], self.B[1]) - EPSV
             self.maxy = max(self.A[1], self.B[1]) + EPSV
         else:
-            # FIXME very bad
-            self.minx = self.C[0] - self.radius - EPSV
-            self.maxx = self.C[0] + self.radius + EPSV
-            self.miny = self.C[1] - self.radius - EPSV
-            self.maxy = self.C[1] + self.radius + EPSV
+            # end points and the axis extremes swept by the arc
+            xs = [self.A[0], self.B[0]]
+            ys = [self.A[1], self.B[1]]
+            if self.type == Segment.CW:
+                lo, hi = self.endPhi, self.startPhi
+            else:
+                lo, hi = self.startPhi, self.endPhi
+            for k in range(ceil(lo / PI_2), floor(hi / PI_2) + 1):
+                k %= 4
+                if k == 0:
+                    xs.append(self.C[0] + self.radius)
+                elif k == 1:
+                    ys.append(self.C[1] + self.radius)
+                elif k == 2:
+                    xs.append(self.C[0] - self.radius)
+                else:
+                    ys.append(self.C[1] - self.radius)
+            self.minx = min(xs) - EPSV
+            self.maxx = max(xs) + EPSV
+            self.miny = min(ys) - EPSV
+            self.maxy = max(ys) + EPSV
 
     # ----------------------------------------------------------------------
     def __repr__(self):
@@ -711,6 +735,95 @@ class Segment:
         return new
 
 
+# =============================================================================
+# Uniform grid over the bounding boxes of a list of segments, to find the
+# segments that may intersect a box or a line without testing all of them
+# =============================================================================
+class SegmentGrid:
+    def __init__(self, segments):
+        self.segments = segments
+        n = max(1, len(segments))
+        self.minx = min((s.minx for s in segments), default=0.0)
+        self.miny = min((s.miny for s in segments), default=0.0)
+        self.maxx = max((s.maxx for s in segments), default=0.0)
+        self.maxy = max((s.maxy for s in segments), default=0.0)
+        width = self.maxx - self.minx
+        height = self.maxy - self.miny
+
+        # cells of the mean segment size, but not more cells than segments
+        mean = sum(
+            max(s.maxx - s.minx, s.maxy - s.miny) for s in segments) / n
+        self.size = max(mean, sqrt(width * height / n),
+                        max(width, height) / n, EPSV)
+        self.nx = int(width / self.size) + 1
+        self.ny = int(height / self.size) + 1
+        self.cells = [[] for _ in range(self.nx * self.ny)]
+        for i, s in enumerate(segments):
+            for cell in self._cells(s.minx, s.miny, s.maxx, s.maxy):
+                cell.append(i)
+
+    # ----------------------------------------------------------------------
+    def _column(self, x):
+        return min(self.nx - 1, max(0, int((x - self.minx) / self.size)))
+
+    # ----------------------------------------------------------------------
+    def _row(self, y):
+        return min(self.ny - 1, max(0, int((y - self.miny) / self.size)))
+
+    # ----------------------------------------------------------------------
+    def _cells(self, minx, miny, maxx, maxy):
+        j0 = self._row(miny)
+        j1 = self._row(maxy) + 1
+        for i in range(self._column(minx), self._column(maxx) + 1):
+            yield from self.cells[i * self.ny + j0:i * self.ny + j1]
+
+    # ----------------------------------------------------------------------
+    # @return sorted indices of the segments that may overlap the box
+    # ----------------------------------------------------------------------
+    def query(self, minx, miny, maxx, maxy):
+        found = set()
+        for cell in self._cells(minx, miny, maxx, maxy):
+            found.update(cell)
+        return sorted(found)
+
+    # ----------------------------------------------------------------------
+    # @return sorted indices of the segments that may intersect segment
+    # ----------------------------------------------------------------------
+    def candidates(self, segment):
+        return self.query(segment.minx, segment.miny,
+                          segment.maxx, segment.maxy)
+
+    # ----------------------------------------------------------------------
+    # @return sorted indices of the segments that may intersect line AB,
+    # visiting only the cells along the line
+    # ----------------------------------------------------------------------
+    def queryLine(self, A, B):
+        if A[0] > B[0]:
+            A, B = B, A
+        dx = B[0] - A[0]
+        dy = B[1] - A[1]
+        found = set()
+        for i in range(self._column(A[0] - EPSV),
+                       self._column(B[0] + EPSV) + 1):
+            # part of the line inside the column
+            xa = max(A[0], self.minx + i * self.size - EPSV)
+            xb = min(B[0], self.minx + (i + 1) * self.size + EPSV)
+            if xa > xb:
+                continue
+            if dx > EPS:
+                ya = A[1] + dy * (xa - A[0]) / dx
+                yb = A[1] + dy * (xb - A[0]) / dx
+            else:
+                ya, yb = A[1], B[1]
+            if ya > yb:
+                ya, yb = yb, ya
+            j0 = self._row(ya - EPSV)
+            j1 = self._row(yb + EPSV) + 1
+            for cell in self.cells[i * self.ny + j0:i * self.ny + j1]:
+                found.update(cell)
+        return sorted(found)
+
+
 # =============================================================================
 # Path: a list of joint segments
 # Closed path?
@@ -1142,19 +1255,30 @@ class Path(list):
     # If N is odd the point is inside
     # if N is even the point is outside
     # WARNING: the path must be closed otherwise it is meaningless
+    # @param grid SegmentGrid of the path, to test only the segments along
+    #        the line when testing many points
     # ----------------------------------------------------------------------
-    def isInside(self, P):
-        maxx = self.bbox()[2]
+    def isInside(self, P, grid=None):
+        maxx = self.bbox()[2] if grid is None else grid.maxx
         # FIXME: this is strange. adding +1000 to line endpoint changes the
         #        outcome of method i've found that doing this works around some
         #        unknown problem in most cases, but it's not really ideal
         #        solution
         line = Segment(Segment.LINE, P, Vector(maxx * 1.1, P[1] + 1000))
+        if grid is None:
+            candidates = range(len(self))
+        else:
+            candidates = grid.queryLine(line.A, line.B)
         count = 0
         PP1 = None  # previous points to avoid double counting
         PP2 = None
-        for segment in self:
-            P1, P2 = line.intersect(segment)
+        prev = None
+        for i in candidates:
+            if prev != i - 1:
+                # the skipped segments cannot intersect the line
+                PP1 = PP2 = None
+            prev = i
+            P1, P2 = line.intersect(self[i])
             if P1 is not None:
                 if PP1 is None and PP2 is None:
                     count += 1
@@ -1359,12 +1483,15 @@ class Path(list):
             points.append((i, oi, P))
 
         # Find all intersection points
+        grid = SegmentGrid(self)
         for i, si in enumerate(self[:-2]):
             if si.type == Segment.LINE and self[i + 1].type == Segment.LINE:
-                j = i + 2
+                first = i + 2
             else:
-                j = i + 1
-            while j < len(self):
+                first = i + 1
+            for j in grid.candidates(si):
+                if j < first:
+                    continue
                 P1, P2 = si.intersect(self[j])
                 # skip doublet solution
                 if P1 is not None and P2 is not None and eq(P1, P2, EPS):
@@ -1375,7 +1502,6 @@ class Path(list):
                 if P2:
                     addPoint(i, P2)
                     addPoint(j, P2)
-                j += 1
 
         # sort according to index, and position of point
         points.sort(key=itemgetter(0, 1))
@@ -1392,8 +1518,9 @@ class Path(list):
     # mark all segments of intersected path that lay inside another path
     # ----------------------------------------------------------------------
     def markInside(self, path, setinside):
+        grid = SegmentGrid(path)
         for i, si in enumerate(self):
-            if path.isInside(si.midPoint()):
+            if path.isInside(si.midPoint(), grid):
                 si._inside.append(setinside)
 
     # ----------------------------------------------------------------------
@@ -1412,9 +1539,10 @@ class Path(list):
             points.append((i, oi, P))
 
         # Find all intersection points
+        grid = SegmentGrid(path)
         for i, si in enumerate(self):
-            for cut in path:
-                P1, P2 = si.intersect(cut)
+            for j in grid.candidates(si):
+                P1, P2 = si.intersect(path[j])
                 # skip doublet solution
                 if P1 is not None and P2 is not None and eq(P1, P2, EPS):
                     P2 = None
@@ -1449,25 +1577,19 @@ class Path(list):
     # ----------------------------------------------------------------------
     def removeExcluded(self, path, offset):
         chkofs = abs(offset) * (1.0 - EPS)
+        grid = SegmentGrid(path)
 
         # --------------------------------------------------------------
         # Search if point P is closer than chkofs or not
         # --------------------------------------------------------------
-        def isClose(P, last):
-            # search in the close vicinity first
-            i0 = last - min(10, len(path))
-            if i0 < 0:
-                i0 += len(path)
-            for i in range(i0, len(path)):
-                if path[i].distance(P) < chkofs:
-                    return False, i
-            for i in range(i0):
+        def isClose(P):
+            for i in grid.query(P[0] - chkofs, P[1] - chkofs,
+                                P[0] + chkofs, P[1] + chkofs):
                 if path[i].distance(P) < chkofs:
-                    return False, i
-            return True, last
+                    return False
+            return True
 
-        last = 0
-        include, last = isClose(self[0].midPoint(), last)
+        include = isClose(self[0].midPoint())
         i = 0
         while i < len(self):
             cross = self[i]._cross
@@ -1480,7 +1602,7 @@ class Path(list):
                 #    check if really it crosses the segment
                 #    or it goes back (only touching)
                 # Check middle of next path
-                include, last = isClose(self[i % len(self)].midPoint(), last)
+                include = isClose(self[i % len(self)].midPoint())
 
     # ----------------------------------------------------------------------
     # Perform overcut movements on corners, moving at half angle by
@@ -1998,3 +2120,441 @@ class Path(list):
                         except Exception:
                             self.append(Segment(Segment.LINE, A, B))
                     A = B
+
+
+# =============================================================================
+# Read only view of a segment of a CompactPath with the attributes of a
+# Segment, the rest is delegated to an equivalent Segment
+# =============================================================================
+class SegmentView:
+    __slots__ = ("path", "index")
+
+    def __init__(self, path, index):
+        self.path = path
+        self.index = index
+
+    # ----------------------------------------------------------------------
+    @property
+    def type(self):
+        return self.path.type[self.index]
+
+    @property
+    def A(self):
+        return Vector(self.path.ax[self.index], self.path.ay[self.index])
+
+    @property
+    def B(self):
+        return Vector(self.path.bx[self.index], self.path.by[self.index])
+
+    @property
+    def C(self):
+        return Vector(self.path.cx[self.index], self.path.cy[self.index])
+
+    @property
+    def AB(self):
+        return self.B - self.A
+
+    @property
+    def radius(self):
+        return self.path.radius[self.index]
+
+    @property
+    def startPhi(self):
+        return self.path.startPhi[self.index]
+
+    @property
+    def endPhi(self):
+        return self.path.endPhi[self.index]
+
+    @property
+    def _inside(self):
+        return self.path._inside.get(self.index, ())
+
+    @property
+    def _cross(self):
+        return False
+
+    # ----------------------------------------------------------------------
+    def length(self):
+        return self.path.segmentLength(self.index)
+
+    # ----------------------------------------------------------------------
+    # @return a new Segment with the same geometry
+    # ----------------------------------------------------------------------
+    def segment(self):
+        if self.type == Segment.LINE:
+            segment = Segment(Segment.LINE, self.A, self.B)
+        else:
+            segment = Segment(self.type, self.A, self.B, self.C)
+        segment._inside = list(self._inside)
+        return segment
+
+    # ----------------------------------------------------------------------
+    def __getattr__(self, name):
+        if name in SegmentView.__slots__:
+            raise AttributeError(name)
+        return getattr(self.segment(), name)
+
+    # ----------------------------------------------------------------------
+    def __repr__(self):
+        return repr(self.segment())
+
+
+# =============================================================================
+# Path stored as typed arrays, one entry per segment, for the paths of
+# millions of segments (meshes, image traces). The segments are accessed
+# through SegmentView; toPath() converts it to a Path to modify it
+# =============================================================================
+class CompactPath:
+    _FIELDS = (
+        "ax", "ay", "bx", "by", "cx", "cy", "radius", "startPhi", "endPhi"
+    )
+
+    def __init__(self, name, color=None):
+        self.name = name
+        self.color = color
+        self.type = array("b")
+        for field in CompactPath._FIELDS:
+            setattr(self, field, array("d"))
+        self._inside = {}  # segment index: islands, only when not empty
+        self._length = None
+
+    # ----------------------------------------------------------------------
+    @classmethod
+    def fromPath(cls, path):
+        compact = cls(path.name, path.color)
+        compact.extend(path)
+        return compact
+
+    # ----------------------------------------------------------------------
+    # Polyline through the (x,y,...) points, filling the arrays directly
+    # without creating the Segments. Repeated points are skipped
+    # ----------------------------------------------------------------------
+    @classmethod
+    def fromPoints(cls, name, points, closed=False, color=None):
+        compact = cls(name, color)
+        xs = []
+        ys = []
+        for P in points:
+            x = float(P[0])
+            y = float(P[1])
+            if xs and abs(x - xs[-1]) <= EPS and abs(y - ys[-1]) <= EPS:
+                continue
+            xs.append(x)
+            ys.append(y)
+        if closed and len(xs) > 2 and (
+                abs(xs[0] - xs[-1]) > EPS or abs(ys[0] - ys[-1]) > EPS):
+            xs.append(xs[0])
+            ys.append(ys[0])
+        n = len(xs) - 1
+        if n <= 0:
+            return compact
+        compact.type.frombytes(bytes([Segment.LINE]) * n)
+        compact.ax.fromlist(xs[:-1])
+        compact.ay.fromlist(ys[:-1])
+        compact.bx.fromlist(xs[1:])
+        compact.by.fromlist(ys[1:])
+        zeros = bytes(compact.cx.itemsize * n)
+        for field in ("cx", "cy", "radius", "startPhi", "endPhi"):
+            getattr(compact, field).frombytes(zeros)
+        return compact
+
+    # ----------------------------------------------------------------------
+    def toPath(self):
+        path = Path(self.name, self.color)
+        path.extend(view.segment() for view in self)
+        return path
+
+    # ----------------------------------------------------------------------
+    def __repr__(self):
+        return "{}:\n\t{}".format(
+            self.name,
+            "\n\t".join([f"{int(i):3d}: {x}" for i, x in enumerate(self)]),
+        )
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        return len(self.type)
+
+    # ----------------------------------------------------------------------
+    def __iter__(self):
+        for i in range(len(self.type)):
+            yield SegmentView(self, i)
+
+    # ----------------------------------------------------------------------
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [SegmentView(self, i)
+                    for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("segment index out of range")
+        return SegmentView(self, index)
+
+    # ----------------------------------------------------------------------
+    def append(self, segment):
+        self._length = None
+        self.type.append(segment.type)
+        A = segment.A
+        B = segment.B
+        self.ax.append(A[0])
+        self.ay.append(A[1])
+        self.bx.append(B[0])
+        self.by.append(B[1])
+        if segment.type == Segment.LINE:
+            for field in ("cx", "cy", "radius", "startPhi", "endPhi"):
+                getattr(self, field).append(0.0)
+        else:
+            C = segment.C
+            self.cx.append(C[0])
+            self.cy.append(C[1])
+            self.radius.append(segment.radius)
+            self.startPhi.append(segment.startPhi)
+            self.endPhi.append(segment.endPhi)
+        if segment._inside:
+            self._inside[len(self.type) - 1] = list(segment._inside)
+
+    # ----------------------------------------------------------------------
+    def extend(self, segments):
+        for segment in segments:
+            self.append(segment)
+
+    # ----------------------------------------------------------------------
+    # @return numpy views of the arrays, without copying them
+    # ----------------------------------------------------------------------
+    def _numpy(self):
+        arrays = {"type": numpy.frombuffer(self.type, numpy.int8)}
+        for field in CompactPath._FIELDS:
+            arrays[field] = numpy.frombuffer(getattr(self, field), float)
+        return arrays
+
+    # ----------------------------------------------------------------------
+    # @return the angle swept by the arcs (0 for lines)
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _sweep(a):
+        phi = numpy.where(
+            a["type"] == Segment.CW,
+            a["startPhi"] - a["endPhi"],
+            a["endPhi"] - a["startPhi"],
+        )
+        phi[phi < 0.0] += PI2
+        phi[a["type"] == Segment.LINE] = 0.0
+        return phi
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _lengths(a):
+        return numpy.where(
+            a["type"] == Segment.LINE,
+            numpy.hypot(a["bx"] - a["ax"], a["by"] - a["ay"]),
+            a["radius"] * CompactPath._sweep(a),
+        )
+
+    # ----------------------------------------------------------------------
+    def segmentLength(self, i):
+        if self.type[i] == Segment.LINE:
+            return sqrt((self.bx[i] - self.ax[i]) ** 2
+                        + (self.by[i] - self.ay[i]) ** 2)
+        elif self.type[i] == Segment.CW:
+            phi = self.startPhi[i] - self.endPhi[i]
+        else:
+            phi = self.endPhi[i] - self.startPhi[i]
+        if phi < 0.0:
+            phi += PI2
+        return self.radius[i] * phi
+
+    # ----------------------------------------------------------------------
+    # @return total length of path
+    # ----------------------------------------------------------------------
+    def length(self):
+        if self._length is None:
+            if numpy is not None:
+                self._length = float(self._lengths(self._numpy()).sum())
+            else:
+                self._length = sum(
+                    self.segmentLength(i) for i in range(len(self)))
+        return self._length
+
+    # ----------------------------------------------------------------------
+    # Bounding box of all the segments, same as Segment.calcBBox
+    # ----------------------------------------------------------------------
+    def calcBBox(self):
+        if not self:
+            self.minx = self.miny = 1e10
+            self.maxx = self.maxy = -1e10
+            return
+        if numpy is None:
+            segments = [view.segment() for view in self]
+            self.minx = min(s.minx for s in segments)
+            self.miny = min(s.miny for s in segments)
+            self.maxx = max(s.maxx for s in segments)
+            self.maxy = max(s.maxy for s in segments)
+            return
+
+        a = self._numpy()
+        minx = numpy.minimum(a["ax"], a["bx"])
+        maxx = numpy.maximum(a["ax"], a["bx"])
+        miny = numpy.minimum(a["ay"], a["by"])
+        maxy = numpy.maximum(a["ay"], a["by"])
+
+        # axis extremes swept by the arcs
+        arc = a["type"] != Segment.LINE
+        cw = a["type"] == Segment.CW
+        lo = numpy.where(cw, a["endPhi"], a["startPhi"])
+        hi = numpy.where(cw, a["startPhi"], a["endPhi"])
+        r = a["radius"]
+        for k, extreme in enumerate(
+            (
+                (maxx, numpy.maximum, a["cx"] + r),
+                (maxy, numpy.maximum, a["cy"] + r),
+                (minx, numpy.minimum, a["cx"] - r),
+                (miny, numpy.minimum, a["cy"] - r),
+            )
+        ):
+            bound, func, value = extreme
+            # first angle k*pi/2 + 2*pi*m after lo
+            phi = k * PI_2 + PI2 * numpy.ceil((lo - k * PI_2) / PI2)
+            swept = arc & (phi <= hi)
+            func(bound, numpy.where(swept, value, bound), out=bound)
+
+        self.minx = float(minx.min()) - EPSV
+        self.maxx = float(maxx.max()) + EPSV
+        self.miny = float(miny.min()) - EPSV
+        self.maxy = float(maxy.max()) + EPSV
+
+    # ----------------------------------------------------------------------
+    def bbox(self):
+        self.calcBBox()
+        return self.minx, self.miny, self.maxx, self.maxy
+
+    # ----------------------------------------------------------------------
+    # @return true if path is closed
+    # ----------------------------------------------------------------------
+    def isClosed(self):
+        return bool(self) and eq(self[0].A, self[-1].B)
+
+    # ----------------------------------------------------------------------
+    # @return -1 CCW, 0 open, +1 CW closed path, same as Path.direction()
+    # ----------------------------------------------------------------------
+    def direction(self):
+        if not self.isClosed():
+            return 0
+        return self._direction()
+
+    # ----------------------------------------------------------------------
+    def _direction(self):
+        if numpy is not None:
+            a = self._numpy()
+            sum_ = float(
+                ((a["bx"] - a["ax"]) * (a["by"] + a["ay"])).sum())
+            lengths = self._lengths(a)
+            cwarc = float(
+                lengths[a["type"] == Segment.CW].sum()
+                - lengths[a["type"] == Segment.CCW].sum()
+            )
+        else:
+            sum_ = 0.0
+            cwarc = 0.0
+            for i in range(len(self)):
+                sum_ += (self.bx[i] - self.ax[i]) * (self.by[i] + self.ay[i])
+                if self.type[i] == Segment.CW:
+                    cwarc += self.segmentLength(i)
+                elif self.type[i] == Segment.CCW:
+                    cwarc -= self.segmentLength(i)
+
+        if sum_ < 0:
+            return -1  # CCW
+        if sum_ > 0:
+            return 1  # CW
+        # Arcs only, decide from the length of the CW and CCW arcs
+        if cwarc < 0:
+            return -1
+        if cwarc > 0:
+            return 1
+        return 0
+
+    # ----------------------------------------------------------------------
+    # Return linearized path (arcs are subdivided to lines),
+    # same as Path.linearize()
+    # ----------------------------------------------------------------------
+    def linearize(self, maxseg=1, splitlines=False):
+        linearized = CompactPath(self.name, self.color)
+        if numpy is None:
+            for view in self:
+                linearized.extend(
+                    view.segment().linearize(maxseg, splitlines))
+            return linearized
+
+        a = self._numpy()
+        line = a["type"] == Segment.LINE
+        lengths = self._lengths(a)
+        split = ~line if not splitlines else numpy.ones(len(self), bool)
+        count = numpy.where(
+            split, numpy.maximum(numpy.ceil(lengths / maxseg), 1), 1
+        ).astype(numpy.int64)
+
+        # segment and number of the sub-segment of every new line
+        sweep = self._sweep(a)
+        seg = numpy.repeat(numpy.arange(len(self)), count)
+        sub = numpy.arange(len(seg)) - numpy.repeat(
+            numpy.cumsum(count) - count, count)
+        n = count[seg]
+
+        def point(t):
+            # lines: A + AB*t, arcs: rotate by the swept angle
+            ax = a["ax"][seg]
+            ay = a["ay"][seg]
+            x = ax + (a["bx"][seg] - ax) * t
+            y = ay + (a["by"][seg] - ay) * t
+            sign = numpy.where(a["type"][seg] == Segment.CW, -1.0, 1.0)
+            phi = a["startPhi"][seg] + sign * sweep[seg] * t
+            r = a["radius"][seg]
+            arc = ~line[seg] & (r != 0.0)
+            x = numpy.where(arc, a["cx"][seg] + r * numpy.cos(phi), x)
+            y = numpy.where(arc, a["cy"][seg] + r * numpy.sin(phi), y)
+            # arcs of zero radius end on B
+            zero = ~line[seg] & (r == 0.0)
+            x = numpy.where(zero, a["bx"][seg], x)
+            y = numpy.where(zero, a["by"][seg], y)
+            return x, y
+
+        ax, ay = point(sub / n)
+        bx, by = point((sub + 1) / n)
+        # unsplit lines keep their end points
+        keep = ~split[seg]
+        bx = numpy.where(keep, a["bx"][seg], bx)
+        by = numpy.where(keep, a["by"][seg], by)
+
+        linearized.type.frombytes(
+            numpy.full(len(seg), Segment.LINE, numpy.int8).tobytes())
+        zeros = numpy.zeros(len(seg)).tobytes()
+        for field, values in (
+            ("ax", ax), ("ay", ay), ("bx", bx), ("by", by),
+            ("cx", None), ("cy", None), ("radius", None),
+            ("startPhi", None), ("endPhi", None),
+        ):
+            getattr(linearized, field).frombytes(
+                zeros if values is None else values.tobytes())
+        if self._inside:
+            for i in numpy.flatnonzero(keep).tolist():
+                inside = self._inside.get(int(seg[i]))
+                if inside:
+                    linearized._inside[i] = list(inside)
+        return linearized
+
+
+# -----------------------------------------------------------------------------
+# One pocket ring: offset the closed path and clean it up to the contours
+# left. A module function so it can run in a process pool
+# @return list of contours or None if nothing is left
+# -----------------------------------------------------------------------------
+def offsetContours(path, offset):
+    opath = path.offset(offset)
+    if not opath:
+        return None
+    opath.intersectSelf()
+    opath.removeExcluded(path, offset)
+    opath.removeZeroLength(abs(offset) / 100.0)
+    return opath.split2contours()
@@ -0,0 +1,656 @@
+#
+# Polygon offsetting on integer coordinates, in the manner of Clipper
+#
+# The closed paths are flattened to polygons, oriented by their nesting
+# (outer contours CCW, islands CW) and every polygon is offset edge by edge
+# with round joins. The raw offset polygons overlap and loop on themselves;
+# they are merged with a union on the positive winding number: the edges
+# are split at their intersections, an edge is kept when it separates a
+# covered (winding > 0) from an uncovered area, and the kept edges are
+# linked into contours. The coordinates are scaled to integers so that the
+# union is computed exactly.
+#
+# The contours returned have the covered area on their left: outer contours
+# are CCW and the contours of the islands CW.
+
+from math import acos, atan2, ceil, cos, pi, sin, sqrt
+
+from bmath import Vector
+from bpath import Path, Segment
+
+SCALE = 100000  # integer units per drawing unit
+TOLERANCE = 0.01  # maximum chord error of the flattened arcs
+ARCFIT_SEGMENTS = 4  # minimum lines of an arc to fit it back
+SNAP_PASSES = 8  # maximum passes splitting the edges at the intersections
+
+
+# -----------------------------------------------------------------------------
+# Offset the closed paths as one area, islands included
+# @param paths    closed paths, nested paths are islands
+# @param delta    offset, positive grows the area and negative shrinks it
+# @param tolerance maximum deviation of the arcs flattened to lines
+# @param arcs     fit arcs back on the result
+# @return list of closed paths, outer contours CCW and islands CW
+# -----------------------------------------------------------------------------
+def offset(paths, delta, tolerance=TOLERANCE, arcs=True, name=None,
+           color=None):
+    result = rings(paths, delta, 0.0, 1, tolerance, arcs, name, color)
+    return result[0] if result else []
+
+
+# -----------------------------------------------------------------------------
+# Offset the closed paths repeatedly, e.g. the passes of a pocket. The
+# first ring is offset by first and every next ring by step more. The rings
+# are all offset from the paths, so that the arcs grown keep the tolerance
+# @param count    maximum number of rings, None until the area vanishes
+# @return list of rings, every ring a list of closed paths as offset()
+# -----------------------------------------------------------------------------
+def rings(paths, first, step, count=None, tolerance=TOLERANCE, arcs=True,
+          name=None, color=None):
+    polys = orient([flatten(path, tolerance) for path in paths])
+    if name is None and paths:
+        name = paths[0].name
+    if color is None and paths:
+        color = paths[0].color
+
+    result = []
+    while polys and (count is None or len(result) < count):
+        delta = first + len(result) * step
+        raw = []
+        for poly in polys:
+            if delta:
+                poly = rawOffset(poly, delta, tolerance)
+            raw.append([(round(x * SCALE), round(y * SCALE))
+                        for x, y in poly])
+        loops = union(raw)
+        if not loops:
+            break
+        result.append([_path(loop, tolerance, arcs, name, color)
+                       for loop in loops])
+        if not step:
+            break
+    return result
+
+
+# -----------------------------------------------------------------------------
+# Closed path of the loop, with the runs of lines lying on a circle fitted
+# back to arcs
+# -----------------------------------------------------------------------------
+def _path(loop, tolerance, arcs, name, color):
+    points = [Vector(x / SCALE, y / SCALE) for x, y in loop]
+    points.append(points[0])
+    n = len(points) - 1
+    turns = _turns(points) if arcs else None
+    path = Path(name, color)
+    i = 0
+    while i < n:
+        fit = _arc(points, turns, i, tolerance) if arcs else None
+        if fit is None:
+            path.append(Segment(Segment.LINE, points[i], points[i + 1]))
+            i += 1
+        else:
+            j, C, kind = fit
+            path.append(Segment(kind, points[i], points[j], C))
+            i = j
+    return path
+
+
+# -----------------------------------------------------------------------------
+# Running sums of the turns at the points: the angle turned and the number
+# of left and right turns up to every point
+# -----------------------------------------------------------------------------
+def _turns(points):
+    angle = [0.0]
+    left = [0]
+    right = [0]
+    for k in range(1, len(points) - 1):
+        ax = points[k][0] - points[k - 1][0]
+        ay = points[k][1] - points[k - 1][1]
+        bx = points[k + 1][0] - points[k][0]
+        by = points[k + 1][1] - points[k][1]
+        turn = atan2(ax * by - ay * bx, ax * bx + ay * by)
+        angle.append(angle[-1] + turn)
+        left.append(left[-1] + (turn > 0.0))
+        right.append(right[-1] + (turn < 0.0))
+    return angle, left, right
+
+
+# -----------------------------------------------------------------------------
+# Longest arc starting at point i, found by doubling its length and then
+# bisecting, as every test costs the length of the arc
+# @return (j, center, type) of the arc to point j or None
+# -----------------------------------------------------------------------------
+def _arc(points, turns, i, tolerance):
+    n = len(points) - 1
+    good = i + ARCFIT_SEGMENTS
+    if good > n:
+        return None
+    C = _circle(points, turns, i, good, tolerance)
+    if C is None:
+        return None
+    bad = None
+    step = ARCFIT_SEGMENTS
+    while bad is None and good < n:
+        step *= 2
+        j = min(good + step, n)
+        D = _circle(points, turns, i, j, tolerance)
+        if D is None:
+            bad = j
+        else:
+            good, C = j, D
+    while bad is not None and bad - good > 1:
+        j = (good + bad) // 2
+        D = _circle(points, turns, i, j, tolerance)
+        if D is None:
+            bad = j
+        else:
+            good, C = j, D
+    left = turns[1][good - 1] > turns[1][i]
+    return good, C, Segment.CCW if left else Segment.CW
+
+
+# -----------------------------------------------------------------------------
+# @return the center of the circle through the points i to j, turning all
+# on the same side by less than a quarter turn, or None
+# -----------------------------------------------------------------------------
+def _circle(points, turns, i, j, tolerance):
+    angle, left, right = turns
+    inner = j - 1 - i
+    if left[j - 1] - left[i] != inner and right[j - 1] - right[i] != inner:
+        return None
+    if abs(angle[j - 1] - angle[i]) >= pi / 2.0:
+        return None
+
+    # circle through the first, middle and last points
+    ax, ay = points[i]
+    bx, by = points[(i + j) // 2]
+    cx, cy = points[j]
+    bx -= ax
+    by -= ay
+    cx -= ax
+    cy -= ay
+    d = 2.0 * (bx * cy - by * cx)
+    if abs(d) < 1e-12:
+        return None
+    b2 = bx * bx + by * by
+    c2 = cx * cx + cy * cy
+    ox = (cy * b2 - by * c2) / d
+    oy = (bx * c2 - cx * b2) / d
+    r = sqrt(ox * ox + oy * oy)
+    ox += ax
+    oy += ay
+
+    # the points and the middle of the lines within the tolerance
+    prec = min(tolerance, r / 4.0)
+    x0, y0 = points[i]
+    for k in range(i + 1, j + 1):
+        x1, y1 = points[k]
+        if abs(sqrt((x1 - ox) ** 2 + (y1 - oy) ** 2) - r) > prec:
+            return None
+        mx = (x0 + x1) / 2.0 - ox
+        my = (y0 + y1) / 2.0 - oy
+        if abs(sqrt(mx * mx + my * my) - r) > prec:
+            return None
+        x0, y0 = x1, y1
+    return Vector(ox, oy)
+
+
+# -----------------------------------------------------------------------------
+# @return the points of the closed path with the arcs flattened to lines
+# -----------------------------------------------------------------------------
+def flatten(path, tolerance=TOLERANCE):
+    points = []
+    for segment in path:
+        if segment.type == Segment.LINE:
+            points.append((segment.A[0], segment.A[1]))
+            continue
+        # chord with a sagitta of tolerance
+        r = segment.radius
+        maxseg = 2.0 * sqrt(max(2.0 * r * tolerance - tolerance**2, 1e-12))
+        for line in segment.linearize(maxseg):
+            points.append((line.A[0], line.A[1]))
+
+    # remove the repeated points
+    clean = []
+    for P in points:
+        if not clean or abs(P[0] - clean[-1][0]) + abs(P[1] - clean[-1][1]) \
+                > 1.0 / SCALE:
+            clean.append(P)
+    while len(clean) > 1 and abs(clean[0][0] - clean[-1][0]) \
+            + abs(clean[0][1] - clean[-1][1]) <= 1.0 / SCALE:
+        del clean[-1]
+    return clean
+
+
+# -----------------------------------------------------------------------------
+def area(poly):
+    s = 0.0
+    x0, y0 = poly[-1]
+    for x1, y1 in poly:
+        s += x0 * y1 - x1 * y0
+        x0, y0 = x1, y1
+    return s / 2.0
+
+
+# -----------------------------------------------------------------------------
+# Even-odd point in polygon
+# -----------------------------------------------------------------------------
+def inside(P, poly):
+    x, y = P
+    result = False
+    x0, y0 = poly[-1]
+    for x1, y1 in poly:
+        if (y0 > y) != (y1 > y):
+            if x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+                result = not result
+        x0, y0 = x1, y1
+    return result
+
+
+# -----------------------------------------------------------------------------
+# Orient the polygons from their nesting: the polygons inside an even
+# number of others are outer contours turned CCW, the rest are islands
+# turned CW. Degenerated polygons are dropped
+# -----------------------------------------------------------------------------
+def orient(polys):
+    polys = [p for p in polys if len(p) >= 3 and area(p) != 0.0]
+    boxes = [
+        (min(x for x, y in p), min(y for x, y in p),
+         max(x for x, y in p), max(y for x, y in p))
+        for p in polys
+    ]
+    result = []
+    for i, poly in enumerate(polys):
+        P = poly[0]
+        depth = 0
+        for j, other in enumerate(polys):
+            if i == j:
+                continue
+            minx, miny, maxx, maxy = boxes[j]
+            if minx <= P[0] <= maxx and miny <= P[1] <= maxy \
+                    and inside(P, other):
+                depth += 1
+        if (area(poly) > 0.0) != (depth % 2 == 0):
+            poly = poly[::-1]
+        result.append(poly)
+    return result
+
+
+# -----------------------------------------------------------------------------
+# Offset every edge of the polygon to its right by delta. The corners where
+# the offset edges diverge are joined with an arc around the vertex. Where
+# they overlap they are cut at their crossing when it lies within half of
+# both edges, otherwise joined through the vertex so the loops formed have
+# a winding number that the union removes
+# -----------------------------------------------------------------------------
+def rawOffset(poly, delta, tolerance=TOLERANCE):
+    if tolerance < abs(delta):
+        step = 2.0 * acos(1.0 - tolerance / abs(delta))
+    else:
+        step = pi / 2.0
+
+    # right normal and length of every edge
+    normals = []
+    lengths = []
+    n = len(poly)
+    for i in range(n):
+        x0, y0 = poly[i]
+        x1, y1 = poly[(i + 1) % n]
+        length = sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2)
+        normals.append(((y1 - y0) / length, (x0 - x1) / length))
+        lengths.append(length)
+
+    result = []
+    for i in range(n):
+        x, y = poly[i]
+        n1x, n1y = normals[i - 1]
+        n2x, n2y = normals[i]
+        cross = n1x * n2y - n1y * n2x
+        dot = n1x * n2x + n1y * n2y
+        if abs(cross) < 1e-12 and dot > 0.0:
+            result.append((x + delta * n2x, y + delta * n2y))
+        elif cross * delta < 0.0 and dot > 0.0 \
+                and abs(delta * cross) <= (1.0 + dot) * 0.5 * min(
+                    lengths[i - 1], lengths[i]):
+            # overlapping edges crossing within their halves, the loop
+            # through the vertex would be removed by the union
+            k = delta / (1.0 + dot)
+            result.append((x + k * (n1x + n2x), y + k * (n1y + n2y)))
+        elif cross * delta > 0.0 or (abs(cross) < 1e-12 and delta > 0.0):
+            # diverging edges, round join
+            angle = atan2(cross, dot)
+            if abs(cross) < 1e-12:
+                angle = pi
+            steps = int(ceil(abs(angle) / step))
+            if steps <= 1:
+                # miter point, within the tolerance for such an angle
+                k = delta / (1.0 + dot)
+                result.append((x + k * (n1x + n2x), y + k * (n1y + n2y)))
+                continue
+            for k in range(steps + 1):
+                phi = angle * k / steps
+                c = cos(phi)
+                s = sin(phi)
+                result.append((
+                    x + delta * (n1x * c - n1y * s),
+                    y + delta * (n1x * s + n1y * c),
+                ))
+        else:
+            result.append((x + delta * n1x, y + delta * n1y))
+            result.append((x, y))
+            result.append((x + delta * n2x, y + delta * n2y))
+    return result
+
+
+# -----------------------------------------------------------------------------
+# Integer division rounded to the nearest
+# -----------------------------------------------------------------------------
+def _div(num, den):
+    if den < 0:
+        num = -num
+        den = -den
+    return (2 * num + den) // (2 * den)
+
+
+# -----------------------------------------------------------------------------
+# Uniform grid of the edge bounding boxes
+# -----------------------------------------------------------------------------
+def _grid(edges):
+    minx = min(min(e[0], e[2]) for e in edges)
+    miny = min(min(e[1], e[3]) for e in edges)
+    maxx = max(max(e[0], e[2]) for e in edges)
+    maxy = max(max(e[1], e[3]) for e in edges)
+    mean = sum(abs(e[2] - e[0]) + abs(e[3] - e[1]) for e in edges) \
+        // len(edges)
+    size = max(mean, int(sqrt((maxx - minx) * (maxy - miny) / len(edges))),
+               (maxx - minx + maxy - miny) // len(edges), 1)
+    cells = {}
+    for i, (x0, y0, x1, y1) in enumerate(edges):
+        for cx in range((min(x0, x1) - minx) // size,
+                        (max(x0, x1) - minx) // size + 1):
+            for cy in range((min(y0, y1) - miny) // size,
+                            (max(y0, y1) - miny) // size + 1):
+                cell = cells.get((cx, cy))
+                if cell is None:
+                    cells[(cx, cy)] = [i]
+                else:
+                    cell.append(i)
+    return cells, minx, miny, size
+
+
+# -----------------------------------------------------------------------------
+# Split the edges at all their intersections
+# @return the split points of every edge
+# -----------------------------------------------------------------------------
+def _intersect(edges):
+    splits = [[] for _ in edges]
+    boxes = [
+        (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        for x0, y0, x1, y1 in edges
+    ]
+    cells, minx, miny, size = _grid(edges)
+    for (cx, cy), cell in cells.items():
+        for a in range(len(cell)):
+            i = cell[a]
+            ax0, ay0, ax1, ay1 = edges[i]
+            aminx, aminy, amaxx, amaxy = boxes[i]
+            for b in range(a + 1, len(cell)):
+                j = cell[b]
+                bminx, bminy, bmaxx, bmaxy = boxes[j]
+
+                # test every pair once, in the first cell of their overlap
+                ox = aminx if aminx > bminx else bminx
+                if ox > (amaxx if amaxx < bmaxx else bmaxx):
+                    continue
+                oy = aminy if aminy > bminy else bminy
+                if oy > (amaxy if amaxy < bmaxy else bmaxy):
+                    continue
+                if (ox - minx) // size != cx or (oy - miny) // size != cy:
+                    continue
+
+                bx0, by0, bx1, by1 = edges[j]
+                rx = ax1 - ax0
+                ry = ay1 - ay0
+                sx = bx1 - bx0
+                sy = by1 - by0
+                qx = bx0 - ax0
+                qy = by0 - ay0
+                den = rx * sy - ry * sx
+                if den == 0:
+                    if qx * ry - qy * rx != 0:
+                        continue  # parallel
+                    # collinear, split each on the end points of the other
+                    for P, edge, split in (
+                        ((bx0, by0), edges[i], splits[i]),
+                        ((bx1, by1), edges[i], splits[i]),
+                        ((ax0, ay0), edges[j], splits[j]),
+                        ((ax1, ay1), edges[j], splits[j]),
+                    ):
+                        if _between(P, edge):
+                            split.append(P)
+                    continue
+
+                if (ax1 == bx0 and ay1 == by0) or (ax0 == bx1 and ay0 == by1):
+                    continue  # consecutive, crossing only at their vertex
+                t = qx * sy - qy * sx
+                u = qx * ry - qy * rx
+                if den < 0:
+                    den = -den
+                    t = -t
+                    u = -u
+                if t < 0 or t > den or u < 0 or u > den:
+                    continue
+                P = (ax0 + _div(rx * t, den), ay0 + _div(ry * t, den))
+                splits[i].append(P)
+                splits[j].append(P)
+    return splits
+
+
+# -----------------------------------------------------------------------------
+def _between(P, edge):
+    x0, y0, x1, y1 = edge
+    return (min(x0, x1) <= P[0] <= max(x0, x1)
+            and min(y0, y1) <= P[1] <= max(y0, y1))
+
+
+# -----------------------------------------------------------------------------
+# Winding numbers on the +x side of the edges, casting a ray towards +x
+# from their middle point. Coordinates are doubled to stay integer
+# -----------------------------------------------------------------------------
+def _winding(edges, queries):
+    if not queries:
+        return []
+    miny = min(min(y0, y1) for x0, y0, x1, y1, w in edges)
+    maxy = max(max(y0, y1) for x0, y0, x1, y1, w in edges)
+    height = max(1, (maxy - miny) // max(1, len(edges) // 4) + 1)
+    strips = {}
+    for edge in edges:
+        x0, y0, x1, y1, w = edge
+        if y0 == y1:
+            continue
+        if y0 > y1:
+            # upward, the sign of the winding is kept in w
+            x0, y0, x1, y1, w = x1, y1, x0, y0, -w
+        item = (2 * y0, 2 * y1, 2 * x0, x1 - x0, y1 - y0, w, edge)
+        for k in range((y0 - miny) // height, (y1 - miny) // height + 1):
+            strip = strips.get(k)
+            if strip is None:
+                strips[k] = [item]
+            else:
+                strip.append(item)
+
+    result = []
+    for mx, my, self_ in queries:
+        winding = 0
+        for lo, hi, x2, dx, dy, w, edge in strips.get(
+                (my // 2 - miny) // height, ()):
+            # x of the edge at my, compared to mx
+            if lo <= my < hi and x2 * dy + (my - lo) * dx > mx * dy \
+                    and edge is not self_:
+                winding += w
+        result.append(winding)
+    return result
+
+
+# -----------------------------------------------------------------------------
+# Union of integer polygons on the positive winding number
+# @return list of contours with the covered area on their left
+# -----------------------------------------------------------------------------
+def union(polys):
+    edges = []
+    for poly in polys:
+        for i in range(len(poly)):
+            x0, y0 = poly[i - 1]
+            x1, y1 = poly[i]
+            if x0 != x1 or y0 != y1:
+                edges.append((x0, y0, x1, y1))
+    if not edges:
+        return []
+
+    # split the edges at their intersections. Rounding the intersections
+    # to integers bends the edges a little, so split again the edges
+    # crossed by the bent ones until nothing changes
+    for _ in range(SNAP_PASSES):
+        split = []
+        changed = False
+        for edge, points in zip(edges, _intersect(edges)):
+            x0, y0, x1, y1 = edge
+            points = set(points)
+            points.discard((x0, y0))
+            points.discard((x1, y1))
+            if not points:
+                split.append(edge)
+                continue
+            changed = True
+            dx = x1 - x0
+            dy = y1 - y0
+            points = sorted(
+                points, key=lambda P: (P[0] - x0) * dx + (P[1] - y0) * dy)
+            for A, B in zip([(x0, y0)] + points, points + [(x1, y1)]):
+                if A != B:
+                    split.append((A[0], A[1], B[0], B[1]))
+        edges = split
+        if not changed:
+            break
+
+    # sum the overlapping edges
+    count = {}
+    for x0, y0, x1, y1 in edges:
+        A = (x0, y0)
+        B = (x1, y1)
+        if A < B:
+            count[(A, B)] = count.get((A, B), 0) + 1
+        else:
+            count[(B, A)] = count.get((B, A), 0) - 1
+    unique = [(A[0], A[1], B[0], B[1], w)
+              for (A, B), w in count.items() if w != 0]
+
+    # winding on both sides, the horizontal edges are tested on the
+    # coordinates rotated by -90 degrees
+    rotated = [(y0, -x0, y1, -x1, w) for x0, y0, x1, y1, w in unique]
+    queries = []
+    queriesRotated = []
+    for edge, redge in zip(unique, rotated):
+        x0, y0, x1, y1, w = edge
+        if y0 != y1:
+            queries.append((x0 + x1, y0 + y1, edge))
+        else:
+            queriesRotated.append((redge[0] + redge[2],
+                                   redge[1] + redge[3], redge))
+    windings = iter(_winding(unique, queries))
+    windingsRotated = iter(_winding(rotated, queriesRotated))
+
+    out = {}  # start point: end points of the boundary edges
+    for edge, redge in zip(unique, rotated):
+        x0, y0, x1, y1, w = edge
+        if y0 != y1:
+            upward = y0 < y1
+            side = next(windings)
+        else:
+            upward = redge[1] < redge[3]
+            side = next(windingsRotated)
+        # the +x side is on the right of an upward edge
+        if upward:
+            right = side
+            left = side + w
+        else:
+            left = side
+            right = side - w
+        if (left > 0) == (right > 0):
+            continue
+        A = (x0, y0)
+        B = (x1, y1)
+        if right > 0:
+            A, B = B, A
+        out.setdefault(A, []).append(B)
+
+    return [_simplify(loop) for loop in _link(out) if len(loop) >= 3]
+
+
+# -----------------------------------------------------------------------------
+# Link the boundary edges into closed contours, at the vertices shared by
+# more contours turning as much left as possible
+# -----------------------------------------------------------------------------
+def _link(out):
+    loops = []
+    while out:
+        start = next(iter(out))
+        loop = [start]
+        prev = None
+        P = start
+        while True:
+            ends = out.get(P)
+            if not ends:
+                loop = None  # open chain
+                break
+            if len(ends) == 1 or prev is None:
+                i = 0
+            else:
+                dx = P[0] - prev[0]
+                dy = P[1] - prev[1]
+                i = max(
+                    range(len(ends)),
+                    key=lambda k: _turn(dx, dy, ends[k][0] - P[0],
+                                        ends[k][1] - P[1]),
+                )
+            Q = ends.pop(i)
+            if not ends:
+                del out[P]
+            prev = P
+            P = Q
+            if P == start:
+                break
+            loop.append(P)
+        if loop:
+            loops.append(loop)
+    return loops
+
+
+# -----------------------------------------------------------------------------
+def _turn(dx, dy, ex, ey):
+    angle = atan2(dx * ey - dy * ex, dx * ex + dy * ey)
+    if angle <= -pi + 1e-12:
+        return -4.0  # going back on the same line
+    return angle
+
+
+# -----------------------------------------------------------------------------
+# Remove the vertices in the middle of straight lines
+# -----------------------------------------------------------------------------
+def _simplify(loop):
+    changed = True
+    while changed and len(loop) >= 3:
+        changed = False
+        result = []
+        n = len(loop)
+        for i in range(n):
+            ax, ay = result[-1] if result else loop[i - 1]
+            bx, by = loop[i]
+            cx, cy = loop[(i + 1) % n]
+            if (bx - ax) * (cy - by) - (by - ay) * (cx - bx) == 0 \
+                    and (bx - ax) * (cx - bx) + (by - ay) * (cy - by) >= 0:
+                changed = True
+                continue
+            result.append(loop[i])
+        loop = result
+    return loop
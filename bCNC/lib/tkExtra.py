@@ -664,6 +664,13 @@ class ProgressBar(Canvas):
         self.t0 = time.time()
         self.msg = ""
 
+    # ----------------------------------------------------------------------
+    # Change the upper limit keeping the progress and start time
+    # ----------------------------------------------------------------------
+    def setHigh(self, high):
+        self.high = float(high)
+        self.length = float(self.high - self.low)
+
     # ----------------------------------------------------------------------
     def setProgress(self, now, done=None, txt=None):
         self.now = now
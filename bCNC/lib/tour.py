@@ -0,0 +1,362 @@
+#
+# Order of the blocks minimizing the rapid motions
+#
+# Every block is a move from its start to its end point, the cost between
+# two blocks is the distance from the end of the first to the start of the
+# next one. The tour is seeded with a nearest neighbour search on a KD-tree
+# and then improved with 2-opt and Or-opt moves on the nearest neighbours
+# until nothing improves or the time is over. A 2-opt move reverses a run
+# of blocks, which is only possible when every block of the run can be
+# reversed: the closed blocks (start = end) and, when allowed, the open
+# ones. The first block stays in place.
+
+import time
+
+OPTIMIZE_TIME = 5.0  # s, maximum time of the improvement
+NEIGHBOURS = 8  # nearest blocks tried by the moves
+OROPT_CHAIN = 3  # maximum blocks moved by an Or-opt move
+EPS = 1e-9  # minimum gain of a move
+
+
+# =============================================================================
+# 2D KD-tree on a list of points supporting the removal of points
+# The tree is implicit: the nodes are the medians of the index ranges
+# =============================================================================
+class KDTree:
+    def __init__(self, points):
+        self.points = points
+        self.index = list(range(len(points)))
+        self.alive = [0] * len(points)  # alive points below every node
+        self.where = [0] * len(points)  # position of every point
+        self._build(0, len(points), 0)
+        for k, i in enumerate(self.index):
+            self.where[i] = k
+
+    # ----------------------------------------------------------------------
+    def _build(self, lo, hi, axis):
+        stack = [(lo, hi, axis)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if lo >= hi:
+                continue
+            points = self.points
+            self.index[lo:hi] = sorted(
+                self.index[lo:hi], key=lambda i: points[i][axis])
+            mid = (lo + hi) // 2
+            self.alive[mid] = hi - lo
+            stack.append((lo, mid, 1 - axis))
+            stack.append((mid + 1, hi, 1 - axis))
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        return self.alive[len(self.index) // 2] if self.index else 0
+
+    # ----------------------------------------------------------------------
+    # Remove point i from the searches, if not already removed
+    # ----------------------------------------------------------------------
+    def remove(self, i):
+        k = self.where[i]
+        if k < 0:
+            return
+        lo = 0
+        hi = len(self.index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            self.alive[mid] -= 1
+            if k == mid:
+                break
+            if k < mid:
+                hi = mid
+            else:
+                lo = mid + 1
+        self.where[i] = -1
+
+    # ----------------------------------------------------------------------
+    # @return the list of (squared distance, point) of the n nearest points
+    # not removed, sorted by distance
+    # ----------------------------------------------------------------------
+    def nearest(self, x, y, n=1):
+        best = []  # (d2, i) sorted
+        worst = float("inf")
+        points = self.points
+        index = self.index
+        alive = self.alive
+        where = self.where
+        stack = [(0, len(index), 0, 0.0)]
+        while stack:
+            lo, hi, axis, bound = stack.pop()
+            if lo >= hi or bound >= worst:
+                continue
+            mid = (lo + hi) // 2
+            if alive[mid] <= 0:
+                continue
+            i = index[mid]
+            px, py = points[i]
+            if where[i] >= 0:
+                d2 = (px - x) ** 2 + (py - y) ** 2
+                if d2 < worst:
+                    best.append((d2, i))
+                    best.sort()
+                    del best[n:]
+                    if len(best) == n:
+                        worst = best[-1][0]
+            diff = (x - px) if axis == 0 else (y - py)
+            near = (lo, mid, 1 - axis, bound)
+            far = (mid + 1, hi, 1 - axis, max(bound, diff * diff))
+            if diff > 0.0:
+                near, far = (mid + 1, hi, 1 - axis, bound), \
+                    (lo, mid, 1 - axis, max(bound, diff * diff))
+            stack.append(far)
+            stack.append(near)
+        return best
+
+
+# =============================================================================
+# Tour of the blocks
+# =============================================================================
+class Tour:
+    def __init__(self, starts, ends, reversible):
+        self.starts = starts
+        self.ends = ends
+        # blocks that can run backwards, the closed ones cost the same
+        self.free = [
+            rev or s == e for s, e, rev in zip(starts, ends, reversible)
+        ]
+        self.allFree = all(self.free)
+        self.order = []
+        self.flip = [False] * len(starts)
+        self.pos = [0] * len(starts)
+
+    # ----------------------------------------------------------------------
+    def start(self, b):
+        return self.ends[b] if self.flip[b] else self.starts[b]
+
+    def end(self, b):
+        return self.starts[b] if self.flip[b] else self.ends[b]
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def dist(A, B):
+        return ((A[0] - B[0]) ** 2 + (A[1] - B[1]) ** 2) ** 0.5
+
+    # ----------------------------------------------------------------------
+    # @return the length of the rapid motions of the tour
+    # ----------------------------------------------------------------------
+    def length(self):
+        return sum(
+            self.dist(self.end(a), self.start(b))
+            for a, b in zip(self.order, self.order[1:])
+        )
+
+    # ----------------------------------------------------------------------
+    # Greedy tour from the first block, going every time to the nearest
+    # end point of the blocks left
+    # ----------------------------------------------------------------------
+    def nearestNeighbour(self):
+        n = len(self.starts)
+        if n == 0:
+            return
+        # entry 2*b is the start of block b and 2*b+1 its end
+        points = []
+        for b in range(n):
+            points.append(self.starts[b])
+            points.append(self.ends[b])
+        tree = KDTree(points)
+        for b in range(n):
+            if not self.free[b] or self.starts[b] == self.ends[b]:
+                tree.remove(2 * b + 1)
+
+        b = 0
+        self.order = [0]
+        tree.remove(0)
+        tree.remove(1)
+        while len(tree):
+            x, y = self.end(b)
+            d2, i = tree.nearest(x, y)[0]
+            b = i // 2
+            self.flip[b] = bool(i & 1)
+            self.order.append(b)
+            tree.remove(2 * b)
+            tree.remove(2 * b + 1)
+        self._positions()
+
+    # ----------------------------------------------------------------------
+    def _positions(self, lo=0, hi=None):
+        order = self.order
+        pos = self.pos
+        for k in range(lo, len(order) if hi is None else hi):
+            pos[order[k]] = k
+
+    # ----------------------------------------------------------------------
+    # Nearest blocks of both end points of every block
+    # ----------------------------------------------------------------------
+    def _neighbours(self):
+        n = len(self.starts)
+        points = []
+        for b in range(n):
+            points.append(self.starts[b])
+            points.append(self.ends[b])
+        tree = KDTree(points)
+        neighbours = []
+        for P in points:
+            near = []
+            for d2, i in tree.nearest(P[0], P[1], 2 * NEIGHBOURS + 2):
+                if i // 2 not in near:
+                    near.append(i // 2)
+            neighbours.append(near[:NEIGHBOURS + 1])
+        return neighbours
+
+    # ----------------------------------------------------------------------
+    # @return true if all the blocks between positions lo and hi included
+    # can be reversed
+    # ----------------------------------------------------------------------
+    def _reversible(self, lo, hi):
+        if self.allFree:
+            return True
+        free = self.free
+        order = self.order
+        return all(free[order[k]] for k in range(lo, hi + 1))
+
+    # ----------------------------------------------------------------------
+    # Reverse the run of blocks between positions lo and hi included
+    # ----------------------------------------------------------------------
+    def _reverse(self, lo, hi):
+        run = self.order[lo:hi + 1]
+        run.reverse()
+        self.order[lo:hi + 1] = run
+        for b in run:
+            self.flip[b] = not self.flip[b]
+        self._positions(lo, hi + 1)
+
+    # ----------------------------------------------------------------------
+    # 2-opt: try to link the end of the block at i to the end of a near
+    # block at j, reversing the blocks between them
+    # ----------------------------------------------------------------------
+    def _twoOpt(self, i, neighbours):
+        order = self.order
+        n = len(order)
+        dist = self.dist
+        a = order[i]
+        Ea = self.end(a)
+        b = order[i + 1]
+        Sb = self.start(b)
+        for c in neighbours[2 * a + (0 if self.flip[a] else 1)]:
+            j = self.pos[c]
+            if j <= i:
+                continue
+            Ec = self.end(c)
+            old = dist(Ea, Sb)
+            new = dist(Ea, Ec)
+            if j < n - 1:
+                Sd = self.start(order[j + 1])
+                old += dist(Ec, Sd)
+                new += dist(Sb, Sd)
+            if new < old - EPS and self._reversible(i + 1, j):
+                self._reverse(i + 1, j)
+                return True
+        return False
+
+    # ----------------------------------------------------------------------
+    # Or-opt: try to move the chain of blocks starting at i+1 after a block
+    # ending near it, reversed if better and possible
+    # ----------------------------------------------------------------------
+    def _orOpt(self, i, neighbours):
+        order = self.order
+        n = len(order)
+        dist = self.dist
+        pos = self.pos
+        Ea = self.end(order[i])
+        for length in range(1, OROPT_CHAIN + 1):
+            s = i + 1
+            e = i + length
+            if e >= n:
+                break
+            Ss = self.start(order[s])
+            Ee = self.end(order[e])
+            gain = dist(Ea, Ss)
+            if e < n - 1:
+                Sn = self.start(order[e + 1])
+                gain += dist(Ee, Sn) - dist(Ea, Sn)
+            if gain <= EPS:
+                continue
+            reversible = None
+            candidates = neighbours[2 * order[s] + (
+                1 if self.flip[order[s]] else 0)] \
+                + neighbours[2 * order[e] + (0 if self.flip[order[e]] else 1)]
+            for c in candidates:
+                p = pos[c]
+                if i <= p <= e:
+                    continue
+                Ep = self.end(c)
+                Sq = self.start(order[p + 1]) if p < n - 1 else None
+                base = dist(Ep, Sq) if Sq is not None else 0.0
+                # forward
+                cost = dist(Ep, Ss) - base
+                if Sq is not None:
+                    cost += dist(Ee, Sq)
+                if cost < gain - EPS:
+                    self._move(s, e, p, False)
+                    return True
+                # reversed
+                cost = dist(Ep, Ee) - base
+                if Sq is not None:
+                    cost += dist(Ss, Sq)
+                if cost < gain - EPS:
+                    if reversible is None:
+                        reversible = self._reversible(s, e)
+                    if reversible:
+                        self._move(s, e, p, True)
+                        return True
+        return False
+
+    # ----------------------------------------------------------------------
+    # Move the chain of positions s..e after position p
+    # ----------------------------------------------------------------------
+    def _move(self, s, e, p, reverse):
+        order = self.order
+        chain = order[s:e + 1]
+        if reverse:
+            chain.reverse()
+            for b in chain:
+                self.flip[b] = not self.flip[b]
+        del order[s:e + 1]
+        if p > e:
+            p -= e - s + 1
+        order[p + 1:p + 1] = chain
+        self._positions(min(s, p + 1))
+
+    # ----------------------------------------------------------------------
+    # Improve the tour until no move improves it or the time is over
+    # ----------------------------------------------------------------------
+    def improve(self, timeout=OPTIMIZE_TIME):
+        n = len(self.order)
+        if n < 3:
+            return
+        neighbours = self._neighbours()
+        end = time.time() + timeout
+        improved = True
+        while improved:
+            improved = False
+            for i in range(n - 1):
+                if self._twoOpt(i, neighbours) or self._orOpt(i, neighbours):
+                    improved = True
+                if time.time() > end:
+                    return
+
+
+# -----------------------------------------------------------------------------
+# Order the blocks
+# @param starts     start point of every block, weighted by the machine speed
+# @param ends       end point of every block
+# @param reversible blocks that may be reversed
+# @return the new order and the list of the blocks to reverse
+# -----------------------------------------------------------------------------
+def optimize(starts, ends, reversible, timeout=OPTIMIZE_TIME):
+    tour = Tour(starts, ends, reversible)
+    tour.nearestNeighbour()
+    tour.improve(timeout)
+    flips = [
+        b for b in tour.order
+        if tour.flip[b] and reversible[b] and starts[b] != ends[b]
+    ]
+    return tour.order, flips
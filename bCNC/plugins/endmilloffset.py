@@ -5,6 +5,7 @@ import sys
 from copy import deepcopy
 from tkinter import messagebox
 
+import polyoffset
 from bpath import Path, Segment
 from ToolsPage import Plugin
 
@@ -30,6 +31,7 @@ def pocket(
     name,
     gcode,
     app,
+    method="path",
 ):
     undoinfo = []
     msg = ""
@@ -73,23 +75,37 @@ def pocket(
             path.convert2Lines(abs(diameter) / 10.0)
             if not block.operationTest("island"):
                 outpathslist.append(path)
-        MyPocket = PocketIsland(
-            outpathslist,
-            RecursiveDepth,
-            ProfileDir,
-            CutDir,
-            AdditionalCut,
-            Overcuts,
-            CustomRecursiveDepth,
-            ignoreIslands,
-            allowG1,
-            diameter,
-            stepover,
-            0,
-            app,
-            islandslist,
-        )
-        newpathList = MyPocket.getfullpath()
+        if method == "polygon":
+            newpathList = polygonPocket(
+                outpathslist,
+                islandslist,
+                RecursiveDepth,
+                ProfileDir,
+                CutDir,
+                AdditionalCut,
+                Overcuts,
+                CustomRecursiveDepth,
+                diameter,
+                stepover,
+            )
+        else:
+            MyPocket = PocketIsland(
+                outpathslist,
+                RecursiveDepth,
+                ProfileDir,
+                CutDir,
+                AdditionalCut,
+                Overcuts,
+                CustomRecursiveDepth,
+                ignoreIslands,
+                allowG1,
+                diameter,
+                stepover,
+                0,
+                app,
+                islandslist,
+            )
+            newpathList = MyPocket.getfullpath()
         # concatenate newpath in a single list and split2contours
         if allowG1:
             MyFullPath = Path("Pocket")
@@ -115,6 +131,52 @@ def pocket(
     return msg
 
 
+# =============================================================================
+# Passes of the outer paths with their islands offset as one area by
+# polyoffset, every pass offset from the paths by one step more than the
+# previous one
+# =============================================================================
+def polygonPocket(
+    outpaths,
+    islands,
+    RecursiveDepth,
+    ProfileDir,
+    CutDir,
+    AdditionalCut,
+    Overcuts,
+    CustomRecursiveDepth,
+    diameter,
+    stepover,
+):
+    count = {
+        "Single profile": 1,
+        "Custom offset count": max(1, int(CustomRecursiveDepth)),
+        "Full pocket": None,
+    }.get(RecursiveDepth, 1)
+    profiledir = 1.0 if ProfileDir == "inside" or count is None else -1.0
+    islands = [
+        island
+        for island in islands
+        if any(island.isPathInside(path) >= 0 for path in outpaths)
+    ]
+    first = -profiledir * (diameter / 2.0 - float(AdditionalCut))
+    step = -profiledir * diameter * stepover
+    rings = polyoffset.rings(outpaths + islands, first, step, count)
+
+    # the area is on the left, conventional milling needs the tool on the
+    # right inside and on the left outside
+    invert = (profiledir > 0.0) != bool(CutDir)
+    newpathList = []
+    for depth, ring in enumerate(rings):
+        for opath in ring:
+            if depth == 0 and Overcuts:
+                opath.overcut(-first)
+            if invert:
+                opath.invert()
+            newpathList.append(opath)
+    return newpathList
+
+
 class PocketIsland:
     def __init__(
         self,
@@ -502,6 +564,15 @@ class Tool(Plugin):
                     "Currently there is some weird behaviour sometimes when trying to link segments of pocket internally, so it can be disabled using this option. This workaround should be fixed and removed in future."
                 ),
             ),
+            (
+                "method",
+                "path,polygon",
+                "path",
+                _("Offset method"),
+                _(
+                    "polygon offsets the paths with their islands as one area, more robust on complex shapes"
+                ),
+            ),
         ]
         self.help = """This plugin offsets shapes to create toolpaths for profiling and pocketing operation.
 Shape needs to be offset by the radius of endmill to get cut correctly.
@@ -558,6 +629,7 @@ Grey is simulation of how part will look after machining
             name,
             app.gcode,
             app,
+            self["method"],
         )
         if msg:
             messagebox.showwarning(
@@ -13,6 +13,7 @@ import numpy as np
 import ply
 import stl  # FIXME: write smaller STL parser
 
+from bpath import CompactPath
 from CNC import Block
 from ToolsPage import Plugin
 
@@ -228,6 +229,20 @@ Also note you can export resulting slices to DXF and SVG if needed.
         # Crosscut
         contours = meshcut.cross_section(verts, faces, plane_orig, plane_norm)
 
+        # Horizontal contours to G-code through paths, so they are cut
+        # like the other imported paths
+        if axis == "z":
+            if zout is None:
+                zout = z
+            for contour in contours:
+                path = CompactPath.fromPoints(block.name(), contour, True)
+                if path:
+                    self.app.gcode.fromPath(path, block, zout)
+                    block.append("( ---------- cut-here ---------- )")
+            if block:
+                del block[-1]
+            return block or None
+
         # Flatten contours
         if zout is not None:
             for contour in contours:
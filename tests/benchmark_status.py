@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# Status report parser benchmark
+#
+# Parses streams of grbl 1.1 status reports with the GRBL1 controller and
+# with the former field by field parser, checks that both leave the same
+# values in CNC.vars and reports the time per report. The former parser
+# computed the work position from the previous WCO when the WCO field
+# followed MPos, so the reports changing the WCO are not compared.
+# Captured streams are text files (e.g. saved terminal logs), only the
+# <...> lines are used. Without files synthetic idle, jog and run streams
+# are parsed, with the WCO and Ov refresh rates of grbl.
+#
+# Usage:
+#   python tests/benchmark_status.py [--reports 20000] [capture.txt ...]
+
+import argparse
+import gettext
+import math
+import os
+import sys
+import time
+from queue import Queue
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+BCNC = os.path.join(os.path.dirname(TESTS), "bCNC")
+sys.path[:0] = [
+    BCNC,
+    os.path.join(BCNC, "lib"),
+    os.path.join(BCNC, "controllers"),
+]
+gettext.install(True, localedir=None)
+
+import GRBL1  # noqa: E402
+from _GenericController import SPLITPAT  # noqa: E402
+from CNC import CNC  # noqa: E402
+
+KEYS = (
+    "state", "pins", "mx", "my", "mz", "wx", "wy", "wz",
+    "wcox", "wcoy", "wcoz", "curfeed", "curspindle",
+    "planner", "rxbytes", "OvFeed", "OvRapid", "OvSpindle",
+)
+
+
+# =============================================================================
+# The parts of the Sender used by the status parser
+# =============================================================================
+class Master:
+    MSG_RECEIVE = 2
+
+    def __init__(self):
+        self.sio_status = True
+        self.sio_wait = False
+        self.running = True
+        self.runningPrev = True
+        self._posUpdate = False
+        self._gcount = 0
+        self.log = Queue()
+
+    def controllerStateChange(self, state):
+        pass
+
+    def bufferReport(self, planner, rxbytes, cline):
+        pass
+
+    def event_generate(self, event, **kw):
+        pass
+
+
+# =============================================================================
+# Former parser splitting every field with SPLITPAT
+# =============================================================================
+class Legacy(GRBL1.Controller):
+    def parseBracketAngle(self, line, cline):
+        self.master.sio_status = False
+        fields = line[1:-1].split("|")
+        CNC.vars["pins"] = ""
+
+        if (
+            CNC.vars["state"] != fields[0]
+            or self.master.runningPrev != self.master.running
+        ):
+            self.master.controllerStateChange(fields[0])
+        self.master.runningPrev = self.master.running
+
+        self.displayState(fields[0])
+
+        for field in fields[1:]:
+            word = SPLITPAT.split(field)
+            if word[0] == "MPos":
+                CNC.vars["mx"] = float(word[1])
+                CNC.vars["my"] = float(word[2])
+                CNC.vars["mz"] = float(word[3])
+                CNC.vars["wx"] = round(
+                    CNC.vars["mx"] - CNC.vars["wcox"], CNC.digits)
+                CNC.vars["wy"] = round(
+                    CNC.vars["my"] - CNC.vars["wcoy"], CNC.digits)
+                CNC.vars["wz"] = round(
+                    CNC.vars["mz"] - CNC.vars["wcoz"], CNC.digits)
+                self.master._posUpdate = True
+            elif word[0] == "F":
+                CNC.vars["curfeed"] = float(word[1])
+            elif word[0] == "FS":
+                CNC.vars["curfeed"] = float(word[1])
+                CNC.vars["curspindle"] = float(word[2])
+            elif word[0] == "Bf":
+                CNC.vars["planner"] = int(word[1])
+                CNC.vars["rxbytes"] = int(word[2])
+                self.master.bufferReport(
+                    CNC.vars["planner"], CNC.vars["rxbytes"], cline)
+            elif word[0] == "Ov":
+                CNC.vars["OvFeed"] = int(word[1])
+                CNC.vars["OvRapid"] = int(word[2])
+                CNC.vars["OvSpindle"] = int(word[3])
+            elif word[0] == "WCO":
+                CNC.vars["wcox"] = float(word[1])
+                CNC.vars["wcoy"] = float(word[2])
+                CNC.vars["wcoz"] = float(word[3])
+            elif word[0] == "Pn":
+                CNC.vars["pins"] = word[1]
+
+
+# -----------------------------------------------------------------------------
+# Synthetic stream of n reports, WCO and Ov are sent every 30 and 20 reports
+# while moving and every 10 when idle like grbl does
+# -----------------------------------------------------------------------------
+def synthetic(kind, n):
+    lines = []
+    wco, ov = (30, 20) if kind != "idle" else (10, 10)
+    for i in range(n):
+        if kind == "idle":
+            state, x, y, z, feed, bf = "Idle", 10.0, 20.0, -1.0, 0, 15
+        else:
+            a = i * 0.01
+            state = "Jog" if kind == "jog" else "Run"
+            x = 50.0 + 40.0 * math.cos(a)
+            y = 50.0 + 40.0 * math.sin(a)
+            z = -1.0 if kind == "run" else 5.0
+            feed = 1000 + (i % 7) * 10
+            bf = i % 15
+        line = (f"<{state}|MPos:{x:.3f},{y:.3f},{z:.3f}|Bf:{bf},{i % 128}"
+                f"|FS:{feed},12000")
+        if i % wco == 0:
+            line += "|WCO:-100.000,-50.000,-20.000"
+        elif i % ov == 1:
+            line += "|Ov:100,100,100"
+        if kind == "run" and i % 50 == 25:
+            line += "|Pn:P"
+        lines.append(line + ">")
+    return lines
+
+
+# -----------------------------------------------------------------------------
+def captured(filename):
+    with open(filename) as f:
+        return [x.strip() for x in f if x.startswith("<")]
+
+
+# -----------------------------------------------------------------------------
+# Parse the stream with the controller class
+# @return seconds per report and the values after every report
+# -----------------------------------------------------------------------------
+def parse(cls, lines, check):
+    master = Master()
+    ctl = cls(master)
+    for key in KEYS:
+        CNC.vars[key] = 0
+    CNC.vars["state"] = "Idle"
+    CNC.vars["pins"] = ""
+    values = []
+    start = time.perf_counter()
+    for line in lines:
+        master.sio_status = True
+        ctl.parseBracketAngle(line, [])
+        if check:
+            values.append(tuple(CNC.vars[k] for k in KEYS))
+    elapsed = time.perf_counter() - start
+    return elapsed / max(1, len(lines)), values
+
+
+# -----------------------------------------------------------------------------
+# Index of the reports changing the WCO
+# -----------------------------------------------------------------------------
+def wcoChanges(lines):
+    changes = set()
+    wco = None
+    for i, line in enumerate(lines):
+        for field in line[1:-1].split("|"):
+            if field.startswith("WCO:") and field != wco:
+                wco = field
+                changes.add(i)
+    return changes
+
+
+# -----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="status parser benchmark")
+    parser.add_argument("files", nargs="*", help="captured status streams")
+    parser.add_argument("--reports", type=int, default=20000,
+                        help="reports of every synthetic stream")
+    args = parser.parse_args()
+
+    streams = [(f, captured(f)) for f in args.files]
+    if not streams:
+        streams = [(kind, synthetic(kind, args.reports))
+                   for kind in ("idle", "jog", "run")]
+
+    rc = 0
+    for name, lines in streams:
+        # same values after every report
+        legacy = parse(Legacy, lines, True)[1]
+        fast = parse(GRBL1.Controller, lines, True)[1]
+        skip = wcoChanges(lines)
+        i = next((i for i, (a, b) in enumerate(zip(legacy, fast))
+                  if a != b and i not in skip), None)
+        if i is not None:
+            print(f"{name}: report {i} differs: {lines[i]}")
+            print(f"  legacy {legacy[i]}\n  fast   {fast[i]}")
+            rc = 1
+
+        told = min(parse(Legacy, lines, False)[0] for _ in range(3))
+        tnew = min(parse(GRBL1.Controller, lines, False)[0] for _ in range(3))
+        print(f"{name}: {len(lines)} reports, legacy {told * 1e6:.1f}us, "
+              f"fast {tnew * 1e6:.1f}us per report, x{told / tnew:.2f}")
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main())
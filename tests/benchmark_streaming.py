@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Streaming benchmark
+#
+# Streams g-code files through bCNC's Sender into the GRBL simulator
+# (grblsim.py) over a pseudo terminal and reports the achieved lines/s,
+# the planner starvation time of the simulated machine and the latency of
+# the emulated GUI thread, that drains the log every MONITOR_AFTER ms like
+# Application._monitorSerial does.
+#
+# Usage:
+#   python tests/benchmark_streaming.py [--speed 20] [--poll] [file.nc ...]
+
+import argparse
+import gettext
+import os
+import sys
+import time
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+BCNC = os.path.join(os.path.dirname(TESTS), "bCNC")
+sys.path[:0] = [
+    TESTS,
+    BCNC,
+    os.path.join(BCNC, "lib"),
+    os.path.join(BCNC, "controllers"),
+]
+gettext.install(True, localedir=None)
+
+import Sender  # noqa: E402
+import Utils  # noqa: E402
+from grblsim import GrblSimulator  # noqa: E402
+
+MONITOR_AFTER = 0.200  # s, same as bmain.MONITOR_AFTER
+TIMEOUT = 600.0  # s, give up after
+
+
+# -----------------------------------------------------------------------------
+# Stream one file and return a dictionary with the measurements
+# -----------------------------------------------------------------------------
+def stream(filename, speed=1.0, rx=128, planner=15, verbose=False):
+    sim = GrblSimulator(rx=rx, planner=planner, speed=speed)
+    port = sim.openPty()
+    sim.start()
+
+    sender = Sender.Sender()
+    sender.gcode.load(filename)
+    lines = sender.gcode.countLines()
+    if not sender.open(port, 115200):
+        raise OSError(f"Cannot open {port}")
+    time.sleep(1.0)  # welcome, $G, $$
+    while not sender.log.empty():
+        sender.log.get_nowait()
+    sim.resetStats()
+
+    # same as Application.run() without the GUI
+    sender._quit = 0
+    sender._pause = False
+    sender.running = True
+    sender._gcount = 0
+    sender._paths = []
+    sender._runLines = lines + 1
+    sender._compiler = sender.gcode.compileIter()
+
+    start = time.time()
+    latency = []
+    logged = 0
+    tick = start + MONITOR_AFTER
+    try:
+        while True:
+            now = time.time()
+            if now < tick:
+                time.sleep(tick - now)
+                continue
+            latency.append(now - tick)
+            t = time.time()
+            while sender.log.qsize() > 0 and time.time() - t < 0.1:
+                msg, line = sender.log.get_nowait()
+                logged += 1
+                if verbose and msg == Sender.Sender.MSG_ERROR:
+                    print(line)
+            if sender._compiler is None and sender._gcount >= sender._runLines:
+                break
+            if now - start > TIMEOUT:
+                print("Timeout!")
+                break
+            tick = time.time() + MONITOR_AFTER
+        elapsed = time.time() - start
+    finally:
+        sender.runEnded()
+        sender.running = False
+        sender.close()
+        sim.stop()
+
+    return {
+        "file": os.path.basename(filename),
+        "lines": sim.lines,
+        "time": elapsed,
+        "rate": sim.lines / elapsed if elapsed > 0 else 0.0,
+        "busy": sim.busy,
+        "starved": sim.starved,
+        "errors": sim.errors,
+        "overflow": sim.overflow,
+        "rxmax": sim.rxMax,
+        "latency": sum(latency) / max(1, len(latency)),
+        "latencymax": max(latency, default=0.0),
+        "logged": logged,
+    }
+
+
+# -----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="bCNC streaming benchmark")
+    parser.add_argument(
+        "files",
+        nargs="*",
+        default=[os.path.join(TESTS, "static", "sample.gcode")],
+        help="g-code files to stream",
+    )
+    parser.add_argument("--speed", type=float, default=20.0,
+                        help="simulator time scaling")
+    parser.add_argument("--rx", type=int, default=128,
+                        help="simulator RX buffer size")
+    parser.add_argument("--planner", type=int, default=15,
+                        help="simulator planner blocks")
+    parser.add_argument("--poll", action="store_true",
+                        help="use the polling serial loop instead of select")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    Utils.loadConfiguration(systemOnly=True)  # reproducible defaults
+    if args.poll:
+        Sender.SERIAL_SELECT = False
+
+    for filename in args.files:
+        r = stream(filename, args.speed, args.rx, args.planner, args.verbose)
+        print(
+            "{file}: {lines} lines in {time:.2f}s = {rate:.0f} lines/s\n"
+            "  machine busy {busy:.2f}s starved {starved:.2f}s\n"
+            "  errors {errors} overflow {overflow} bytes, rx max {rxmax}\n"
+            "  gui latency mean {lat:.1f}ms max {latmax:.1f}ms, "
+            "{logged} log messages".format(
+                lat=r["latency"] * 1000.0,
+                latmax=r["latencymax"] * 1000.0,
+                **r
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# GRBL 1.1 simulator for offline streaming tests
+#
+# Models the parts of the controller that matter for streaming: the serial
+# RX buffer, the planner depth, the execution time of the motions, status
+# reports with the Bf: field and the ok/error replies. The simulator listens
+# on a pseudo terminal (like fake-grbl.sh) or on a tcp socket, both can be
+# opened by pyserial's serial_for_url and therefore by bCNC.
+#
+# Usage:
+#   python tests/grblsim.py /tmp/ttyGRBL          # pty linked to the path
+#   python tests/grblsim.py socket://:8300        # tcp socket
+
+import argparse
+import math
+import os
+import re
+import select
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+WELCOME = b"\r\nGrbl 1.1f ['$' for help]\r\n"
+WORDPAT = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+COMMENTPAT = re.compile(r"\(.*?\)|;.*")
+
+RX_BUFFER_SIZE = 128  # bytes
+PLANNER_SIZE = 15  # blocks
+LINE_LENGTH = 80  # maximum characters per line
+ACCELERATION = 500.0  # mm/s^2
+RAPID = 5000.0  # mm/min
+
+
+class GrblSimulator:
+    def __init__(
+        self,
+        rx=RX_BUFFER_SIZE,
+        planner=PLANNER_SIZE,
+        acceleration=ACCELERATION,
+        rapid=RAPID,
+        speed=1.0,
+    ):
+        self.rxSize = rx
+        self.plannerSize = planner
+        self.acceleration = acceleration
+        self.rapid = rapid
+        self.speed = speed  # time scaling, >1 executes faster than real
+        self.fd = None
+        self.thread = None
+        self.reset()
+        self.resetStats()
+
+    # ----------------------------------------------------------------------
+    def reset(self):
+        self.rx = bytearray()  # received bytes not yet parsed
+        self.planner = deque()  # (duration, target, feed)
+        self.blockEnd = None  # end time of the executing block
+        self.hold = False
+        self._remaining = 0.0  # time left of the block when held
+        self.position = [0.0, 0.0, 0.0]  # executed position
+        self.target = [0.0, 0.0, 0.0]  # parser position
+        self.absolute = True
+        self.unit = 1.0
+        self.motion = 0
+        self.feed = 0.0
+        self.error = None  # error to report for the current line
+
+    # ----------------------------------------------------------------------
+    def resetStats(self):
+        self.lines = 0  # lines parsed
+        self.errors = 0
+        self.overflow = 0  # bytes lost with a full RX buffer
+        self.starved = 0.0  # s, planner empty between motions
+        self.busy = 0.0  # s, executing motions
+        self.idleSince = None  # planner empty since, after a motion
+        self.rxMax = 0  # maximum RX buffer usage
+
+    # ----------------------------------------------------------------------
+    # Open a pseudo terminal, the slave name is returned and optionally
+    # linked to link
+    # ----------------------------------------------------------------------
+    def openPty(self, link=None):
+        import pty
+        import tty
+
+        master, slave = pty.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        name = os.ttyname(slave)
+        if link:
+            if os.path.islink(link):
+                os.unlink(link)
+            os.symlink(name, link)
+            name = link
+        self.fd = master
+        self._slave = slave  # keep it open to avoid EIO when closed
+        return name
+
+    # ----------------------------------------------------------------------
+    # Wait for a tcp connection on port
+    # ----------------------------------------------------------------------
+    def acceptSocket(self, port, host=""):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen(1)
+        conn, addr = server.accept()
+        server.close()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket = conn  # keep a reference
+        self.fd = conn.fileno()
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        self.thread = None
+
+    # ----------------------------------------------------------------------
+    def write(self, data):
+        try:
+            os.write(self.fd, data)
+        except OSError:
+            self.thread = None
+
+    # ----------------------------------------------------------------------
+    # Main loop reading the serial, executing the planner and parsing
+    # the lines from the RX buffer when there is room in the planner
+    # ----------------------------------------------------------------------
+    def loop(self):
+        self.write(WELCOME)
+        while self.thread is not None:
+            now = time.time()
+            self.execute(now)
+            self.parse(now)
+
+            if self.blockEnd is not None and not self.hold:
+                timeout = max(0.0, self.blockEnd - now)
+            else:
+                timeout = 0.1
+            if not select.select([self.fd], [], [], timeout)[0]:
+                continue
+            try:
+                data = os.read(self.fd, 4096)
+            except OSError:
+                break
+            if not data:
+                break
+            self.receive(data, time.time())
+
+    # ----------------------------------------------------------------------
+    # Realtime commands are executed immediately, the rest is buffered
+    # ----------------------------------------------------------------------
+    def receive(self, data, now):
+        for c in data:
+            if c == 0x3F:  # ?
+                self.write(self.status().encode() + b"\r\n")
+            elif c == 0x21:  # !
+                if not self.hold and self.blockEnd is not None:
+                    self._remaining = self.blockEnd - now
+                self.hold = True
+            elif c == 0x7E:  # ~
+                if self.hold and self.blockEnd is not None:
+                    self.blockEnd = now + self._remaining
+                self.hold = False
+            elif c == 0x18:  # ctrl-x
+                self.reset()
+                self.write(WELCOME)
+            elif c >= 0x80:  # overrides
+                pass
+            elif len(self.rx) < self.rxSize:
+                self.rx.append(c)
+                self.rxMax = max(self.rxMax, len(self.rx))
+            else:
+                self.overflow += 1
+
+    # ----------------------------------------------------------------------
+    # Execute the planner blocks finished by now
+    # ----------------------------------------------------------------------
+    def execute(self, now):
+        if self.hold:
+            return
+        while self.blockEnd is not None and self.blockEnd <= now:
+            duration, target, feed = self.planner.popleft()
+            self.position = target
+            self.busy += duration
+            if self.planner:
+                self.blockEnd += self.planner[0][0]
+            else:
+                self.idleSince = self.blockEnd
+                self.blockEnd = None
+
+    # ----------------------------------------------------------------------
+    # Parse lines while the planner has free blocks
+    # ----------------------------------------------------------------------
+    def parse(self, now):
+        while len(self.planner) < self.plannerSize:
+            eol = self.rx.find(b"\n")
+            if eol < 0:
+                return
+            line = self.rx[:eol].decode("ascii", "ignore").strip()
+            del self.rx[: eol + 1]
+            self.lines += 1
+            reply = self.line(line, now)
+            if reply.startswith("error"):
+                self.errors += 1
+            self.write(reply.encode() + b"\r\n")
+
+    # ----------------------------------------------------------------------
+    # Process one line
+    # @return the reply
+    # ----------------------------------------------------------------------
+    def line(self, line, now):
+        if not line:
+            return "ok"
+        if len(line) > LINE_LENGTH:
+            return "error:11"
+        if line[0] == "$":
+            return self.system(line.upper())
+
+        words = WORDPAT.findall(COMMENTPAT.sub("", line).upper())
+        if not words:
+            return "error:1"
+        values = {}
+        for letter, value in words:
+            value = float(value)
+            if letter == "G":
+                if value in (0, 1, 2, 3):
+                    self.motion = int(value)
+                elif value == 90:
+                    self.absolute = True
+                elif value == 91:
+                    self.absolute = False
+                elif value == 20:
+                    self.unit = 25.4
+                elif value == 21:
+                    self.unit = 1.0
+            elif letter == "F":
+                self.feed = value * self.unit
+            else:
+                values[letter] = value * self.unit
+
+        if not any(axis in values for axis in "XYZ"):
+            return "ok"
+        start = self.target
+        target = list(start)
+        for i, axis in enumerate("XYZ"):
+            if axis in values:
+                if self.absolute:
+                    target[i] = values[axis]
+                else:
+                    target[i] += values[axis]
+        self.target = target
+        if self.motion == 0:
+            feed = self.rapid
+        elif self.feed <= 0.0:
+            return "error:22"  # undefined feed rate
+        else:
+            feed = self.feed
+        length = self.length(start, target, values)
+        self.plan(length, target, feed, now)
+        return "ok"
+
+    # ----------------------------------------------------------------------
+    def length(self, start, target, values):
+        chord = math.dist(start, target)
+        if self.motion not in (2, 3) or ("I" not in values and "J" not in values):
+            return chord
+        cx = start[0] + values.get("I", 0.0)
+        cy = start[1] + values.get("J", 0.0)
+        r = math.hypot(start[0] - cx, start[1] - cy)
+        a1 = math.atan2(start[1] - cy, start[0] - cx)
+        a2 = math.atan2(target[1] - cy, target[0] - cx)
+        angle = a2 - a1 if self.motion == 3 else a1 - a2
+        if angle <= 1e-9:
+            angle += 2.0 * math.pi
+        return math.hypot(r * angle, target[2] - start[2])
+
+    # ----------------------------------------------------------------------
+    # Add a block to the planner. The look ahead keeps the speed between
+    # blocks, only a block starting from rest pays the acceleration ramp
+    # ----------------------------------------------------------------------
+    def plan(self, length, target, feed, now):
+        speed = feed / 60.0
+        duration = length / speed
+        if not self.planner:
+            duration += speed / (2.0 * self.acceleration)
+        duration /= self.speed
+        self.planner.append((duration, target, feed))
+        if self.blockEnd is None and not self.hold:
+            if self.idleSince is not None:
+                self.starved += max(0.0, now - self.idleSince)
+                self.idleSince = None
+            self.blockEnd = now + duration
+
+    # ----------------------------------------------------------------------
+    def system(self, line):
+        if line == "$$":
+            # $10=3: MPos and Bf: in the status reports
+            self.write(
+                b"$10=3\r\n$11=0.010\r\n$110=%d\r\n$120=%d\r\n"
+                % (int(self.rapid), int(self.acceleration))
+            )
+        elif line == "$G":
+            self.write(
+                b"[GC:G%d G54 G17 G%d G%d G94 M5 M9 T0 F%g S0]\r\n"
+                % (
+                    self.motion,
+                    21 if self.unit == 1.0 else 20,
+                    90 if self.absolute else 91,
+                    self.feed,
+                )
+            )
+        elif line == "$#":
+            for g in ("G54", "G55", "G56", "G57", "G58", "G59", "G28", "G30"):
+                self.write(b"[%s:0.000,0.000,0.000]\r\n" % g.encode())
+            self.write(b"[TLO:0.000]\r\n[PRB:0.000,0.000,0.000:0]\r\n")
+        elif line == "$I":
+            self.write(b"[VER:1.1f.sim:]\r\n[OPT:V,%d,%d]\r\n" % (
+                self.plannerSize, self.rxSize))
+        elif line == "$X":
+            self.write(b"[MSG:Caution: Unlocked]\r\n")
+        return "ok"
+
+    # ----------------------------------------------------------------------
+    def status(self):
+        if self.hold:
+            state = "Hold:0"
+        elif self.blockEnd is not None:
+            state = "Run"
+        else:
+            state = "Idle"
+        feed = self.planner[0][2] if self.planner else 0.0
+        return "<{}|MPos:{:.3f},{:.3f},{:.3f}|Bf:{},{}|FS:{:g},0>".format(
+            state,
+            *self.position,
+            self.plannerSize - len(self.planner),
+            self.rxSize - len(self.rx),
+            feed,
+        )
+
+
+# -----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="GRBL 1.1 simulator")
+    parser.add_argument("port", help="pty link path or socket://[host]:port")
+    parser.add_argument("--rx", type=int, default=RX_BUFFER_SIZE,
+                        help="RX buffer size in bytes")
+    parser.add_argument("--planner", type=int, default=PLANNER_SIZE,
+                        help="planner blocks")
+    parser.add_argument("--acceleration", type=float, default=ACCELERATION,
+                        help="acceleration in mm/s^2")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="time scaling of the execution")
+    args = parser.parse_args()
+
+    sim = GrblSimulator(args.rx, args.planner, args.acceleration,
+                        speed=args.speed)
+    if args.port.startswith("socket://"):
+        host, port = args.port[9:].rsplit(":", 1)
+        print(f"Listening at {args.port}")
+        sim.acceptSocket(int(port), host)
+    else:
+        print(f"Listening at fake serial port: {sim.openPty(args.port)}")
+    sim.thread = threading.current_thread()
+    try:
+        sim.loop()
+    except KeyboardInterrupt:
+        pass
+    print(
+        f"lines {sim.lines} errors {sim.errors} overflow {sim.overflow} "
+        f"busy {sim.busy:.2f}s starved {sim.starved:.2f}s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import gettext
+import math
+import os
+import random
+import sys
+import unittest
+
+BCNC = os.path.join(os.path.dirname(__file__), "..", "bCNC")
+sys.path[:0] = [BCNC, os.path.join(BCNC, "lib")]
+gettext.install(True, localedir=None)
+
+import bpath  # noqa: E402
+from bmath import Vector  # noqa: E402
+from bpath import CompactPath, Path, Segment  # noqa: E402
+from CNC import GCode  # noqa: E402
+
+
+def polyline(points, closed=False):
+    path = Path("polyline")
+    if closed:
+        points = list(points) + [points[0]]
+    for A, B in zip(points, points[1:]):
+        path.append(Segment(Segment.LINE, Vector(*A), Vector(*B)))
+    return path
+
+
+def mixed(seed):
+    # lines and arcs in both directions, a closed path
+    rnd = random.Random(seed)
+    path = Path("mixed")
+    n = 24
+    angles = sorted(rnd.uniform(0, 2 * math.pi) for _ in range(n))
+    points = [Vector(50 * math.cos(a), 50 * math.sin(a)) for a in angles]
+    for k, A in enumerate(points):
+        B = points[(k + 1) % n]
+        if k % 3 == 0:
+            path.append(Segment(Segment.LINE, A, B))
+        else:
+            C = (A + B) * 0.5
+            kind = Segment.CCW if k % 3 == 1 else Segment.CW
+            path.append(Segment(kind, A, B, C))
+    return path
+
+
+class CompactPathTest(unittest.TestCase):
+    def paths(self):
+        rnd = random.Random(5)
+        open_ = [(rnd.uniform(-20, 20), rnd.uniform(-20, 20))
+                 for _ in range(50)]
+        square = [(0, 0), (0, 10), (10, 10), (10, 0)]
+        return [
+            polyline(open_),
+            polyline(square, True),
+            polyline(square[::-1], True),
+            mixed(1),
+            mixed(2),
+        ]
+
+    def assertSegments(self, compact, path):
+        self.assertEqual(len(compact), len(path))
+        for view, segment in zip(compact, path):
+            self.assertEqual(view.type, segment.type)
+            for P, Q in ((view.A, segment.A), (view.B, segment.B)):
+                self.assertAlmostEqual(P[0], Q[0], 9)
+                self.assertAlmostEqual(P[1], Q[1], 9)
+
+    def compare(self):
+        for path in self.paths():
+            compact = CompactPath.fromPath(path)
+            self.assertAlmostEqual(compact.length(), path.length(), 9)
+            for a, b in zip(compact.bbox(), path.bbox()):
+                self.assertAlmostEqual(a, b, 6)
+            self.assertEqual(compact.isClosed(), path.isClosed())
+            self.assertEqual(compact.direction(), path.direction())
+            self.assertSegments(compact.linearize(2.0),
+                                path.linearize(2.0))
+            self.assertSegments(compact.linearize(2.0, True),
+                                path.linearize(2.0, True))
+
+    def test_same_as_path(self):
+        self.compare()
+
+    def test_same_as_path_without_numpy(self):
+        numpy = bpath.numpy
+        bpath.numpy = None
+        try:
+            self.compare()
+        finally:
+            bpath.numpy = numpy
+
+    def test_round_trip(self):
+        for path in self.paths():
+            self.assertSegments(CompactPath.fromPath(path).toPath(), path)
+
+    def test_from_points(self):
+        square = [(0, 0), (0, 0), (0, 10), (10, 10), (10, 0)]
+        compact = CompactPath.fromPoints("square", square, True)
+        path = polyline(square[1:], True)
+        self.assertSegments(compact, path)
+        self.assertTrue(compact.isClosed())
+        self.assertEqual(compact.direction(), path.direction())
+        self.assertEqual(len(CompactPath.fromPoints("open", square)), 3)
+        self.assertEqual(len(CompactPath.fromPoints("point", [(1, 1)])), 0)
+
+    def test_same_gcode(self):
+        gcode = GCode()
+        for path in self.paths():
+            self.assertEqual(
+                list(gcode.fromPath(CompactPath.fromPath(path), z=-1.0)),
+                list(gcode.fromPath(path, z=-1.0)))
+
+
+if __name__ == "__main__":
+    unittest.main()
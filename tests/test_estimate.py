@@ -0,0 +1,35 @@
+import gettext
+import os
+import sys
+import unittest
+
+BCNC = os.path.join(os.path.dirname(__file__), "..", "bCNC")
+sys.path[:0] = [BCNC, os.path.join(BCNC, "lib")]
+gettext.install(True, localedir=None)
+
+from CNC import CNC, GCode  # noqa: E402
+
+
+class EstimateTimeTest(unittest.TestCase):
+    def estimate(self, text):
+        gcode = GCode()
+        gcode.addBlockFromString("program", text)
+        return gcode.estimateTime() * 60.0
+
+    def test_dwell(self):
+        base = self.estimate("G1 X10 F600")
+        for dwell in ("G4 P2", "g04 p2", "G4.0 P2", "g4p2"):
+            self.assertAlmostEqual(
+                self.estimate(f"G1 X10 F600\n{dwell}") - base, 2.0, 3)
+
+    def test_inverse_time(self):
+        feedmode = CNC.vars["feedmode"]
+        # 1/6 min whatever the length
+        base = self.estimate("G1 X10 F600")
+        total = self.estimate("G1 X10 F600\nG93 G1 X20 F6")
+        self.assertAlmostEqual(total - base, 10.0, 0)
+        self.assertEqual(CNC.vars["feedmode"], feedmode)
+
+
+if __name__ == "__main__":
+    unittest.main()
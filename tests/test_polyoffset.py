@@ -0,0 +1,128 @@
+import gettext
+import math
+import os
+import sys
+import unittest
+
+BCNC = os.path.join(os.path.dirname(__file__), "..", "bCNC")
+sys.path[:0] = [BCNC, os.path.join(BCNC, "lib")]
+gettext.install(True, localedir=None)
+
+import polyoffset  # noqa: E402
+from bmath import Vector  # noqa: E402
+from bpath import Path, Segment  # noqa: E402
+from CNC import OFFSET_POLYGON, GCode  # noqa: E402
+
+
+def polygon(points):
+    path = Path("polygon")
+    points = list(points) + [points[0]]
+    for A, B in zip(points, points[1:]):
+        path.append(Segment(Segment.LINE, Vector(*A), Vector(*B)))
+    return path
+
+
+def square(x, y, size):
+    return [(x, y), (x + size, y), (x + size, y + size), (x, y + size)]
+
+
+def circle(r, n):
+    return [(r * math.cos(2 * math.pi * k / n),
+             r * math.sin(2 * math.pi * k / n)) for k in range(n)]
+
+
+def area(path):
+    return polyoffset.area(polyoffset.flatten(path))
+
+
+class PolyOffsetTest(unittest.TestCase):
+    def test_square(self):
+        path = polygon(square(0, 0, 10))
+        grown = polyoffset.offset([path], 1.0)
+        self.assertEqual(len(grown), 1)
+        self.assertAlmostEqual(area(grown[0]), 140.0 + math.pi, 1)
+        shrunk = polyoffset.offset([path], -1.0)
+        self.assertEqual(len(shrunk), 1)
+        self.assertAlmostEqual(area(shrunk[0]), 64.0, 3)
+        self.assertEqual(polyoffset.offset([path], -5.5), [])
+
+    def test_concave(self):
+        # L shape, the inner corner is rounded inside and mitered outside
+        L = [(0, 0), (20, 0), (20, 10), (10, 10), (10, 20), (0, 20)]
+        path = polygon(L)
+        shrunk = polyoffset.offset([path], -1.0)
+        self.assertEqual(len(shrunk), 1)
+        self.assertAlmostEqual(
+            area(shrunk[0]), 18 * 8 + 8 * 10 + 1.0 - math.pi / 4, 1)
+        grown = polyoffset.offset([path], 1.0)
+        self.assertEqual(len(grown), 1)
+        self.assertAlmostEqual(
+            area(grown[0]), 300.0 + 80.0 - 1.0 + 5 * math.pi / 4, 1)
+
+    def test_island(self):
+        paths = [polygon(square(0, 0, 20)), polygon(square(8, 8, 4))]
+        result = polyoffset.offset(paths, -1.0)
+        self.assertEqual(len(result), 2)
+        areas = sorted(area(path) for path in result)
+        self.assertAlmostEqual(areas[0], -(16.0 + 16.0 + math.pi), 1)
+        self.assertAlmostEqual(areas[1], 18.0 * 18.0, 3)
+
+    def test_rings(self):
+        rings = polyoffset.rings([polygon(square(0, 0, 20))], -1.0, -2.0)
+        self.assertEqual(len(rings), 5)
+        for k, ring in enumerate(rings):
+            side = 20.0 - 2.0 * (1.0 + 2.0 * k)
+            self.assertEqual(len(ring), 1)
+            self.assertAlmostEqual(area(ring[0]), side * side, 3)
+
+    def test_arcs(self):
+        # the round joins of a dense circle are fitted back to arcs
+        path = polygon(circle(10.0, 400))
+        for delta in (-2.0, 2.0):
+            result = polyoffset.offset([path], delta)
+            self.assertEqual(len(result), 1)
+            arcs = [s for s in result[0] if s.type != Segment.LINE]
+            self.assertTrue(arcs)
+            self.assertLess(len(result[0]), 40)
+            for segment in arcs:
+                self.assertEqual(segment.type, Segment.CCW)
+                self.assertAlmostEqual(segment.radius, 10.0 + delta, 2)
+            self.assertAlmostEqual(
+                area(result[0]), math.pi * (10.0 + delta) ** 2, 0)
+            lines = polyoffset.offset([path], delta, arcs=False)
+            self.assertEqual(len(lines[0]), len(lines[0].linearize(100.0)))
+
+    def test_miter(self):
+        # smooth wavy contour with concave and convex joins, offset by less
+        # than its radius of curvature: area + delta * perimeter + pi delta^2
+        wavy = [((10 + 2 * math.sin(9 * a)) * math.cos(a),
+                 (10 + 2 * math.sin(9 * a)) * math.sin(a))
+                for a in (2 * math.pi * k / 360 for k in range(360))]
+        for delta in (-0.3, 0.3):
+            loops = polyoffset.offset([polygon(wavy)], delta, arcs=False)
+            self.assertEqual(len(loops), 1)
+            expected = polyoffset.area(wavy) + delta * sum(
+                math.hypot(x1 - x0, y1 - y0)
+                for (x0, y0), (x1, y1) in zip(wavy, wavy[1:] + wavy[:1])
+            ) + math.pi * delta * delta
+            self.assertAlmostEqual(area(loops[0]) / expected, 1.0, 3)
+
+
+class ProfileTest(unittest.TestCase):
+    def test_open_path_skipped(self):
+        gcode = GCode()
+        gcode.addBlockFromString(
+            "closed", "g0 x0 y0\ng1 z-1\ng1 x10\ng1 y10\ng1 x0\ng1 y0")
+        gcode.addBlockFromString("open", "g0 x20 y0\ng1 z-1\ng1 x30\ng1 y10")
+        blocks = [0, 1]
+        msg = gcode.profile(blocks, 1.0, method=OFFSET_POLYGON)
+        self.assertIn("'open' is OPEN", msg)
+        self.assertEqual(len(blocks), 1)
+        self.assertTrue(gcode.blocks[1].enable)
+        path = gcode.toPath(blocks[0])[0]
+        self.assertTrue(path.isClosed())
+        self.assertAlmostEqual(area(path), 140.0 + math.pi, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
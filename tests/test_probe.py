@@ -0,0 +1,83 @@
+import gettext
+import math
+import os
+import re
+import sys
+import unittest
+
+BCNC = os.path.join(os.path.dirname(__file__), "..", "bCNC")
+sys.path[:0] = [BCNC, os.path.join(BCNC, "lib")]
+gettext.install(True, localedir=None)
+
+from CNC import CNC, Probe  # noqa: E402
+
+MOVEPAT = re.compile(r"G0X(\S+)Y(\S+)")
+RETRACTPAT = re.compile(r"G0Z(\S+)")
+
+
+def surface(x, y):
+    return 2.0 * math.sin(x / 20.0) * math.cos(y / 25.0) + 0.01 * x
+
+
+class AdaptiveScanTest(unittest.TestCase):
+    def setUp(self):
+        CNC.vars["state"] = "Idle"
+        self.probe = Probe()
+        self.probe.xmin = self.probe.ymin = 0.0
+        self.probe.xmax = self.probe.ymax = 140.0
+        self.probe.xn = self.probe.yn = 15
+        self.probe.zmin = -10.0
+        self.probe.zmax = 10.0
+
+    def tearDown(self):
+        CNC.vars["state"] = "Idle"
+
+    # @return (moves, lowered retracts, lowest clearance over the surface)
+    def scan(self, surf):
+        x = y = 0.0
+        z = self.probe.zmax
+        moves = lowered = 0
+        clearance = float("inf")
+        for line in self.probe.scanAdaptive(0.05, 1.0):
+            if line is None:
+                continue
+            match = RETRACTPAT.match(line)
+            if match:
+                z = float(match.group(1))
+                continue
+            match = MOVEPAT.match(line)
+            if match:
+                nx, ny = float(match.group(1)), float(match.group(2))
+                for k in range(51):
+                    t = k / 50.0
+                    height = surf(x + t * (nx - x), y + t * (ny - y))
+                    clearance = min(clearance, z - height)
+                moves += 1
+                if z < self.probe.zmax:
+                    lowered += 1
+                x, y = nx, ny
+            elif line.startswith(CNC.vars["prbcmd"]):
+                self.probe.add(x, y, surf(x, y))
+        return moves, lowered, clearance
+
+    def test_retract(self):
+        moves, lowered, clearance = self.scan(surface)
+        self.assertFalse(self.probe.isEmpty())
+        # the moves between probed points retract only above them
+        self.assertGreater(lowered, moves // 2)
+        self.assertGreater(clearance, 0.0)
+
+    def test_alarm(self):
+        # GRBL 1.1 reports a failed probe as the Alarm state
+        scan = self.probe.scanAdaptive(0.05, 1.0)
+        for line in scan:
+            if line is None:
+                CNC.vars["state"] = "Alarm"
+                break
+        with self.assertRaises(Exception):
+            next(scan)
+        self.assertFalse(self.probe.start)
+
+
+if __name__ == "__main__":
+    unittest.main()
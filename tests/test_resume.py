@@ -0,0 +1,80 @@
+import copy
+import gettext
+import os
+import sys
+import unittest
+
+BCNC = os.path.join(os.path.dirname(__file__), "..", "bCNC")
+sys.path[:0] = [BCNC, os.path.join(BCNC, "lib")]
+gettext.install(True, localedir=None)
+
+from CNC import CNC, GCode  # noqa: E402
+
+PROGRAM = """G21 G90
+G0 X0 Y0 Z5
+M3 S1000
+G1 Z-1 F200
+G2 X10 Y0 I5 J0 F300
+M8
+X0 Y0 I-5 J0
+G91 G1 X1
+X1
+G93 G1 X1 F2
+X1 F3"""
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.gcode = GCode()
+        self.gcode.addBlockFromString("program", PROGRAM)
+
+    def resume(self, lid):
+        start = (0, lid)
+        cnc = self.gcode.resumeState(*start)
+        preamble = self.gcode.resumePreamble(cnc)
+        # compileIter() moves on the state given
+        lines = [line for line, path in
+                 self.gcode.compileIter(start, None, copy.copy(cnc))]
+        return cnc, preamble, lines[-(len(PROGRAM.splitlines()) - lid):]
+
+    def test_state(self):
+        cnc, preamble, lines = self.resume(6)
+        self.assertEqual(cnc.gcode, 2)
+        self.assertAlmostEqual(cnc.x, 10.0)
+        self.assertAlmostEqual(cnc.z, -1.0)
+        self.assertEqual(cnc.spindle, 3)
+        self.assertEqual(cnc.coolant, 8)
+        self.assertIn("M3 S1000", preamble)
+        self.assertIn("M8", preamble)
+
+    def test_arc(self):
+        # G2 alone is an error, it goes on the first resumed motion
+        for lid in (5, 6):
+            cnc, preamble, lines = self.resume(lid)
+            for line in preamble:
+                self.assertNotIn("G2", CNC.breakLine(line.upper()))
+            self.assertEqual(lines[-5], "G2X0Y0I-5J0\n")
+
+    def test_motion_word_kept(self):
+        cnc, preamble, lines = self.resume(7)
+        self.assertEqual(cnc.gcode, 2)
+        self.assertEqual(lines[0], "G91G1X1\n")
+
+    def test_incremental(self):
+        cnc, preamble, lines = self.resume(8)
+        self.assertFalse(cnc.absolute)
+        self.assertEqual(preamble[-1], "G1 G91")
+        self.assertEqual(preamble[-2], "g1 z-1 f300")
+        self.assertEqual(lines[0], "X1\n")
+
+    def test_inverse_time(self):
+        cnc, preamble, lines = self.resume(10)
+        self.assertEqual(cnc.feedmode, 93)
+        # the plunge can not use the inverse time feed
+        self.assertEqual(
+            preamble[-2], CNC.gline(z=-1.0, f=CNC.vars["cutfeedz"]))
+        self.assertEqual(preamble[-1], "G1 G91 G93")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import gettext
+import os
+import sys
+import unittest
+
+BCNC = os.path.join(os.path.dirname(__file__), "..", "bCNC")
+sys.path[:0] = [BCNC, os.path.join(BCNC, "lib")]
+gettext.install(True, localedir=None)
+
+import Telemetry  # noqa: E402
+from CNC import CNC, GCode  # noqa: E402
+
+
+class ProgramFeedsTest(unittest.TestCase):
+    def test_inverse_time(self):
+        feedmode = CNC.vars["feedmode"]
+        gcode = GCode()
+        gcode.addBlockFromString(
+            "program", "G1 X10 F600\nG93 G1 X20 F6\nG94 G1 X30 F300")
+        feeds = Telemetry.programFeeds(gcode)
+        self.assertEqual(feeds, {(0, 0): 600.0, (0, 2): 300.0})
+        # the feed mode shown by the gui is left alone
+        self.assertEqual(CNC.vars["feedmode"], feedmode)
+
+
+if __name__ == "__main__":
+    unittest.main()
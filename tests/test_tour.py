@@ -0,0 +1,142 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "bCNC", "lib"))
+
+import tour  # noqa: E402
+
+
+def brute(points, removed, x, y, n):
+    return sorted(
+        ((px - x) ** 2 + (py - y) ** 2, i)
+        for i, (px, py) in enumerate(points)
+        if i not in removed
+    )[:n]
+
+
+def rapids(order, flips, starts, ends):
+    flips = set(flips)
+    length = 0.0
+    for a, b in zip(order, order[1:]):
+        end = starts[a] if a in flips else ends[a]
+        start = ends[b] if b in flips else starts[b]
+        length += tour.Tour.dist(end, start)
+    return length
+
+
+def greedy(starts, ends):
+    order = [0]
+    left = list(range(1, len(starts)))
+    while left:
+        end = ends[order[-1]]
+        k = min(range(len(left)),
+                key=lambda k: tour.Tour.dist(end, starts[left[k]]))
+        order.append(left.pop(k))
+    return order
+
+
+class KDTreeTest(unittest.TestCase):
+    def test_nearest_and_remove(self):
+        rnd = random.Random(1)
+        points = [(rnd.random(), rnd.random()) for _ in range(300)]
+        tree = tour.KDTree(points)
+        removed = set()
+        for _ in range(290):
+            x, y = rnd.random(), rnd.random()
+            for n in (1, 3):
+                self.assertEqual(tree.nearest(x, y, n),
+                                 brute(points, removed, x, y, n))
+            i = rnd.randrange(len(points))
+            tree.remove(i)
+            tree.remove(i)  # removing twice is harmless
+            removed.add(i)
+            self.assertEqual(len(tree), len(points) - len(removed))
+
+    def test_duplicated_points(self):
+        tree = tour.KDTree([(1.0, 1.0)] * 5)
+        tree.remove(2)
+        self.assertEqual([i for d2, i in tree.nearest(1.0, 1.0, 5)],
+                         [0, 1, 3, 4])
+
+    def test_empty(self):
+        tree = tour.KDTree([])
+        self.assertEqual(len(tree), 0)
+        self.assertEqual(tree.nearest(0.0, 0.0), [])
+
+
+class TourTest(unittest.TestCase):
+    def blocks(self, n, seed, closed):
+        rnd = random.Random(seed)
+        starts = [(rnd.uniform(0, 300), rnd.uniform(0, 200))
+                  for _ in range(n)]
+        if closed:
+            ends = list(starts)
+        else:
+            ends = [(x + rnd.uniform(-10, 10), y + rnd.uniform(-10, 10))
+                    for x, y in starts]
+        return starts, ends
+
+    def check(self, order, flips, n, reversible):
+        self.assertEqual(order[0], 0)
+        self.assertEqual(sorted(order), list(range(n)))
+        self.assertEqual(len(set(flips)), len(flips))
+        for b in flips:
+            self.assertTrue(reversible[b])
+
+    def test_permutation(self):
+        for n in (0, 1, 2, 3, 10, 200):
+            for closed in (False, True):
+                for reverse in (False, True):
+                    starts, ends = self.blocks(n, n, closed)
+                    reversible = [reverse] * n
+                    order, flips = tour.optimize(
+                        starts, ends, reversible, 2.0)
+                    if n:
+                        self.check(order, flips, n, reversible)
+                    else:
+                        self.assertEqual(order, [])
+                    if closed:
+                        self.assertEqual(flips, [])
+
+    def test_some_reversible(self):
+        n = 200
+        starts, ends = self.blocks(n, 7, False)
+        reversible = [b % 3 == 0 for b in range(n)]
+        order, flips = tour.optimize(starts, ends, reversible, 2.0)
+        self.check(order, flips, n, reversible)
+
+    def test_moves_keep_permutation(self):
+        starts, ends = self.blocks(150, 3, False)
+        reversible = [b % 2 == 0 for b in range(150)]
+        t = tour.Tour(starts, ends, reversible)
+        t.nearestNeighbour()
+        neighbours = t._neighbours()
+        length = t.length()
+        for i in range(len(t.order) - 1):
+            for move in (t._twoOpt, t._orOpt):
+                if move(i, neighbours):
+                    # every accepted move shortens the tour
+                    self.assertLess(t.length(), length)
+                    length = t.length()
+                self.assertEqual(t.order[0], 0)
+                self.assertEqual(sorted(t.order), list(range(150)))
+                self.assertEqual(
+                    [t.pos[b] for b in t.order], list(range(150)))
+                for b in range(150):
+                    if t.flip[b]:
+                        self.assertTrue(t.free[b])
+
+    def test_shorter_than_greedy(self):
+        for closed in (False, True):
+            starts, ends = self.blocks(500, 11, closed)
+            order, flips = tour.optimize(starts, ends, [False] * 500, 5.0)
+            self.assertLess(
+                rapids(order, flips, starts, ends),
+                rapids(greedy(starts, ends), [], starts, ends))
+
+
+if __name__ == "__main__":
+    unittest.main()